@@ -1,11 +1,13 @@
 # api/routers/auth.py
-from fastapi import APIRouter, Request, Depends, HTTPException, Form
+from fastapi import APIRouter, Request, Depends, HTTPException, Form, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from datetime import datetime
+from typing import Optional
 import secrets
 from core.logger import api_logger as logger
 from db.beanie.models import Administrators
+from utils.streaming import FORMAT_PATTERN, parse_fields, stream_documents
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 templates = Jinja2Templates(directory="api/templates")
@@ -122,20 +124,34 @@ async def logout(request: Request):
 
 
 # API эндпоинты для отладки
+# Поля администратора, которые можно выбрать в fields= потокового режима (password и session_token не отдаются)
+ADMIN_STREAM_FIELDS = ("admin_id", "login", "is_active", "created_at")
+
+
 @router.get("/debug-admins")
-async def debug_admins():
-    """Посмотреть всех администраторов из базы"""
+async def debug_admins(
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+    fields: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """Посмотреть всех администраторов из базы (format=ndjson / array — потоково, fields — выбор полей)"""
+    if not admin:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    if format != "json":
+        cursor = Administrators.get_motor_collection().find({}, parse_fields(fields, ADMIN_STREAM_FIELDS))
+        return stream_documents(cursor, format)
+
     admins = await Administrators.all()
 
     result = []
-    for admin in admins:
+    for item in admins:
         result.append({
-            "id": str(admin.id),
-            "admin_id": admin.admin_id,
-            "login": admin.login,
-            "password": admin.password,
-            "is_active": admin.is_active,
-            "created_at": admin.created_at.isoformat() if admin.created_at else None
+            "id": str(item.id),
+            "admin_id": item.admin_id,
+            "login": item.login,
+            "is_active": item.is_active,
+            "created_at": item.created_at.isoformat() if item.created_at else None
         })
 
     return result
@@ -5,21 +5,29 @@ import time
 from typing import Dict, Any, Tuple
 import hashlib
 import json
-from aiogram.types import BufferedInputFile
 import time
 from typing import Union
 from fastapi import Query, HTTPException, Request, Depends
 import mimetypes
 from urllib.parse import quote
 from datetime import datetime, timezone
-from typing import Optional
+from typing import List, Optional
 from fastapi import Request, Query, Depends, APIRouter
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from api.router.auth import get_current_admin
-from core.bot1 import bot1
-from db.beanie_bot1.models import Messages, Users
+from core.bot1 import bot1, media
+from beanie import PydanticObjectId
+from bson import ObjectId
+from db.beanie_bot1.models import Messages, Users, ChatDeleteJob
+from utils.chat_archive import (
+    start_chat_delete_job, restore_chat, load_history, find_message
+)
 from utils.database import get_database_bot1
+from utils.outbound import outbound
+from utils.ingest_writer import reserve_message_ids
+from utils.uploads import spool_upload, send_upload_album
+from utils.user_context import publish_invalidation
 from fastapi.responses import JSONResponse
 from core.logger import api_logger as logger
 
@@ -124,21 +132,26 @@ async def chats_page(
 async def get_chat_history(
         user_id: int = Query(..., description="ID пользователя"),
         limit: int = Query(100, description="Лимит сообщений"),
+        before: Optional[datetime] = Query(None, description="Сообщения старше этой даты (прокрутка назад)"),
+        before_id: Optional[str] = Query(None, description="id последнего показанного сообщения с датой before"),
         admin=Depends(get_current_admin)
 ):
     """Получить историю сообщений с пользователем"""
     if not admin:
         return {"error": "Unauthorized"}
 
+    if before_id and not (before and ObjectId.is_valid(before_id)):
+        raise HTTPException(status_code=400, detail="before_id задаётся вместе с before и должен быть id сообщения")
+    before_oid = ObjectId(before_id) if before_id else None
+
     db = get_database_bot1()
     messages_collection = db["messages"]
 
-    # 1. СНАЧАЛА загружаем сообщения
-    messages_cursor = messages_collection.find(
-        {"from_id": user_id}
-    ).sort("date", -1).limit(limit)
+    if before and before.tzinfo:
+        before = before.astimezone(timezone.utc).replace(tzinfo=None)
 
-    messages_list = await messages_cursor.to_list(length=None)
+    # 1. СНАЧАЛА загружаем сообщения (старые периоды поднимаются из архива)
+    messages_list = await load_history(messages_collection, user_id, limit, before, before_oid)
 
     # 2. ПОТОМ помечаем как прочитанные
     unread_count = await messages_collection.count_documents({
@@ -197,11 +210,7 @@ async def get_chat_photo_stream(
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     try:
-        db = get_database_bot1()
-        messages_collection = db["messages"]
-
-        from bson import ObjectId
-        message = await messages_collection.find_one({"_id": ObjectId(message_id)})
+        message = await find_message(message_id)
 
         if not message or message.get("file_type") != "photo" or not message.get("file_id"):
             raise HTTPException(status_code=404, detail="Photo not found")
@@ -248,11 +257,7 @@ async def download_file_stream(
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     try:
-        db = get_database_bot1()
-        messages_collection = db["messages"]
-
-        from bson import ObjectId
-        message = await messages_collection.find_one({"_id": ObjectId(message_id)})
+        message = await find_message(message_id)
 
         if not message or not message.get("file_id"):
             raise HTTPException(status_code=404, detail="File not found")
@@ -320,11 +325,7 @@ async def download_file_simple(
     if not admin:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    db = get_database_bot1()
-    messages_collection = db["messages"]
-
-    from bson import ObjectId
-    message = await messages_collection.find_one({"_id": ObjectId(message_id)})
+    message = await find_message(message_id)
 
     if not message or not message.get("file_id"):
         raise HTTPException(status_code=404, detail="File not found")
@@ -396,16 +397,25 @@ async def send_operator_message(
 
         logger.info(f"✅ Помечены как прочитанные сообщения пользователя {user_id}")
 
-        telegram_success = await send_telegram_message(user_id, text)
-
         last_message = await messages_collection.find_one({}, sort=[("id", -1)])
         next_id = last_message["id"] + 1 if last_message else 1
+        # id из max(id)+1 может совпасть с id входящего сообщения (бот выдаёт их из counters),
+        # поэтому отложенная доставка находит запись по _id
+        message_oid = ObjectId()
+
+        # При временной ошибке сообщение уйдёт из очереди переотправки и пометка снимется
+        telegram_success = await send_telegram_message(user_id, text, on_delivered={
+            "collection": "messages",
+            "filter": {"_id": message_oid},
+            "update": {"$set": {"message_object": text}}
+        })
 
         message_text = text
         if not telegram_success:
             message_text = text + " (не доставлено)"
 
         message_data = {
+            "_id": message_oid,
             "from_id": user_id,
             "message_object": message_text,
             "checked": "1",
@@ -465,42 +475,50 @@ async def send_operator_file(
         if user and user.get("banned") == "1":
             raise HTTPException(status_code=403, detail="Пользователь заблокирован")
 
-        # 2. Чтение файла
-        contents = await file.read()
-        file_size = len(contents)
-        if file_size > 50 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="Файл слишком большой (макс. 50MB)")
-
         filename = file.filename or f"file_{int(time.time())}"
         mime_type = file.content_type or "application/octet-stream"
-        input_file = BufferedInputFile(contents, filename=filename)
+        short_caption = caption[:1024] or None
 
-        # 3. Отправка в Telegram
         file_type = "document"
         file_id = ""
         msg = None
 
-        try:
-            if mime_type.startswith("image/"):
-                msg = await bot1.send_photo(chat_id=user_id, photo=input_file, caption=caption[:1024] or None)
-                file_type = "photo"
-                file_id = msg.photo[-1].file_id if msg.photo else ""
-            elif mime_type.startswith("video/"):
-                msg = await bot1.send_video(chat_id=user_id, video=input_file, caption=caption[:1024] or None)
-                file_type = "video"
-                file_id = msg.video.file_id if msg.video else ""
-            elif mime_type.startswith("audio/"):
-                msg = await bot1.send_audio(chat_id=user_id, audio=input_file, caption=caption[:1024] or None)
-                file_type = "audio"
-                file_id = msg.audio.file_id if msg.audio else ""
-            else:
-                msg = await bot1.send_document(chat_id=user_id, document=input_file, caption=caption[:1024] or None)
-                file_type = "document"
-                file_id = msg.document.file_id if msg.document else ""
-        except Exception as e:
-            logger.error(f"❌ Telegram отправка не удалась: {e}")
-            # Не прерываем — сохраним как "не доставлено", как в send/
-            pass
+        # 2-3. Отправка в Telegram
+        async with spool_upload(file, filename) as upload:
+            file_size = upload.size
+            try:
+                if mime_type.startswith("image/"):
+                    msg = await media.send_upload(
+                        lambda photo: outbound.send("bot1", "send_photo", user_id, photo=photo, caption=short_caption),
+                        upload, "photo"
+                    )
+                    file_type = "photo"
+                    file_id = msg.photo[-1].file_id if msg.photo else ""
+                elif mime_type.startswith("video/"):
+                    msg = await media.send_upload(
+                        lambda video: outbound.send("bot1", "send_video", user_id, video=video, caption=short_caption),
+                        upload, "video"
+                    )
+                    file_type = "video"
+                    file_id = msg.video.file_id if msg.video else ""
+                elif mime_type.startswith("audio/"):
+                    msg = await media.send_upload(
+                        lambda audio: outbound.send("bot1", "send_audio", user_id, audio=audio, caption=short_caption),
+                        upload, "audio"
+                    )
+                    file_type = "audio"
+                    file_id = msg.audio.file_id if msg.audio else ""
+                else:
+                    msg = await media.send_upload(
+                        lambda document: outbound.send("bot1", "send_document", user_id, document=document, caption=short_caption),
+                        upload, "document"
+                    )
+                    file_type = "document"
+                    file_id = msg.document.file_id if msg.document else ""
+            except Exception as e:
+                logger.error(f"❌ Telegram отправка не удалась: {e}")
+                # Не прерываем — сохраним как "не доставлено", как в send/
+                pass
 
         # 4. Генерация next_id — КАК В send/ !
         messages_collection = db["messages"]
@@ -550,15 +568,88 @@ async def send_operator_file(
         raise HTTPException(status_code=500, detail=f"Не удалось отправить файл: {str(e)}")
 
 
+@router.post("/chats/send/files/")
+async def send_operator_files(
+    user_id: int = Form(...),
+    files: List[UploadFile] = File(...),
+    caption: str = Form(""),
+    admin=Depends(get_current_admin)
+):
+    """
+    Отправка нескольких файлов (от 2 до 10) одним альбомом: один send_media_group,
+    одна запись insert_many в messages и одно обновление диалога
+    """
+    if not admin:
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
-async def send_telegram_message(user_id: int, text: str) -> bool:
-    """Отправить сообщение пользователю через Telegram Bot API"""
     try:
-        await bot1.send_message(
-            chat_id=user_id,
-            text=text
+        db = get_database_bot1()
+        user = await db["users"].find_one({"id": user_id})
+        if user and user.get("banned") == "1":
+            raise HTTPException(status_code=403, detail="Пользователь заблокирован")
+
+        file_type, items = await send_upload_album(
+            media, lambda group: outbound.send("bot1", "send_media_group", user_id, media=group), files, caption
         )
-        return True
+
+        messages_collection = db["messages"]
+        # id из того же счётчика, что и у входящих сообщений: блок max(id)+1 мог бы с ними пересечься
+        message_ids = await reserve_message_ids(len(items))
+
+        now = datetime.now(timezone.utc)
+        message_docs = []
+        for item, message_id in zip(items, message_ids):
+            message_docs.append({
+                "from_id": user_id,
+                "message_object": item.text("" if file_type == "photo" else f"📎 {item.upload.filename}"),
+                "checked": "1",
+                "date": now,
+                "file_id": item.file_id,
+                "file_type": file_type,
+                "from_operator": "1",
+                "id": message_id,
+                "file_name": item.upload.filename,
+                "file_size": item.upload.size,
+                "mime_type": item.mime_type
+            })
+
+        await messages_collection.insert_many(message_docs, ordered=True)
+        await db.chat_dialogs.update_one(
+            {"user_id": user_id},
+            {
+                "$set": {
+                    "last_message_text": message_docs[-1]["message_object"][:200],
+                    "last_message_date": now,
+                    "last_message_type": file_type,
+                },
+                "$inc": {"message_count": len(message_docs)}
+            },
+            upsert=True
+        )
+
+        return {
+            "ok": True,
+            "message_ids": [doc["id"] for doc in message_docs],
+            "file_type": file_type,
+            "delivered": any(item.delivered for item in items)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки альбома: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Не удалось отправить файлы: {str(e)}")
+
+
+
+async def send_telegram_message(user_id: int, text: str, on_delivered: dict = None) -> bool:
+    """
+    Отправить сообщение пользователю через Telegram Bot API.
+    False — не доставлено сейчас (при временной ошибке сообщение ждёт в очереди переотправки)
+    """
+    try:
+        msg = await outbound.send_or_queue("bot1", "send_message", user_id, on_delivered=on_delivered, text=text)
+        return msg is not None
 
     except Exception as e:
         logger.error(f"❌ Ошибка отправки в Telegram пользователю {user_id}: {e}")
@@ -592,6 +683,7 @@ async def ban_user_chat(
             {"id": user_id},
             {"$set": {"banned": "1"}}
         )
+        await publish_invalidation("bot1", user_id)
 
         if result.modified_count > 0:
 
@@ -625,6 +717,7 @@ async def unban_user_chat(
             {"id": user_id},
             {"$set": {"banned": "0"}}
         )
+        await publish_invalidation("bot1", user_id)
 
         if result.modified_count > 0:
 
@@ -642,33 +735,89 @@ async def delete_chat(
         request: Request,
         admin=Depends(get_current_admin)
 ):
+    """Ставит удаление чата в фоновую задачу и сразу возвращает её ID"""
     if not admin:
         return JSONResponse({"ok": False, "error": "Не авторизован"})
 
     try:
         data = await request.json()
         user_id = data.get("user_id")
+        archive = bool(data.get("archive", False))
 
         if not user_id:
             return JSONResponse({"ok": False, "error": "Не указан user_id"})
 
-        db = get_database_bot1()
-        messages_collection = db["messages"]
-        dialogs_collection = db["chat_dialogs"]
+        job = await start_chat_delete_job(int(user_id), archive=archive)
+
+        return JSONResponse({
+            "ok": True,
+            "message": f"Чат с пользователем {user_id} поставлен в очередь на удаление",
+            "job_id": str(job.id),
+            "archive": archive
+        })
 
-        # --- 1. Удаляем все сообщения ---
-        msg_result = await messages_collection.delete_many({"from_id": user_id})
+    except Exception as e:
+        logger.error(f"❌ Ошибка удаления чата: {e}", exc_info=True)
+        return JSONResponse({"ok": False, "error": str(e)})
 
-        # --- 2. Удаляем summary чата ---
-        dialog_result = await dialogs_collection.delete_one({"user_id": user_id})
+
+@router.get("/chats/delete/status/{job_id}")
+async def delete_chat_status(
+        job_id: str,
+        admin=Depends(get_current_admin)
+):
+    """Статус фоновой задачи удаления чата"""
+    if not admin:
+        return JSONResponse({"ok": False, "error": "Не авторизован"})
+
+    try:
+        job = await ChatDeleteJob.get(PydanticObjectId(job_id))
+    except Exception:
+        job = None
+
+    if not job:
+        return JSONResponse({"ok": False, "error": "Задача не найдена"})
+
+    return JSONResponse({
+        "ok": True,
+        "job_id": str(job.id),
+        "user_id": job.user_id,
+        "status": job.status,
+        "deleted_messages": job.deleted_messages,
+        "archive": job.archive,
+        "restored": job.restored,
+        "error": job.error
+    })
+
+
+@router.post("/chats/restore/")
+async def restore_chat_from_archive(
+        request: Request,
+        admin=Depends(get_current_admin)
+):
+    """Восстановить удалённый чат из архива"""
+    if not admin:
+        return JSONResponse({"ok": False, "error": "Не авторизован"})
+
+    try:
+        data = await request.json()
+        job = await ChatDeleteJob.get(PydanticObjectId(data.get("job_id")))
+        if not job:
+            return JSONResponse({"ok": False, "error": "Задача не найдена"})
+
+        if job.status != "done":
+            return JSONResponse({"ok": False, "error": "Удаление ещё не завершено"})
+
+        restored = await restore_chat(job)
 
         return JSONResponse({
             "ok": True,
-            "message": f"Чат с пользователем {user_id} удалён",
-            "deleted_messages": msg_result.deleted_count,
-            "dialog_removed": dialog_result.deleted_count > 0
+            "message": f"Чат с пользователем {job.user_id} восстановлен",
+            "restored_messages": restored
         })
 
+    except FileNotFoundError as e:
+        return JSONResponse({"ok": False, "error": str(e)})
     except Exception as e:
-        logger.error(f"❌ Ошибка удаления чата: {e}", exc_info=True)
+        logger.error(f"❌ Ошибка восстановления чата: {e}", exc_info=True)
         return JSONResponse({"ok": False, "error": str(e)})
@@ -15,10 +15,13 @@ from fastapi.responses import Response, RedirectResponse
 from api.router.auth import get_current_admin
 from api.schemas.response import ClaimResponse, ChatMessageSchema, CloseChatRequest
 from fastapi import Form, UploadFile, File
-from core.bot import bot
+from core.bot import bot, media
 from db.beanie.models import Claim, UserMessage, ChatSession, User, AdminMessage
 from db.beanie.models.models import ChatMessage, KonsolPayment, SupportSession
 from utils.konsol_client import konsol_client
+from utils.outbound import outbound
+from utils.uploads import spool_upload, send_upload_album
+from utils.user_context import publish_invalidation
 
 router = APIRouter(prefix="/claims", tags=["Claims"])
 templates = Jinja2Templates(directory="api/templates")
@@ -358,6 +361,7 @@ async def start_chat_session(data: dict):
             has_unanswered=False
         )
         await session.insert()
+        await publish_invalidation("bot", claim.user_id)
 
 
 
@@ -423,22 +427,31 @@ async def send_chat_message_endpoint(data: dict):
             )
             raise HTTPException(status_code=409, detail=warning_msg)  # 409 Conflict
 
+        message_id = PydanticObjectId()
+        # При временной ошибке сообщение уйдёт из очереди переотправки и пометка снимется
+        on_delivered = {
+            "collection": "chat_messages",
+            "filter": {"_id": message_id},
+            "update": {"$set": {"message": text}}
+        }
         if has_photo and photo_file_id:
             logger.info(f"📸 [ChatSend] Отправка фото: file_id={photo_file_id}")
-            await bot.send_photo(
-                chat_id=claim.user_id,
+            sent = await outbound.send_or_queue(
+                "bot", "send_photo", claim.user_id,
+                on_delivered=on_delivered,
                 photo=photo_file_id,
                 caption=text if text else None
             )
         else:
             logger.info(f"💬 [ChatSend] Отправка текста: '{text}'")
-            await bot.send_message(chat_id=claim.user_id, text=text)
+            sent = await outbound.send_or_queue("bot", "send_message", claim.user_id, on_delivered=on_delivered, text=text)
 
         msg = ChatMessage(
+            id=message_id,
             session_id=claim_id,
             claim_id=claim_id,
             user_id=claim.user_id,
-            message=text,
+            message=text if sent else f"{text} (не доставлено)",
             is_bot=is_bot,
             has_photo=has_photo,
             photo_file_id=photo_file_id,
@@ -453,7 +466,7 @@ async def send_chat_message_endpoint(data: dict):
             session.has_unanswered = False
             await session.save()
 
-        return {"ok": True, "message_id": str(msg.id)}
+        return {"ok": True, "message_id": str(msg.id), "delivered": sent is not None}
 
     except HTTPException:
         raise
@@ -463,7 +476,6 @@ async def send_chat_message_endpoint(data: dict):
         raise HTTPException(status_code=500, detail=error_msg)
 
 
-from aiogram.types import BufferedInputFile
 import mimetypes
 from datetime import datetime
 
@@ -486,36 +498,32 @@ async def send_chat_file_endpoint(
     if active_support:
         raise HTTPException(409, "У пользователя есть открытая сессия в техподдержке")
 
-    contents = await file.read()
-    if len(contents) > 50 * 1024 * 1024:
-        raise HTTPException(400, "Файл слишком большой (макс. 50 МБ)")
-
     filename = file.filename or "file"
     mime_type = file.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
-    input_file = BufferedInputFile(contents, filename=filename)
+    short_caption = caption[:1024] or None
 
     file_id = ""
     is_photo = False
     msg = None
-    try:
-        if mime_type.startswith("image/"):
-            msg = await bot.send_photo(
-                chat_id=claim.user_id,
-                photo=input_file,
-                caption=caption[:1024] or None
-            )
-            file_id = msg.photo[-1].file_id if msg.photo else ""
-            is_photo = True
-        else:
-            msg = await bot.send_document(
-                chat_id=claim.user_id,
-                document=input_file,
-                caption=caption[:1024] or None
-            )
-            file_id = msg.document.file_id if msg.document else ""
-    except Exception as e:
-        logger.error(f"❌ Telegram send failed: {e}")
-        caption += " (не доставлено)"
+    async with spool_upload(file, filename) as upload:
+        try:
+            # Тот же файл повторно — по file_id, без загрузки
+            if mime_type.startswith("image/"):
+                msg = await media.send_upload(
+                    lambda photo: outbound.send("bot", "send_photo", claim.user_id, photo=photo, caption=short_caption),
+                    upload, "photo"
+                )
+                file_id = msg.photo[-1].file_id if msg.photo else ""
+                is_photo = True
+            else:
+                msg = await media.send_upload(
+                    lambda document: outbound.send("bot", "send_document", claim.user_id, document=document, caption=short_caption),
+                    upload, "document"
+                )
+                file_id = msg.document.file_id if msg.document else ""
+        except Exception as e:
+            logger.error(f"❌ Telegram send failed: {e}")
+            caption += " (не доставлено)"
 
     chat_msg = ChatMessage(
         session_id=claim_id,
@@ -542,6 +550,69 @@ async def send_chat_file_endpoint(
         "file_type": "photo" if is_photo else "document"
     }
 
+
+@router.post("/chat/send-files")
+async def send_chat_files_endpoint(
+    claim_id: str = Form(...),
+    files: List[UploadFile] = File(...),
+    caption: str = Form(""),
+    admin=Depends(get_current_admin)
+):
+    """Несколько файлов (от 2 до 10) одним альбомом: один send_media_group, один insert_many, одно обновление сессии"""
+    if not admin:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    try:
+        claim = await Claim.find_one({"claim_id": claim_id})
+        if not claim:
+            raise HTTPException(404, "Claim not found")
+
+        active_support = await SupportSession.find_one(
+            SupportSession.user_id == claim.user_id,
+            SupportSession.resolved == False
+        )
+        if active_support:
+            raise HTTPException(409, "У пользователя есть открытая сессия в техподдержке")
+
+        kind, items = await send_upload_album(
+            media, lambda group: outbound.send("bot", "send_media_group", claim.user_id, media=group), files, caption
+        )
+        is_photo = kind == "photo"
+
+        now = datetime.now()
+        chat_messages = [
+            ChatMessage(
+                session_id=claim_id,
+                claim_id=claim_id,
+                user_id=claim.user_id,
+                message=item.text(item.upload.filename),
+                is_bot=True,
+                has_photo=is_photo,
+                photo_file_id=item.file_id,
+                photo_caption=item.text() if is_photo else None,
+                timestamp=now
+            )
+            for item in items
+        ]
+        result = await ChatMessage.insert_many(chat_messages)
+
+        await ChatSession.find_one({"claim_id": claim_id}).update(
+            {"$set": {"last_interaction": now, "has_unanswered": False}}
+        )
+
+        return {
+            "ok": True,
+            "message_ids": [str(message_id) for message_id in result.inserted_ids],
+            "file_type": kind,
+            "delivered": any(item.delivered for item in items)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки альбома по заявке {claim_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
+
 @router.get("/chat/photo-url/{message_id}")
 async def get_chat_photo_url(message_id: str):
     """
@@ -799,8 +870,8 @@ async def process_claim_approval_admin(claim: Claim):
             )
 
             try:
-                await bot.send_message(
-                    chat_id=claim.user_id,
+                await outbound.send_or_queue(
+                    "bot", "send_message", claim.user_id,
                     text="✅ Ваш выигрыш отправлен на указанные реквизиты.\nКомпания Pure желает вам крепкого здоровья и отличного дня!"
                 )
                 logger.info(f"✅ [ADMIN] Уведомление отправлено пользователю {claim.user_id}")
@@ -851,20 +922,19 @@ async def close_chat_session(claim_id: str, user_id: int = None):
             chat_session.has_unanswered = False
             chat_session.closed_at = datetime.now()
             await chat_session.save()
+            await publish_invalidation("bot", chat_session.user_id)
 
             logger.info(f"✅ Чат-сессия закрыта для заявки {claim_id}")
 
             if user_id:
                 try:
-                    await bot.send_message(
-                        chat_id=user_id,
+                    await outbound.send_or_queue(
+                        "bot", "send_message", user_id,
                         text="💬 Чат с администратором завершен."
                     )
                     logger.info(f"✅ Уведомление отправлено пользователю {user_id}")
                 except Exception as tg_error:
                     logger.error(f"❌ Ошибка отправки уведомления в Telegram: {tg_error}")
-                finally:
-                    await bot.session.close()
 
         else:
             logger.info(f"ℹ️ Активная чат-сессия не найдена для заявки {claim_id}")
@@ -885,7 +955,7 @@ async def notify_user_about_chat_close(user_id: int, claim_id: str):
 
         message = f"{status_messages.get('pending', '📋 Ваша заявка обработана')}\n\n💬 Чат с поддержкой завершен. Если у вас есть новые вопросы, создайте новую заявку."
 
-        await bot.send_message(chat_id=user_id, text=message)
+        await outbound.send_or_queue("bot", "send_message", user_id, text=message)
         logger.info(f"✅ Уведомление о закрытии чата отправлено пользователю {user_id}")
 
     except Exception as e:
@@ -943,6 +1013,7 @@ async def ban_user(data: dict):
             return {"ok": False, "error": "Пользователь уже заблокирован"}
 
         await user.update(banned=True)
+        await publish_invalidation("bot", user.tg_id)
 
         logger.warning(f"🚫 Пользователь заблокирован {user_id} через админ-панель")
 
@@ -976,6 +1047,7 @@ async def unban_user(data: dict):
             return {"ok": False, "error": "Пользователь не заблокирован"}
 
         await user.update(banned=False)
+        await publish_invalidation("bot", user.tg_id)
 
         logger.warning(f"✅ Пользователь разблокирован {user_id} через админ-панель")
 
@@ -0,0 +1,203 @@
+import asyncio
+import re
+import time
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from api.router.auth import get_current_admin
+from core.logger import api_logger as logger
+from db.beanie.models import Claim, KonsolPayment, SupportSession, User
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+# Результатов в каждой группе
+SEARCH_LIMIT = 20
+
+USER_FIELDS = {"_id": 0, "tg_id": 1, "username": 1, "banned": 1, "created_at": 1}
+CLAIM_FIELDS = {
+    "_id": 0, "claim_id": 1, "user_id": 1, "code": 1, "claim_status": 1, "process_status": 1,
+    "payment_method": 1, "phone": 1, "card_last4": 1, "amount": 1, "created_at": 1
+}
+PAYMENT_FIELDS = {
+    "konsol_id": 1, "claim_id": 1, "user_id": 1, "status": 1, "amount": 1,
+    "bank_details_kind": 1, "phone_number": 1, "created_at": 1, "paid_at": 1
+}
+SUPPORT_FIELDS = {"user_id": 1, "state": 1, "resolved": 1, "created_at": 1, "rollback_count": 1}
+
+
+def classify_query(query: str) -> Dict[str, Any]:
+    """
+    Определяет, чем может быть строка поиска, и возвращает значения для точного поиска по каждому виду:
+    tg_id, claim_id, phone, card, card_last4, code, username.
+    Одна строка может подходить под несколько видов (например, 6 цифр — и номер заявки, и tg_id).
+    """
+    query = query.strip()
+    kinds: Dict[str, Any] = {}
+    if not query:
+        return kinds
+
+    digits = re.sub(r"[\s()+-]", "", query)
+    if digits.isdigit():
+        if len(digits) == 4:
+            kinds["card_last4"] = digits
+        if len(digits) == 16:
+            kinds["card"] = digits
+        if len(digits) == 11 and digits[0] in "78":
+            # В заявках телефон хранится как ввёл пользователь: +7XXXXXXXXXX или 8XXXXXXXXXX
+            kinds["phone"] = [f"+7{digits[1:]}", f"8{digits[1:]}", f"7{digits[1:]}"]
+        elif len(digits) == 10 and digits[0] == "9":
+            kinds["phone"] = [f"+7{digits}", f"8{digits}", f"7{digits}"]
+        if len(digits) <= 6:
+            kinds["claim_id"] = digits.zfill(6)
+        if len(digits) <= 19 and query.isdigit():
+            kinds["tg_id"] = int(digits)
+
+    # Код с голограммы — как ввёл пользователь, регистр может отличаться
+    if " " not in query and not query.startswith("@"):
+        kinds["code"] = list(dict.fromkeys([query, query.upper(), query.lower()]))
+
+    username = query.lstrip("@")
+    if re.fullmatch(r"[A-Za-z0-9_]{3,32}", username) and not username.isdigit():
+        kinds["username"] = username
+    return kinds
+
+
+def username_prefix_query(value: str) -> dict:
+    """
+    Поиск username по префиксу без учёта регистра: регулярка с ^ и без флага i
+    по username_lower идёт по индексу как диапазон
+    """
+    return {"username_lower": re.compile("^" + re.escape(value.lower()))}
+
+
+async def _find(model, conditions: List[dict], projection: dict) -> List[dict]:
+    if not conditions:
+        return []
+    query = conditions[0] if len(conditions) == 1 else {"$or": conditions}
+    return await model.get_motor_collection().find(query, projection).sort(
+        "created_at", -1
+    ).limit(SEARCH_LIMIT).to_list(length=None)
+
+
+async def search_users(kinds: Dict[str, Any]) -> List[dict]:
+    conditions = []
+    if "tg_id" in kinds:
+        conditions.append({"tg_id": kinds["tg_id"]})
+    if "username" in kinds:
+        conditions.append(username_prefix_query(kinds["username"]))
+    return await _find(User, conditions, USER_FIELDS)
+
+
+async def search_claims(kinds: Dict[str, Any]) -> List[dict]:
+    conditions = []
+    if "claim_id" in kinds:
+        conditions.append({"claim_id": kinds["claim_id"]})
+    if "tg_id" in kinds:
+        conditions.append({"user_id": kinds["tg_id"]})
+    if "phone" in kinds:
+        conditions.append({"phone": {"$in": kinds["phone"]}})
+    if "card" in kinds:
+        conditions.append({"card": kinds["card"]})
+    if "card_last4" in kinds:
+        conditions.append({"card_last4": kinds["card_last4"]})
+    if "code" in kinds:
+        conditions.append({"code": {"$in": kinds["code"]}})
+    return await _find(Claim, conditions, CLAIM_FIELDS)
+
+
+async def search_payments(kinds: Dict[str, Any]) -> List[dict]:
+    conditions = []
+    if "claim_id" in kinds:
+        conditions.append({"claim_id": kinds["claim_id"]})
+    if "tg_id" in kinds:
+        conditions.append({"user_id": kinds["tg_id"]})
+    if "phone" in kinds:
+        conditions.append({"phone_number": {"$in": kinds["phone"]}})
+    if "card" in kinds:
+        conditions.append({"card_number": kinds["card"]})
+    return await _find(KonsolPayment, conditions, PAYMENT_FIELDS)
+
+
+async def search_support_sessions(kinds: Dict[str, Any]) -> List[dict]:
+    conditions = []
+    if "tg_id" in kinds:
+        conditions.append({"user_id": kinds["tg_id"]})
+    return await _find(SupportSession, conditions, SUPPORT_FIELDS)
+
+
+def _serialize(document: dict) -> dict:
+    if "_id" in document:
+        document["id"] = str(document.pop("_id"))
+    if "amount" in document:
+        document["amount"] = str(document["amount"])
+    return document
+
+
+@router.get("/api")
+async def universal_search(
+    q: str = Query(..., min_length=1, max_length=64),
+    admin=Depends(get_current_admin)
+):
+    """
+    Единый поиск для поддержки: телефон, последние 4 цифры карты, код, номер заявки, username или tg_id.
+    Строка классифицируется, и по каждому подходящему виду выполняется точный или префиксный
+    поиск по индексу — одновременно в пользователях, заявках, платежах и обращениях.
+    """
+    if not admin:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    started = time.perf_counter()
+    kinds = classify_query(q)
+
+    users, claims, payments, support_sessions = await asyncio.gather(
+        search_users(kinds),
+        search_claims(kinds),
+        search_payments(kinds),
+        search_support_sessions(kinds)
+    )
+
+    # Платежи по найденным заявкам (например, поиск по 4 цифрам карты)
+    found_payment_claims = {payment.get("claim_id") for payment in payments}
+    linked_claim_ids = [claim["claim_id"] for claim in claims if claim["claim_id"] not in found_payment_claims]
+    if linked_claim_ids and len(payments) < SEARCH_LIMIT:
+        payments += await _find(KonsolPayment, [{"claim_id": {"$in": linked_claim_ids}}], PAYMENT_FIELDS)
+
+    took_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"🔎 Поиск '{q}' ({', '.join(kinds) or '—'}): {took_ms} мс")
+
+    return {
+        "query": q,
+        "kinds": list(kinds),
+        "results": {
+            "users": [_serialize(document) for document in users],
+            "claims": [_serialize(document) for document in claims],
+            "payments": [_serialize(document) for document in payments[:SEARCH_LIMIT]],
+            "support_sessions": [_serialize(document) for document in support_sessions],
+        },
+        "took_ms": took_ms
+    }
+
+
+async def backfill_username_lower() -> int:
+    """Заполняет username_lower у пользователей, созданных до появления поля; повторный запуск ничего не меняет"""
+    result = await User.get_motor_collection().update_many(
+        {"username": {"$nin": [None, ""]}, "username_lower": None},
+        [{"$set": {"username_lower": {"$toLower": "$username"}}}]
+    )
+    if result.modified_count:
+        logger.info(f"✅ username_lower заполнен у {result.modified_count} пользователей")
+    return result.modified_count
+
+
+async def backfill_card_last4() -> int:
+    """Заполняет card_last4 у заявок, созданных до появления поля; повторный запуск ничего не меняет"""
+    result = await Claim.get_motor_collection().update_many(
+        {"card": {"$nin": [None, ""]}, "card_last4": None},
+        [{"$set": {"card_last4": {"$substrCP": [
+            "$card", {"$subtract": [{"$strLenCP": "$card"}, 4]}, 4
+        ]}}}]
+    )
+    if result.modified_count:
+        logger.info(f"✅ card_last4 заполнен у {result.modified_count} заявок")
+    return result.modified_count
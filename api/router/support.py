@@ -1,26 +1,32 @@
 import re
 
-from aiogram.types import BufferedInputFile, InputFile
+from aiogram.types import InputFile
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Request, Depends, Form, UploadFile, File
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from typing import Optional
+from typing import List, Optional
 from urllib.parse import quote
 import httpx
 from fastapi.responses import StreamingResponse
 from bson import ObjectId
 from bson.errors import InvalidId
 import mimetypes
-from fastapi import HTTPException
+from fastapi import HTTPException, Query
 from bot.templates.user import reg as treg
 from bot.templates.user import menu as tmenu
 from api.router.auth import get_current_admin
-from core.bot import bot
+from api.router.search import username_prefix_query
+from core.bot import bot, media
 from core.logger import api_logger as logger
 from datetime import datetime
 from fastapi.templating import Jinja2Templates
 from db.beanie.models import SupportSession, SupportMessage, User
 from utils.database import get_database
+from utils.outbound import outbound
+from utils.streaming import FORMAT_PATTERN, parse_fields, stream_documents
+from utils.support_snapshot import compact_data, load_snapshot
+from utils.uploads import spool_upload, send_upload_album
+from utils.user_context import publish_invalidation
 
 router = APIRouter(prefix="/support", tags=["support"])
 templates = Jinja2Templates(directory="api/templates")
@@ -89,128 +95,161 @@ def translate_state_value(key: str, value: any) -> str:
         return str(value)
 
 
+# Сессий на странице дашборда
+DASHBOARD_PAGE_SIZE = 50
+# Полей сессии для списка: без вложенной копии FSM-данных (state_data.original_data) и previous_state_data
+DASHBOARD_PROJECTION = {"state_data.original_data": 0, "previous_state_data": 0}
+
+STATE_DATA_TRANSLATIONS = {
+    "claim_id": "ID заявки",
+    "entered_code": "Введенный код",
+    "photo_file_ids": "ID фото",
+    "review_text": "Текст отзыва",
+    "screenshot_received": "Скриншот получен",
+    "phone_card_message_id": "ID сообщения выбора оплаты",
+    "payment_method": "Способ оплаты",
+    "phone_number": "Номер телефона",
+    "bank": "Банк",
+    "card_number": "Номер карты",
+    "card": "Номер карты",
+    "original_state": "Исходное состояние",
+    "original_data": "Исходные данные"
+}
+
+
+def encode_cursor(session: dict) -> str:
+    """Курсор страницы — created_at и _id последней показанной сессии"""
+    return f"{session['created_at'].isoformat()}|{session['_id']}"
+
+
+def cursor_filter(cursor: str) -> dict:
+    """Сессии после курсора в порядке (created_at, _id) по убыванию"""
+    try:
+        created_at, session_id = cursor.split("|", 1)
+        created_at = datetime.fromisoformat(created_at)
+        session_id = ObjectId(session_id)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": session_id}}
+    ]}
+
+
+def state_data_preview(state_data: dict) -> dict:
+    preview_data = {}
+    for key, value in state_data.items():
+        if isinstance(value, (dict, list)) and not (key == "photo_file_ids" and isinstance(value, list)):
+            continue
+
+        translated_key = STATE_DATA_TRANSLATIONS.get(key, key)
+        formatted_value = translate_state_value(key, value)
+
+        if formatted_value and formatted_value not in ['', 'None', '[]', '{}'] and len(formatted_value) < 100:
+            preview_data[translated_key] = formatted_value
+    return preview_data
+
+
 @router.get("/", response_class=HTMLResponse)
 async def support_dashboard(
     request: Request,
     resolved: bool = False,
     search: Optional[str] = None,
+    cursor: Optional[str] = None,
     admin=Depends(get_current_admin)
 ):
-    """Главная страница техподдержки со списком сессий"""
+    """
+    Главная страница техподдержки со списком сессий.
+    Постранично (курсор по created_at), без сырых state_data; превью строятся только для страницы
+    """
     if not admin:
         return RedirectResponse("/auth/login")
 
     query = {"resolved": resolved}
 
-    sessions = []
-
     #  ПОИСК
     if search:
         search = search.strip()
+        user_ids = []
         # --- Поиск по ID ---
-        if not sessions and re.fullmatch(r"\d{1,19}", search):
+        if re.fullmatch(r"\d{1,19}", search):
             tg_id = int(search)
-
-            sessions = await SupportSession.find({
-                "resolved": resolved,
-                "user_id": tg_id
-            }).sort("-created_at").to_list()
+            if await SupportSession.find_one({"resolved": resolved, "user_id": tg_id}):
+                user_ids = [tg_id]
 
         # --- Поиск по username ---
-        if not sessions:
+        if not user_ids:
             try:
-                safe_search = re.escape(search)
-                pattern = f".*{safe_search}.*"
-
-                users = await User.find(
-                    {"username": {"$regex": pattern, "$options": "i"}}
-                ).to_list()
+                # Начало username без учёта регистра — по индексу username_lower
+                users = await User.get_motor_collection().find(
+                    username_prefix_query(search.lstrip("@")),
+                    {"tg_id": 1}
+                ).to_list(length=None)
             except Exception as e:
                 logger.error(f"Regex error: {e}")
                 users = []
 
-            user_ids = [u.tg_id for u in users]
+            user_ids = [u["tg_id"] for u in users]
 
-            if user_ids:
-                sessions = await SupportSession.find({
-                    "resolved": resolved,
-                    "user_id": {"$in": user_ids}
-                }).sort("-created_at").to_list()
+        query["user_id"] = {"$in": user_ids}
 
+    collection = SupportSession.get_motor_collection()
+    total_sessions = await collection.count_documents(query)
 
-    else:
-        sessions = await SupportSession.find(query).sort("-created_at").to_list()
+    page_query = {**query, **cursor_filter(cursor)} if cursor else query
+    # На одну больше — чтобы понять, есть ли следующая страница
+    sessions = await collection.find(page_query, DASHBOARD_PROJECTION).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(DASHBOARD_PAGE_SIZE + 1).to_list(length=None)
 
-    total_sessions = len(sessions)
-    user_ids = [session.user_id for session in sessions]
+    next_cursor = None
+    if len(sessions) > DASHBOARD_PAGE_SIZE:
+        sessions = sessions[:DASHBOARD_PAGE_SIZE]
+        next_cursor = encode_cursor(sessions[-1])
 
-    users = await User.find({"tg_id": {"$in": user_ids}}).to_list()
-    users_map = {user.tg_id: user for user in users}
+    user_ids = [session["user_id"] for session in sessions]
+    users = await User.get_motor_collection().find(
+        {"tg_id": {"$in": user_ids}},
+        {"tg_id": 1, "username": 1, "first_name": 1, "last_name": 1, "banned": 1, "created_at": 1}
+    ).to_list(length=None)
+    users_map = {user["tg_id"]: user for user in users}
 
-    STATE_DATA_TRANSLATIONS = {
-        "claim_id": "ID заявки",
-        "entered_code": "Введенный код",
-        "photo_file_ids": "ID фото",
-        "review_text": "Текст отзыва",
-        "screenshot_received": "Скриншот получен",
-        "phone_card_message_id": "ID сообщения выбора оплаты",
-        "payment_method": "Способ оплаты",
-        "phone_number": "Номер телефона",
-        "bank": "Банк",
-        "card_number": "Номер карты",
-        "card": "Номер карты",
-        "original_state": "Исходное состояние",
-        "original_data": "Исходные данные"
-    }
     sessions_with_users = []
-    for session in sessions:
-        session_dict = session.dict()
-        session_dict["id"] = str(session.id)
+    for session_dict in sessions:
+        session_dict["id"] = str(session_dict.pop("_id"))
 
-        user = users_map.get(session.user_id)
+        user = users_map.get(session_dict["user_id"])
         if user:
-            session_dict["username"] = user.username or f""
-            session_dict["first_name"] = getattr(user, 'first_name', None)
-            session_dict["last_name"] = getattr(user, 'last_name', None)
-            session_dict["banned"] = user.banned
-            session_dict["user_created_at"] = user.created_at
+            session_dict["username"] = user.get("username") or ""
+            session_dict["first_name"] = user.get("first_name")
+            session_dict["last_name"] = user.get("last_name")
+            session_dict["banned"] = user.get("banned", False)
+            session_dict["user_created_at"] = user.get("created_at")
         else:
-            session_dict["username"] = user.username or f""
+            session_dict["username"] = ""
             session_dict["first_name"] = None
             session_dict["last_name"] = None
             session_dict["banned"] = False
             session_dict["user_created_at"] = None
 
-        if session.state:
+        state = session_dict.get("state")
+        if state:
             session_dict["state_display"] = STATE_TRANSLATIONS.get(
-                session.state,
-                session.state.replace('_', ' ').title()
+                state,
+                state.replace('_', ' ').title()
             )
         else:
             session_dict["state_display"] = "Не указано"
 
-        if session.previous_state:
+        previous_state = session_dict.get("previous_state")
+        if previous_state:
             session_dict["previous_state_display"] = STATE_TRANSLATIONS.get(
-                session.previous_state,
-                session.previous_state.replace('_', ' ').title()
+                previous_state,
+                previous_state.replace('_', ' ').title()
             )
-        if session.state_data:
-            preview_data = {}
-
-            for key, value in session.state_data.items():
-                if isinstance(value, (dict, list)) and not (key == "photo_file_ids" and isinstance(value, list)):
-                    continue
-
-                translated_key = STATE_DATA_TRANSLATIONS.get(key, key)
-                formatted_value = translate_state_value(key, value)
-
-                if formatted_value and formatted_value not in ['', 'None', '[]', '{}'] and len(formatted_value) < 100:
-                    preview_data[translated_key] = formatted_value
-
-            session_dict["state_data_preview"] = preview_data
-        else:
-            session_dict["state_data_preview"] = {}
 
+        session_dict["state_data_preview"] = state_data_preview(session_dict.get("state_data") or {})
         sessions_with_users.append(session_dict)
 
     return templates.TemplateResponse(
@@ -220,7 +259,9 @@ async def support_dashboard(
             "request": request,
             "sessions": sessions_with_users,
             "active_tab": "resolved" if resolved else "active",
-            "total_sessions": total_sessions
+            "total_sessions": total_sessions,
+            "cursor": cursor,
+            "next_cursor": next_cursor
 
         }
     )
@@ -352,9 +393,16 @@ async def send_text_message(
         if not text:
             raise HTTPException(status_code=400, detail="Сообщение не может быть пустым")
 
+        message_id = PydanticObjectId()
         try:
-            await bot.send_message(
-                chat_id=session.user_id,
+            # При временной ошибке сообщение уйдёт из очереди переотправки и пометка снимется
+            sent = await outbound.send_or_queue(
+                "bot", "send_message", session.user_id,
+                on_delivered={
+                    "collection": "support_messages",
+                    "filter": {"_id": message_id},
+                    "update": {"$set": {"message": text}}
+                },
                 text=text
             )
             logger.info(f"💬 [SupportSend] Отправлен текст пользователю {session.user_id}: '{text}'")
@@ -363,9 +411,10 @@ async def send_text_message(
             raise HTTPException(status_code=500, detail=f"Ошибка отправки текста: {str(e)}")
 
         support_message = SupportMessage(
+            id=message_id,
             session_id=session.id,
             user_id=session.user_id,
-            message=text,
+            message=text if sent else f"{text} (не доставлено)",
             is_bot=True,  # Сообщение от админа (бота)
             has_photo=False,
             has_document=False,
@@ -375,6 +424,8 @@ async def send_text_message(
         await support_message.create()
         logger.info(f"✅ [SupportSend] Текстовое сообщение сохранено в сессию {session_id}")
 
+        if not sent:
+            return {"status": "success", "message": "Сообщение поставлено в очередь на отправку"}
         return {"status": "success", "message": "Сообщение отправлено"}
 
     except HTTPException:
@@ -409,45 +460,40 @@ async def send_support_file(
         if user.banned:
             raise HTTPException(status_code=400, detail="Пользователь заблокирован")
 
-        contents = await file.read()
-        size = len(contents)
-
-        if size == 0:
-            raise HTTPException(status_code=400, detail="Файл пустой")
-        if size > 50 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="Файл слишком большой (макс. 50 МБ)")
-
         filename = file.filename or "file"
         mime_type = file.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
-        input_file = BufferedInputFile(contents, filename=filename)
         safe_caption = (caption[:1024] or "").strip()
 
         is_photo = mime_type.startswith("image/") and not mime_type.endswith("svg+xml")
         file_id = None
 
-        try:
-            if is_photo:
-                msg = await bot.send_photo(
-                    chat_id=session.user_id,
-                    photo=input_file,
-                    caption=safe_caption or None,
-                )
-                file_id = msg.photo[-1].file_id if msg.photo else None
-            else:
-                msg = await bot.send_document(
-                    chat_id=session.user_id,
-                    document=input_file,
-                    caption=safe_caption or None,
-                )
-                file_id = msg.document.file_id if msg.document else None
+        async with spool_upload(file, filename) as upload:
+            size = upload.size
+            if size == 0:
+                raise HTTPException(status_code=400, detail="Файл пустой")
 
-            if not file_id:
-                logger.warning("⚠️ Telegram вернул сообщение без file_id")
-                safe_caption += " (не доставлено)"
+            try:
+                # Тот же файл повторно — по file_id, без загрузки
+                if is_photo:
+                    msg = await media.send_upload(
+                        lambda photo: outbound.send("bot", "send_photo", session.user_id, photo=photo, caption=safe_caption or None),
+                        upload, "photo"
+                    )
+                    file_id = msg.photo[-1].file_id if msg.photo else None
+                else:
+                    msg = await media.send_upload(
+                        lambda document: outbound.send("bot", "send_document", session.user_id, document=document, caption=safe_caption or None),
+                        upload, "document"
+                    )
+                    file_id = msg.document.file_id if msg.document else None
+
+                if not file_id:
+                    logger.warning("⚠️ Telegram вернул сообщение без file_id")
+                    safe_caption += " (не доставлено)"
 
-        except Exception as e:
-            logger.error(f"❌ Telegram send failed for session {session_id}: {e}")
-            safe_caption += " (ошибка отправки)"
+            except Exception as e:
+                logger.error(f"❌ Telegram send failed for session {session_id}: {e}")
+                safe_caption += " (ошибка отправки)"
 
         new_message = SupportMessage(
             session_id=obj_id,
@@ -486,6 +532,78 @@ async def send_support_file(
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 
+@router.post("/session/{session_id}/send_files")
+async def send_support_files(
+    session_id: str,
+    files: List[UploadFile] = File(...),
+    caption: str = Form(""),
+    admin=Depends(get_current_admin)
+):
+    """Несколько файлов (от 2 до 10) одним альбомом: один send_media_group и один insert_many"""
+    if not admin:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    try:
+        try:
+            obj_id = PydanticObjectId(session_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Некорректный session_id")
+
+        session = await SupportSession.get(obj_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Сессия не найдена")
+        if session.resolved:
+            raise HTTPException(status_code=400, detail="Сессия уже закрыта")
+
+        user = await User.find_one(User.tg_id == session.user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if user.banned:
+            raise HTTPException(status_code=400, detail="Пользователь заблокирован")
+
+        kind, items = await send_upload_album(
+            media, lambda group: outbound.send("bot", "send_media_group", session.user_id, media=group),
+            files, (caption[:1024] or "").strip()
+        )
+        is_photo = kind == "photo"
+
+        now = datetime.now()
+        support_messages = [
+            SupportMessage(
+                session_id=obj_id,
+                user_id=session.user_id,
+                message=item.text(item.upload.filename),
+                is_bot=True,
+                has_photo=is_photo,
+                photo_file_id=(item.file_id or None) if is_photo else None,
+                photo_caption=item.text() if is_photo else None,
+                has_document=not is_photo,
+                document_file_id=(item.file_id or None) if not is_photo else None,
+                document_name=item.upload.filename,
+                document_mime_type=item.mime_type,
+                document_size=item.upload.size,
+                timestamp=now,
+            )
+            for item in items
+        ]
+        result = await SupportMessage.insert_many(support_messages)
+
+        logger.info(f"✅ Альбом из {len(support_messages)} файлов сохранён в сессию {session_id}")
+
+        return JSONResponse({
+            "status": "success",
+            "message_ids": [str(message_id) for message_id in result.inserted_ids],
+            "file_type": kind,
+            "delivered": any(item.delivered for item in items),
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"💥 Fatal error in /session/{session_id}/send_files: {e}")
+        raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
+
+
 @router.get("/session/{session_id}/photo/{photo_file_id}")
 async def get_support_photo(session_id: str, photo_file_id: str):
     """Получение фото из чата поддержки"""
@@ -643,13 +761,15 @@ async def resolve_session(
             session.previous_state_data = current_fsm_data.get("data", {})
 
             await mongo_db.aiogram_fsm_states.delete_one({"_id": fsm_key})
+            # Бот держит FSM в памяти — сбрасываем, пока пользователь не успел ответить
+            await publish_invalidation("bot", session.user_id)
             logger.info(f"🔄 [SupportClose] Состояние пользователя {session.user_id} сброшено")
         else:
             logger.warning(f"⚠️ [SupportClose] Не найдено FSM состояние для пользователя {session.user_id}")
 
         try:
-            await bot.send_message(
-                chat_id=session.user_id,
+            await outbound.send_or_queue(
+                "bot", "send_message", session.user_id,
                 text="✅ Ваше обращение в техническую поддержку закрыто. Если у вас возникнут новые вопросы, создайте новое обращение."
 
             )
@@ -660,6 +780,7 @@ async def resolve_session(
         session.resolved = True
         session.resolved_by_admin_id = 1
         await session.save()
+        await publish_invalidation("bot", session.user_id)
 
         logger.info(f"✅ [SupportClose] Сессия {session_id} закрыта, состояние пользователя сброшено")
 
@@ -697,6 +818,7 @@ async def clean_and_set_state(user_id: int, target_state: str, session_data: dic
         },
         upsert=True
     )
+    await publish_invalidation("bot", user_id)
 
     logger.info(f"✅ [CleanState] Пользователь {user_id} переведен в состояние {target_state}")
     return base_data
@@ -729,11 +851,16 @@ async def rollback_session_state(
         mongo_db = get_database()
 
         fsm_key = f"fsm:{session.user_id}:{session.user_id}"
-        logger.info(f"🔍 [Rollback] Поиск FSM данных по ключу: {fsm_key}")
-        fsm_data = await mongo_db.aiogram_fsm_states.find_one({"_id": fsm_key})
 
-        session_state = session.state
-        session_data = session.state_data or {}
+        # Состояние до обращения — из снимка; у старых сессий снимка нет, берём state_data без вложенных копий
+        snapshot = await load_snapshot(session.snapshot_id)
+        if snapshot:
+            logger.info(f"🔍 [Rollback] Снимок {snapshot.id} (версия {snapshot.version})")
+            session_state = snapshot.state
+            session_data = snapshot.data
+        else:
+            session_state = session.state
+            session_data = compact_data(session.state_data)
 
         logger.info(f"🔍 [Rollback] State из сессии: {session_state}")
         logger.info(f"🔍 [Rollback] Data из сессии: {session_data}")
@@ -827,20 +954,21 @@ async def rollback_session_state(
             upsert=True  # Создаем если не существует
         )
 
+        await publish_invalidation("bot", session.user_id)
         logger.info(f"✅ [Rollback] FSM обновлен. Изменено документов: {update_result.modified_count}")
 
         message_text = STATE_MESSAGES.get(target_state, "🔄 Состояние обновлено. Продолжайте оформление заявки.")
 
         try:
             if target_state == "RegState:waiting_for_phone_or_card":
-                await bot.send_message(
-                    chat_id=session.user_id,
+                await outbound.send_or_queue(
+                    "bot", "send_message", session.user_id,
                     text=f"🔄 Ваше обращение в поддержку завершено.\n {message_text}",
                     reply_markup=tmenu.phone_or_card_ikb()
                 )
             else:
-                await bot.send_message(
-                    chat_id=session.user_id,
+                await outbound.send_or_queue(
+                    "bot", "send_message", session.user_id,
                     text=f"🔄 Ваше обращение в поддержку завершено.\n {message_text}"
                 )
             logger.info(f"✅ [Rollback] Сообщение отправлено пользователю {session.user_id}")
@@ -854,6 +982,7 @@ async def rollback_session_state(
         session.rollback_count = (session.rollback_count or 0) + 1
 
         await session.save()
+        await publish_invalidation("bot", session.user_id)
         logger.info(f"✅ [Rollback] Сессия {session_id} закрыта")
 
         return RedirectResponse("/support/", status_code=303)
@@ -947,6 +1076,7 @@ async def block_user(request: Request, session_id: str):
         new_banned_status = not user.banned
 
         await user.update(banned=new_banned_status)
+        await publish_invalidation("bot", session.user_id)
 
         action = "разблокирован" if not new_banned_status else "заблокирован"
         logger.warning(f"🔒 [Support] Пользователь {action} {session.user_id} (сессия: {session_id})")
@@ -960,8 +1090,53 @@ async def block_user(request: Request, session_id: str):
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 
+# Поля сессии, которые можно выбрать в fields= потокового режима
+SESSION_STREAM_FIELDS = (
+    "user_id", "state", "state_data", "created_at", "resolved", "resolved_by_admin_id",
+    "previous_state", "previous_state_data", "rollback_count", "username"
+)
+
+
 @router.get("/api/sessions")
-async def get_sessions_api(resolved: bool = False):
+async def get_sessions_api(
+    resolved: bool = False,
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+    fields: Optional[str] = None,
+    admin=Depends(get_current_admin)
+):
+    """
+    Сессии вкладки. format=ndjson / array — потоковый ответ: курсор читается пачками,
+    fields=a,b,c ограничивает поля (username подтягивается из users для каждой пачки)
+    """
+    if not admin:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    if format != "json":
+        projection = parse_fields(fields, SESSION_STREAM_FIELDS)
+        with_username = bool(projection.pop("username", None))
+        # user_id нужен для поиска username, но в ответ идёт, только если его запросили
+        drop_user_id = with_username and "user_id" not in projection
+        if with_username:
+            projection["user_id"] = 1
+
+        async def add_usernames(batch: List[dict]):
+            if not with_username:
+                return
+            users = await User.get_motor_collection().find(
+                {"tg_id": {"$in": list({session["user_id"] for session in batch})}},
+                {"tg_id": 1, "username": 1}
+            ).to_list(length=None)
+            usernames = {user["tg_id"]: user.get("username") or "" for user in users}
+            for session in batch:
+                session["username"] = usernames.get(session["user_id"], "")
+                if drop_user_id:
+                    del session["user_id"]
+
+        cursor = SupportSession.get_motor_collection().find(
+            {"resolved": resolved}, projection
+        ).sort([("created_at", -1), ("_id", -1)])
+        return stream_documents(cursor, format, add_usernames)
+
     sessions = await SupportSession.find(
         {"resolved": resolved}
     ).sort("-created_at").to_list()
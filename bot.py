@@ -4,24 +4,33 @@ import contextlib
 from aiogram import Dispatcher, Bot
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.storage.mongo import MongoStorage
 from aiogram.types import BotCommandScopeDefault, BotCommandScopeChat
 
 from bot.handlers import routers
 from config import cnf
-from core.bot import bot
+from bot.templates.user.menu import prebuild_keyboards
+from bot.templates.user.reg import RegState
+from core.bot import bot, media, scheduler
 from core.logger import bot_logger as logger
+from core.mongo import get_client
+from core.sharding import ShardIngressMiddleware, run_shard_worker
+from core.webhook import configure_updates, run_webhook
 
 from db.beanie.models import document_models
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
-from db.mysql.crud import init_mysql
+from db.mysql.crud import init_mysql, close_mysql
+from utils.code_filter import run_code_filter_loop
+from utils.media_group import MediaGroupMiddleware
+from utils.fsm_storage import CachedMongoStorage, FSMWriteBufferMiddleware
+from utils.user_context import UserContextMiddleware, run_invalidation_listener
 from utils.database import init_database
 
-fsm_storage = MongoStorage.from_url(
-    url=cnf.mongo.URL,
+fsm_storage = CachedMongoStorage(
+    client=get_client(cnf.mongo.URL),
     db_name=cnf.mongo.NAME,
-    collection_name='aiogram_fsm_states'
+    collection_name='aiogram_fsm_states',
+    scope="bot"
 )
 
 dp = Dispatcher(
@@ -30,6 +39,27 @@ dp = Dispatcher(
 )
 dp.include_routers(*routers)
 
+# Режим шардирования: ingress только складывает апдейты в очередь, обрабатывают воркеры
+if cnf.shard.ROLE == "ingress":
+    dp.update.outer_middleware(ShardIngressMiddleware())
+
+# Альбом со скриншотами отзыва — одним вызовом хендлера (до очереди, чтобы части не ждали друг друга)
+dp.update.outer_middleware(MediaGroupMiddleware([RegState.waiting_for_screenshot]))
+
+# Апдейты пользователя — строго по очереди, разные пользователи — параллельно до общего лимита.
+# Снаружи FSMWriteBufferMiddleware, чтобы запись FSM завершалась до следующего апдейта пользователя
+dp.update.outer_middleware(scheduler)
+
+# Все записи FSM за апдейт — одной операцией в конце обработки
+dp.update.outer_middleware(FSMWriteBufferMiddleware(fsm_storage))
+
+# Контекст пользователя (профиль, бан, активные сессии) — один раз на апдейт через кэш.
+# Забаненных отсекают сами пользовательские роутеры (BannedUserMiddleware), админские команды доступны
+dp.message.outer_middleware(UserContextMiddleware("bot"))
+dp.callback_query.outer_middleware(UserContextMiddleware("bot"))
+
+# Фоновые задачи бота (держим ссылки, отменяем при выключении)
+background_tasks = set()
 
 
 async def startup(bot: Bot) -> None:
@@ -44,9 +74,21 @@ async def startup(bot: Bot) -> None:
     await init_mysql()
     logger.info("✅ MySQL подключена")
 
+    # === Фильтр кодов (строится в фоне, до готовности коды проверяются в MySQL) ===
+    if cnf.codes.FILTER_ENABLED:
+        background_tasks.add(asyncio.create_task(run_code_filter_loop()))
+
+    # === Сброс кэша контекста по событиям админки ===
+    background_tasks.add(asyncio.create_task(run_invalidation_listener("bot")))
+
+    # === Статические клавиатуры и file_id видео ===
+    prebuild_keyboards()
+    known = await media.warm_up("utils/*.mp4")
+    logger.info(f"🎬 Видео с известным file_id: {known}")
+
 
     # === Настройка команд бота ===
-    await bot.delete_webhook()
+    await configure_updates(bot, dp, "bot")
     user_commands = [
         cmd for cmd in cnf.bot.COMMANDS
         if cmd.command != "admin"
@@ -62,15 +104,29 @@ async def shutdown(bot: Bot) -> None:
     """
     Активируется при выключении
     """
-    await bot.close()
-    await dp.stop_polling()
+    for task in background_tasks:
+        task.cancel()
+    await close_mysql()
+    # Polling останавливает и HTTP-сессию закрывает тот, кто их запустил (main или runner.py):
+    # shutdown вызывается из самой остановки polling, а сессия в runner.py общая для обоих ботов
     logger.info('=== Bot stopped ===')
 
 
+# Регистрируем при импорте, чтобы runner.py запускал бота с теми же хуками
+dp.startup.register(startup)
+dp.shutdown.register(shutdown)
+
+
 async def main() -> None:
-    dp.startup.register(startup)
-    dp.shutdown.register(shutdown)
-    await dp.start_polling(bot)
+    try:
+        if cnf.shard.ROLE == "worker":
+            await run_shard_worker(dp, bot)
+        elif cnf.webhook.ENABLED:
+            await run_webhook(dp, bot, "bot", cnf.webhook.BOT_PORT)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await bot.session.close()
 
 
 if __name__ == "__main__":
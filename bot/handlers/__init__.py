@@ -1,7 +1,9 @@
 from .user.commands import router as commands
 from .admin.reg import router as reg
+from .user.channel import router as channel
 
 routers = [
     reg,
+    channel,
     commands
 ]
@@ -6,6 +6,9 @@ from core.logger import bot_logger as logger
 from bot.filters.admin import IsAdmin
 from bot.templates.admin.menu import AdminRegState
 from db.beanie.models.models import ChatSession, UserMessage, Administrators
+from db.mysql.crud import mysql_stats
+from core.bot import scheduler
+from utils.code_filter import code_filter
 
 
 router = Router()
@@ -26,6 +29,31 @@ async def reg_admin(msg: Message, state: FSMContext):
 
 
 
+@router.message(Command("db_stats"), IsAdmin())
+async def db_stats(msg: Message):
+    stats = mysql_stats()
+    pool = stats["pool"]
+    latency = stats["latency_ms"]
+    queue = scheduler.stats()
+
+    pool_text = (
+        f"{pool['size']} соединений, свободно {pool['free']} (мин. {pool['min']}, макс. {pool['max']})"
+        if pool else "не создан"
+    )
+    await msg.answer(
+        f"🗄 <b>MySQL</b>\n\n"
+        f"Пул: {pool_text}\n"
+        f"Погашение кодов: {stats['calls']} попыток, {stats['redeemed']} погашено, "
+        f"{stats['not_found']} не найдено, {stats['errors']} ошибок\n"
+        f"Отсечено фильтром без запроса: {code_filter.rejected}\n"
+        f"Задержка, мс: p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, макс. {latency['max']}\n\n"
+        f"📬 <b>Очередь апдейтов</b>\n\n"
+        f"Пользователей в очереди: {queue['users']}, ждут {queue['waiting']}, выполняются {queue['running']}\n"
+        f"Обработано {queue['processed']}, отброшено {queue['dropped']}\n"
+        f"Ожидание, мс: среднее {queue['wait_avg_ms']}, макс. {queue['wait_max_ms']}"
+    )
+
+
 @router.message(StateFilter(AdminRegState.waiting_for_login))
 async def process_login(msg: Message, state: FSMContext):
     if not msg.text:
@@ -0,0 +1,23 @@
+from aiogram import Router
+from aiogram.types import ChatMemberUpdated
+
+from config import cnf
+from utils.check_subscribe import on_chat_member
+
+router = Router()
+
+
+def _is_our_channel(event: ChatMemberUpdated) -> bool:
+    channel = cnf.bot.CHANNEL_USERNAME
+    if event.chat.username and f"@{event.chat.username}".lower() == channel.lower():
+        return True
+    return str(event.chat.id) == channel
+
+
+@router.chat_member(_is_our_channel)
+async def channel_member_changed(event: ChatMemberUpdated):
+    """
+    Вступления и выходы из канала ведут реестр подписчиков.
+    Telegram присылает chat_member, только если бот — администратор канала.
+    """
+    await on_chat_member(event, cnf.bot.CHANNEL_USERNAME)
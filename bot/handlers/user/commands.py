@@ -1,7 +1,8 @@
 from datetime import datetime
+import math
 import re
+from typing import List, Optional
 from core.logger import bot_logger
-from asyncio import Lock
 from aiogram import Router, types, F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
@@ -9,30 +10,24 @@ from aiogram.types import Message, CallbackQuery, ForceReply, InlineKeyboardMark
 from bot.templates.user.reg import SupportState
 from bot.templates.user import reg as treg
 from bot.templates.user import menu as tmenu
-from core.bot import bot, bot_config
+from core.bot import bot, bot_config, media
 from db.beanie.models import User, Claim, AdminMessage, SupportSession, SupportMessage, ChatMessage, ChatSession
 from db.mysql.crud import get_and_delete_code
 from utils.check_subscribe import check_user_subscription
+from utils.code_filter import code_filter
+from utils.rate_limit import SlidingWindowLimiter
+from utils.support_snapshot import compact_data, snapshot_fsm
+from utils.user_context import BannedUserMiddleware, UserContext
 from config import cnf
-from aiogram.types import FSInputFile
 
 router = Router()
-user_locks = {}
+router.message.middleware(BannedUserMiddleware())
+router.callback_query.middleware(BannedUserMiddleware())
+code_attempts = SlidingWindowLimiter(cnf.codes.ATTEMPTS, cnf.codes.ATTEMPTS_WINDOW)
 logger = bot_logger
 
-async def ban_check_middleware(handler, event, data):
-    if hasattr(event, 'from_user') and event.from_user:
-        user = await User.get(tg_id=event.from_user.id)
-        if user and user.banned:
-            if isinstance(event, CallbackQuery):
-                await event.answer()
-            return
-    return await handler(event, data)
-router.callback_query.middleware(ban_check_middleware)
-router.message.middleware(ban_check_middleware)
-
 @router.message(Command("start"))
-async def start_new_user(msg: Message, state: FSMContext):
+async def start_new_user(msg: Message, state: FSMContext, user_ctx: UserContext):
     current_state = await state.get_state()
     states = ["RegState:waiting_for_code", "RegState:waiting_for_screenshot", "RegState:waiting_for_phone_or_card", "RegState:waiting_for_bank", "RegState:waiting_for_phone_number", "RegState:waiting_for_card_number", "SupportState:waiting_for_message"]
     if current_state in states:
@@ -43,7 +38,7 @@ async def start_new_user(msg: Message, state: FSMContext):
     username = msg.from_user.username
 
     # === Находим или создаём пользователя ===
-    user = await User.get(tg_id=user_id)
+    user = user_ctx.user
     if not user:
         # === Создаём нового пользователя ===
         role = "admin" if user_id in bot_config.ADMINS else "user"
@@ -52,15 +47,15 @@ async def start_new_user(msg: Message, state: FSMContext):
             username=username,
             role=role
         )
+        user_ctx.user = user
     if user.banned:
         return
 
     # welcome_photo = FSInputFile("utils/IMG_1262.png")
-    welcome_video = FSInputFile("utils/IMG_0017.mp4")
     welcome_text = "👋 Привет! Это бот компании Pure. Введите секретный код, указанный на голограмме."
 
-    await msg.answer_video(
-        video=welcome_video,
+    await media.answer_video(
+        msg, "utils/IMG_0017.mp4",
         caption=welcome_text
     )
     await state.set_state(treg.RegState.waiting_for_code)
@@ -68,12 +63,12 @@ async def start_new_user(msg: Message, state: FSMContext):
 
 
 @router.message(Command("help"))
-async def help_save_state(msg: Message, state: FSMContext):
+async def help_save_state(msg: Message, state: FSMContext, user_ctx: UserContext):
     user_id = msg.from_user.id
     username = msg.from_user.username
 
     # === Находим или создаём пользователя ===
-    user = await User.get(tg_id=user_id)
+    user = user_ctx.user
     if not user:
         # === Создаём нового пользователя ===
         role = "admin" if user_id in bot_config.ADMINS else "user"
@@ -82,22 +77,14 @@ async def help_save_state(msg: Message, state: FSMContext):
             username=username,
             role=role
         )
+        user_ctx.user = user
     if user.banned:
         return
 
-    active_session = await SupportSession.find(
-    SupportSession.user_id == user_id,
-    SupportSession.resolved == False
-).sort(-SupportSession.created_at).first_or_none()
+    active_session = user_ctx.support_session
 
     if active_session:
-        current_state = await state.get_state()
-        current_data = await state.get_data() if current_state else {}
-
-        await state.update_data(
-            original_state=current_state,
-            original_data=current_data
-        )
+        await snapshot_fsm(user_id, state)
         await state.set_state(SupportState.waiting_for_message)
 
         await msg.answer(
@@ -105,19 +92,17 @@ async def help_save_state(msg: Message, state: FSMContext):
             "Ваше обращение уже в работе, Вы можете отправить новое сообщение.\n\n", parse_mode="HTML")
         return
 
-    current_state = await state.get_state()
-    current_data = await state.get_data() if current_state else {}
+    # Состояние до обращения — в снимок, сессия и FSM ссылаются на него
+    snapshot = await snapshot_fsm(user_id, state)
 
     new_session = await SupportSession(
         user_id=user_id,
-        state=current_state,
-        state_data=current_data
+        state=snapshot.state,
+        state_data=snapshot.data,
+        snapshot_id=snapshot.id
     ).insert()
+    user_ctx.support_session = new_session
 
-    await state.update_data(
-        original_state=current_state,
-        original_data=current_data
-    )
     await state.set_state(SupportState.waiting_for_message)
 
     await msg.answer(
@@ -128,12 +113,12 @@ async def help_save_state(msg: Message, state: FSMContext):
     )
 
 @router.callback_query(F.data == "send_help_text")
-async def help_save(callback: CallbackQuery, state: FSMContext):
+async def help_save(callback: CallbackQuery, state: FSMContext, user_ctx: UserContext):
     user_id = callback.from_user.id
     username = callback.from_user.username
 
     # === Находим или создаём пользователя ===
-    user = await User.get(tg_id=user_id)
+    user = user_ctx.user
     if not user:
         # === Создаём нового пользователя ===
         role = "admin" if user_id in bot_config.ADMINS else "user"
@@ -142,23 +127,15 @@ async def help_save(callback: CallbackQuery, state: FSMContext):
             username=username,
             role=role
         )
+        user_ctx.user = user
     if user.banned:
         return
     await callback.answer()
 
-    active_session = await SupportSession.find(
-        SupportSession.user_id == user_id,
-        SupportSession.resolved == False
-    ).sort(-SupportSession.created_at).first_or_none()
+    active_session = user_ctx.support_session
 
     if active_session:
-        current_state = await state.get_state()
-        current_data = await state.get_data() if current_state else {}
-
-        await state.update_data(
-            original_state=current_state,
-            original_data=current_data
-        )
+        await snapshot_fsm(user_id, state)
         await state.set_state(SupportState.waiting_for_message)
 
         if callback.message and callback.message.text:
@@ -176,19 +153,17 @@ async def help_save(callback: CallbackQuery, state: FSMContext):
                 "Ваше обращение уже в работе, Вы можете отправить новое сообщение.\n\n", parse_mode="HTML")
         return
 
-    current_state = await state.get_state()
-    current_data = await state.get_data() if current_state else {}
+    # Состояние до обращения — в снимок, сессия и FSM ссылаются на него
+    snapshot = await snapshot_fsm(user_id, state)
 
     new_session = await SupportSession(
         user_id=user_id,
-        state=current_state,
-        state_data=current_data
+        state=snapshot.state,
+        state_data=snapshot.data,
+        snapshot_id=snapshot.id
     ).insert()
+    user_ctx.support_session = new_session
 
-    await state.update_data(
-        original_state=current_state,
-        original_data=current_data
-    )
     await state.set_state(SupportState.waiting_for_message)
 
     if callback.message and callback.message.text:
@@ -215,18 +190,29 @@ async def process_code(msg: Message, state: FSMContext):
 
     code = msg.text.strip()
 
-    code_valid = await get_and_delete_code(code)
+    # Перебор кодов останавливаем до MySQL; в лимит идут только неудачные попытки
+    if not code_attempts.allowed(msg.from_user.id):
+        minutes = math.ceil(code_attempts.retry_after(msg.from_user.id) / 60)
+        await msg.answer(
+            f"⏳ Слишком много попыток ввода кода. Попробуйте через {minutes} мин.",
+            reply_markup=tmenu.support_ikb()
+        )
+        return
+
+    # Заведомо несуществующие коды отсекает фильтр, без запроса в MySQL
+    code_valid = await code_filter.may_exist(code) and await get_and_delete_code(code)
     if not code_valid and not code == "test":
-        await msg.answer_video(video=FSInputFile("utils/IMG_0018.mp4"), caption=treg.code_not_found_text, reply_markup=tmenu.support_ikb())
+        code_attempts.hit(msg.from_user.id)
+        await media.answer_video(msg, "utils/IMG_0018.mp4", caption=treg.code_not_found_text, reply_markup=tmenu.support_ikb())
         return
 
-    await msg.answer_video(video=FSInputFile("utils/IMG_1848.mp4"), caption=treg.code_found_text)
+    await media.answer_video(msg, "utils/IMG_1848.mp4", caption=treg.code_found_text)
 
     CHANNEL_USERNAME = cnf.bot.CHANNEL_USERNAME
     is_subscribed = await check_user_subscription(bot, msg.from_user.id, CHANNEL_USERNAME)
 
     if not is_subscribed:
-        await msg.answer_video(video=FSInputFile("utils/IMG_0016.mp4"), caption=treg.not_subscribed_text, reply_markup=tmenu.check_subscription_ikb())
+        await media.answer_video(msg, "utils/IMG_0016.mp4", caption=treg.not_subscribed_text, reply_markup=tmenu.check_subscription_ikb())
         await state.update_data(entered_code=code)
         return
 
@@ -245,7 +231,7 @@ async def check_subscription_callback(call: CallbackQuery, state: FSMContext):
         return
 
     CHANNEL_USERNAME = cnf.bot.CHANNEL_USERNAME
-    is_subscribed = await check_user_subscription(bot, call.from_user.id, CHANNEL_USERNAME)
+    is_subscribed = await check_user_subscription(bot, call.from_user.id, CHANNEL_USERNAME, recheck=True)
 
     if not is_subscribed:
         await call.answer("Вы всё ещё не подписаны. Попробуйте снова.", show_alert=True)
@@ -291,64 +277,63 @@ async def handle_reg_callback(call: CallbackQuery, callback_data: treg.RegCallba
         await state.set_state(treg.RegState.waiting_for_screenshot)
 
     elif step == "phone":
-        await call.message.answer_video(video=FSInputFile("utils/IMG_0014.mp4"), caption=treg.phone_format_text)
+        await media.answer_video(call.message, "utils/IMG_0014.mp4", caption=treg.phone_format_text)
         await state.set_state(treg.RegState.waiting_for_phone_number)
 
     elif step == "card":
         await call.message.delete()
-        await call.message.answer_video(video=FSInputFile("utils/IMG_1850.mp4"), caption=treg.card_format_text)
+        await media.answer_video(call.message, "utils/IMG_1850.mp4", caption=treg.card_format_text)
         await state.set_state(treg.RegState.waiting_for_card_number)
 
     await call.answer()
 
 
 @router.message(StateFilter(treg.RegState.waiting_for_screenshot))
-async def process_screenshot(msg: Message, state: FSMContext):
-    if not msg.photo:
+async def process_screenshot(msg: Message, state: FSMContext, album: Optional[List[Message]] = None):
+    # Альбом приходит целиком (MediaGroupMiddleware): одна запись FSM и одно сообщение на все фото
+    parts = album or [msg]
+    photo_ids = [part.photo[-1].file_id for part in parts if part.photo]
+    if not photo_ids:
         await msg.answer(text=treg.screenshot_error_text, reply_markup=tmenu.support_ikb())
         return
 
-    user_id = msg.from_user.id
-    if user_id not in user_locks:
-        user_locks[user_id] = Lock()
-
-    async with user_locks[user_id]:
-        data = await state.get_data()
-        largest_photo = msg.photo[-1]
-        file_id = largest_photo.file_id
+    # Апдейты пользователя выполняются по очереди (UpdateScheduler), поэтому
+    # фото из разных сообщений дописываются в photo_file_ids без гонок
+    data = await state.get_data()
+    caption = next((part.caption for part in parts if part.caption), "")
 
-        current_photos = data.get("photo_file_ids", [])
-        current_photos.append(file_id)
+    current_photos = data.get("photo_file_ids", [])
+    current_photos.extend(photo_ids)
 
-        await state.update_data(
-            photo_file_ids=current_photos,
-            review_text=data.get("review_text", "") or msg.caption or "",
-            screenshot_received=True
-        )
+    await state.update_data(
+        photo_file_ids=current_photos,
+        review_text=data.get("review_text", "") or caption,
+        screenshot_received=True
+    )
 
-        existing_msg_id = data.get("phone_card_message_id")
+    existing_msg_id = data.get("phone_card_message_id")
 
-        new_text = f"{treg.phone_or_card_text}"
+    new_text = f"{treg.phone_or_card_text}"
 
-        if existing_msg_id:
-            try:
-                await bot.edit_message_text(
-                    chat_id=msg.chat.id,
-                    message_id=existing_msg_id,
-                    text=new_text,
-                    reply_markup=tmenu.phone_or_card_ikb()
-                )
-            except Exception as e:
-                if "message is not modified" not in str(e):
-                    logger.error(f"Ошибка редактирования: {e}")
-        else:
-            sent_msg = await msg.answer(
+    if existing_msg_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=msg.chat.id,
+                message_id=existing_msg_id,
                 text=new_text,
                 reply_markup=tmenu.phone_or_card_ikb()
             )
-            await state.update_data(phone_card_message_id=sent_msg.message_id)
+        except Exception as e:
+            if "message is not modified" not in str(e):
+                logger.error(f"Ошибка редактирования: {e}")
+    else:
+        sent_msg = await msg.answer(
+            text=new_text,
+            reply_markup=tmenu.phone_or_card_ikb()
+        )
+        await state.update_data(phone_card_message_id=sent_msg.message_id)
 
-        await state.set_state(treg.RegState.waiting_for_phone_or_card)
+    await state.set_state(treg.RegState.waiting_for_phone_or_card)
 
 
 @router.message(StateFilter(treg.RegState.waiting_for_phone_number))
@@ -439,8 +424,10 @@ async def finalize_claim(user_tg_id: int, state: FSMContext):
         update_data["phone"] = phone
         update_data["bank"] = bank
         update_data["card"] = None
+        update_data["card_last4"] = None
     elif card:
         update_data["card"] = card
+        update_data["card_last4"] = card[-4:]
         update_data["phone"] = None
         update_data["bank"] = bank
     await claim.update(**update_data)
@@ -449,20 +436,20 @@ async def finalize_claim(user_tg_id: int, state: FSMContext):
     await state.clear()
 
 @router.message(StateFilter(SupportState.waiting_for_message))
-async def handle_support_message(msg: Message, state: FSMContext):
+async def handle_support_message(msg: Message, state: FSMContext, user_ctx: UserContext):
     user_id = msg.from_user.id
 
-    session = await SupportSession.find(
-        SupportSession.user_id == user_id,
-        SupportSession.resolved == False
-    ).sort(-SupportSession.created_at).first_or_none()
+    session = user_ctx.support_session
 
     if not session:
+        data = await state.get_data()
         session = await SupportSession(
             user_id=user_id,
             state=await state.get_state(),
-            state_data=await state.get_data()
+            state_data=compact_data(data),
+            snapshot_id=data.get("support_snapshot_id")
         ).insert()
+        user_ctx.support_session = session
 
     text = msg.text or msg.caption or ""
     has_photo = bool(msg.photo)
@@ -522,15 +509,12 @@ async def handle_support_message(msg: Message, state: FSMContext):
     )
 
 @router.message(F.chat.type == "private")
-async def handle_all_user_messages(message: Message):
+async def handle_all_user_messages(message: Message, user_ctx: UserContext):
     try:
         user_id = message.from_user.id
 
-        # Ищем сессию с САМЫМ ПОСЛЕДНИМ взаимодействием
-        chat_session = await ChatSession.find_one(
-            {"user_id": user_id, "is_active": True},
-            sort=[("last_interaction", -1)]  # самая свежая по взаимодействию
-        )
+        # Сессия с САМЫМ ПОСЛЕДНИМ взаимодействием (из контекста пользователя)
+        chat_session = user_ctx.chat_session
 
         if not chat_session:
             await message.answer("❌ У вас нет активных чатов с поддержкой.")
@@ -592,9 +576,11 @@ async def handle_all_user_messages(message: Message):
                 chat_message.message = f"📎 {document_name}"
             await chat_message.save()
 
-        chat_session.last_interaction = datetime.now()
-        chat_session.has_unanswered = True
-        await chat_session.save()
+        # Только эти поля: закэшированная сессия не должна затирать изменения админки
+        await chat_session.set({
+            ChatSession.last_interaction: datetime.now(),
+            ChatSession.has_unanswered: True
+        })
 
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения сообщения пользователя: {e}")
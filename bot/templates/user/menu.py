@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -14,6 +16,7 @@ class UserState(StatesGroup):
     waiting_reply_to_admin = State()
 
 
+@lru_cache(maxsize=None)
 def welcome_ikb():
     """Инлайн кнопка для приветственного сообщения"""
     builder = InlineKeyboardBuilder()
@@ -21,6 +24,7 @@ def welcome_ikb():
     return builder.as_markup()
 
 
+@lru_cache(maxsize=None)
 def support_ikb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(
@@ -30,12 +34,14 @@ def support_ikb() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@lru_cache(maxsize=None)
 def send_screenshot_ikb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="Прислать скриншот", callback_data=RegCallback(step="send_screenshot"))
     return builder.as_markup()
 
 
+@lru_cache(maxsize=None)
 def phone_or_card_ikb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="Указать номер телефона СБП", callback_data=RegCallback(step="phone"))
@@ -44,6 +50,7 @@ def phone_or_card_ikb() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@lru_cache(maxsize=None)
 def check_subscription_ikb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Проверить подписку", callback_data=RegCallback(step="check_sub"))
@@ -55,3 +62,8 @@ def user_reply_ikb(claim_id):
     builder.button(text="💬 Ответить администратору", callback_data=f"reply_{claim_id}")
     return builder.as_markup()
 
+
+def prebuild_keyboards():
+    """Статические клавиатуры собираются один раз при старте и дальше берутся из кэша"""
+    for build in (welcome_ikb, support_ikb, send_screenshot_ikb, phone_or_card_ikb, check_subscription_ikb):
+        build()
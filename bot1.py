@@ -3,25 +3,53 @@ import contextlib
 
 from aiogram import Dispatcher, Bot
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommandScopeDefault, BotCommandScopeChat
 
 from bot1.handlers import routers
 from config import cnf
-from core.bot1 import bot1
+from core.bot1 import bot1, scheduler
 from core.logger import bot_logger as logger
+from core.mongo import get_client
+from core.webhook import configure_updates, run_webhook
 
 from db.beanie_bot1.models import document_models
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
+from utils.ingest_writer import ingest_writer
+from utils.fsm_storage import CachedMongoStorage, FSMWriteBufferMiddleware
+from utils.user_context import UserContextMiddleware, run_invalidation_listener
 from utils.database import init_database, init_database_bot1
+from utils.broadcast import resume_broadcasts, run_reprobe_loop
+
+# Состояния храним в Mongo, чтобы незаконченные правки товаров и рассылки переживали рестарт
+fsm_storage = CachedMongoStorage(
+    client=get_client(cnf.mongo_bot1.URL),
+    db_name=cnf.mongo_bot1.NAME,
+    collection_name='aiogram_fsm_states',
+    scope="bot1"
+)
 
 dp = Dispatcher(
     bot=bot1,
-    storage=MemoryStorage()
+    storage=fsm_storage
 )
 dp.include_routers(*routers)
 
+# Апдейты пользователя — строго по очереди, разные пользователи — параллельно до общего лимита.
+# Снаружи FSMWriteBufferMiddleware, чтобы запись FSM завершалась до следующего апдейта пользователя
+dp.update.outer_middleware(scheduler)
+
+# Все записи FSM за апдейт — одной операцией в конце обработки
+dp.update.outer_middleware(FSMWriteBufferMiddleware(fsm_storage))
+
+# Контекст пользователя (профиль, бан, активные сессии) — один раз на апдейт через кэш.
+# Забаненных отсекают сами пользовательские роутеры (BannedUserMiddleware), админские команды доступны
+dp.message.outer_middleware(UserContextMiddleware("bot1"))
+dp.callback_query.outer_middleware(UserContextMiddleware("bot1"))
+
+# Фоновые задачи бота (держим ссылки, отменяем при выключении)
+background_tasks = set()
+
 
 
 async def startup(bot: Bot) -> None:
@@ -37,8 +65,15 @@ async def startup(bot: Bot) -> None:
     # )
     logger.info("✅ MongoDB (BOT-1) подключена")
 
+    # === Незавершённые рассылки ===
+    await resume_broadcasts(bot)
+    background_tasks.add(asyncio.create_task(run_reprobe_loop(bot)))
+
+    # === Сброс кэша контекста по событиям админки ===
+    background_tasks.add(asyncio.create_task(run_invalidation_listener("bot1")))
+
     # === Настройка команд бота ===
-    await bot.delete_webhook()
+    await configure_updates(bot, dp, "bot1")
     user_commands = [
         cmd for cmd in cnf.bot1.COMMANDS
         if cmd.command != "admin"
@@ -61,15 +96,27 @@ async def shutdown(bot: Bot) -> None:
     """
     Активируется при выключении
     """
-    await bot1.close()
-    await dp.stop_polling()
+    for task in background_tasks:
+        task.cancel()
+    await ingest_writer.close()
+    # Polling останавливает и HTTP-сессию закрывает тот, кто их запустил (main или runner.py):
+    # shutdown вызывается из самой остановки polling, а сессия в runner.py общая для обоих ботов
     logger.info('=== Bot stopped ===')
 
 
+# Регистрируем при импорте, чтобы runner.py запускал бота с теми же хуками
+dp.startup.register(startup)
+dp.shutdown.register(shutdown)
+
+
 async def main() -> None:
-    dp.startup.register(startup)
-    dp.shutdown.register(shutdown)
-    await dp.start_polling(bot1)
+    try:
+        if cnf.webhook.ENABLED:
+            await run_webhook(dp, bot1, "bot1", cnf.webhook.BOT1_PORT)
+        else:
+            await dp.start_polling(bot1)
+    finally:
+        await bot1.session.close()
 
 
 if __name__ == "__main__":
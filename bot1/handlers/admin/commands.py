@@ -1,15 +1,14 @@
-import asyncio
-from datetime import datetime
 from aiogram import Router, F
 from aiogram.filters import StateFilter, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message, ForceReply
 from core.logger import bot_1_logger as logger
 from bot1.filters.admin import IsAdmin
-from bot1.templates.admin.keyboards import start_admin_kb
+from bot1.templates.admin.keyboards import start_admin_kb, mailing_segments_kb
 from bot1.templates.admin.states import AdminMailingState, ProductStates
 from core.bot1 import bot1
-from utils.database import get_database_bot1
+from utils.broadcast import start_broadcast
+from utils.segments import segment_title
 
 router = Router()
 
@@ -23,127 +22,67 @@ async def start_admin(msg: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("start_mailing"))
 async def start_mailing(call: CallbackQuery, state: FSMContext):
     await state.clear()
-    await state.set_state(AdminMailingState.waiting_message_to_mailing)
 
     await call.message.reply(
-        text="<b>Введите сообщение для рассылки:</b>",
-        parse_mode="HTML"
+        text="<b>Кому отправить рассылку?</b>",
+        parse_mode="HTML",
+        reply_markup=mailing_segments_kb()
     )
     await call.answer()
 
 
+@router.callback_query(F.data.startswith("mailing_segment_"))
+async def choose_mailing_segment(call: CallbackQuery, state: FSMContext):
+    segment = call.data.removeprefix("mailing_segment_")
+    await state.clear()
+
+    if segment == "active":
+        await state.update_data(segment=segment)
+        await state.set_state(AdminMailingState.waiting_segment_param)
+        await call.message.edit_text("<b>За сколько последних дней учитывать сообщения?</b>", parse_mode="HTML")
+    elif segment == "product":
+        await state.update_data(segment=segment)
+        await state.set_state(AdminMailingState.waiting_segment_param)
+        await call.message.edit_text("<b>Введите ID товара:</b>", parse_mode="HTML")
+    else:
+        await state.update_data(segment=None if segment == "all" else segment)
+        await state.set_state(AdminMailingState.waiting_message_to_mailing)
+        await call.message.edit_text("<b>Введите сообщение для рассылки:</b>", parse_mode="HTML")
+    await call.answer()
+
+
+@router.message(AdminMailingState.waiting_segment_param)
+async def process_segment_param(msg: Message, state: FSMContext):
+    if not msg.text or not msg.text.strip().isdigit() or int(msg.text) <= 0:
+        await msg.answer("❌ Введите положительное число")
+        return
+
+    data = await state.get_data()
+    await state.update_data(segment_param=int(msg.text))
+    await state.set_state(AdminMailingState.waiting_message_to_mailing)
+    await msg.answer(
+        f"🎯 Аудитория: {segment_title(data.get('segment'), int(msg.text))}\n\n"
+        f"<b>Введите сообщение для рассылки:</b>",
+        parse_mode="HTML"
+    )
+
+
 @router.message(AdminMailingState.waiting_message_to_mailing)
 async def process_mailing_message(msg: Message, state: FSMContext):
+    data = await state.get_data()
     await state.clear()
 
     try:
-        # Получаем подключение к MongoDB
-        db = get_database_bot1()
-        users_collection = db["users"]
-
-        # Получаем всех пользователей (исключаем забаненных)
-        users_cursor = users_collection.find({"banned": {"$ne": "1"}})
-        active_users = await users_cursor.to_list(length=None)
+        # Рассылка идёт в фоне: хендлер сразу освобождается,
+        # прогресс обновляется в отдельном сообщении
+        job = await start_broadcast(msg.bot, msg, data.get("segment"), data.get("segment_param"))
 
-        if not active_users:
+        if not job:
             await msg.answer("❌ Нет активных пользователей для рассылки")
             return
 
-        sent_count = 0
-        failed_count = 0
-
-        # Отправляем сообщение о начале рассылки
-        progress_msg = await msg.answer(f"📤 Начинаю рассылку... 0/{len(active_users)}")
-
-        # Получаем parse_mode из сообщения
-        parse_mode = None
-        if hasattr(msg, 'entities') and msg.entities:
-            # Если есть форматирование, используем HTML
-            parse_mode = "HTML"
-        elif hasattr(msg, 'caption_entities') and msg.caption_entities:
-            # Если есть форматирование в подписи
-            parse_mode = "HTML"
-
-        # Рассылка сообщения всем пользователям
-        for user in active_users:
-            try:
-                # Получаем tg_id пользователя
-                tg_id = user.get("tg_id") or user.get("id")
-
-                if not tg_id:
-                    failed_count += 1
-                    continue
-
-                # Проверяем тип сообщения и отправляем соответствующим образом
-                if msg.text:
-                    await msg.bot.send_message(
-                        chat_id=tg_id,
-                        text=msg.text,
-                        parse_mode=parse_mode
-                    )
-                elif msg.photo:
-                    await msg.bot.send_photo(
-                        chat_id=tg_id,
-                        photo=msg.photo[-1].file_id,
-                        caption=msg.caption,
-                        parse_mode=parse_mode
-                    )
-                elif msg.video:
-                    await msg.bot.send_video(
-                        chat_id=tg_id,
-                        video=msg.video.file_id,
-                        caption=msg.caption,
-                        parse_mode=parse_mode
-                    )
-                elif msg.document:
-                    await msg.bot.send_document(
-                        chat_id=tg_id,
-                        document=msg.document.file_id,
-                        caption=msg.caption,
-                        parse_mode=parse_mode
-                    )
-                else:
-                    # Если тип сообщения не поддерживается, отправляем текст
-                    if msg.caption:
-                        await msg.bot.send_message(
-                            chat_id=tg_id,
-                            text=msg.caption,
-                            parse_mode=parse_mode
-                        )
-                    else:
-                        failed_count += 1
-                        continue
-
-                sent_count += 1
-
-                # Обновляем прогресс каждые 10 отправленных сообщений
-                if sent_count % 10 == 0:
-                    await progress_msg.edit_text(
-                        f"📤 Рассылка... {sent_count}/{len(active_users)}"
-                    )
-
-                # Небольшая задержка чтобы не превысить лимиты Telegram
-                await asyncio.sleep(0.1)
-
-            except Exception as e:
-                logger.error(f"Ошибка при отправке пользователю {user.get('tg_id')}: {e}")
-                failed_count += 1
-                continue
-
-        # Финальное сообщение с результатами
-        result_text = (
-            f"✅ <b>Рассылка завершена!</b>\n\n"
-            f"📊 <b>Статистика:</b>\n"
-            f"• Всего пользователей: {len(active_users)}\n"
-            f"• Успешно отправлено: {sent_count}\n"
-            f"• Не удалось отправить: {failed_count}\n"
-            f"• Процент успеха: {(sent_count / len(active_users)) * 100:.1f}%"
-        )
-
-        await progress_msg.edit_text(result_text, parse_mode="HTML")
+        logger.info(f"📨 Запущена рассылка {job.id} на {job.total} пользователей")
 
     except Exception as e:
         logger.error(f"Ошибка при получении пользователей из БД: {e}")
         await msg.answer("❌ Ошибка при получении списка пользователей")
-
-
@@ -4,20 +4,21 @@ from aiogram.filters import CommandStart, Command
 
 from bot1.templates.user.keyboards import product_reaction_kb
 from db.beanie_bot1.models import Users
+from utils.broadcast import clear_unreachable
 from utils.database import get_database_bot1
+from utils.segments import record_product_open
+from utils.user_context import BannedUserMiddleware, UserContext
 
 router = Router()
+router.message.middleware(BannedUserMiddleware())
+router.callback_query.middleware(BannedUserMiddleware())
 
 
 @router.message(CommandStart())
-async def cmd_start_with_product(message: Message):
+async def cmd_start_with_product(message: Message, user_ctx: UserContext):
     user_id = message.from_user.id
-    db = get_database_bot1()
-    users_collection = db.users
-    user = await users_collection.find_one({"id": user_id})
-
-    if user and user.get("banned") == "1":
-        return
+    users_collection = get_database_bot1().users
+    user = user_ctx.user
 
     # Если пользователь не найден - создаем нового
     if not user:
@@ -29,6 +30,11 @@ async def cmd_start_with_product(message: Message):
             "banned": "0"
         }
         await users_collection.insert_one(new_user)
+        user_ctx.user = new_user
+    elif user.get("unreachable"):
+        # Пользователь вернулся после блокировки бота
+        await clear_unreachable(user_id)
+        user.pop("unreachable", None)
 
     # Получаем аргументы после /start
     args = message.text.split()
@@ -54,6 +60,8 @@ async def show_product_to_user(message: Message, product_id: int):
             await message.answer("❌ Товар не найден")
             return
 
+        await record_product_open(message.from_user.id, product_id)
+
         # Отправляем карточку товара с кнопками
         await message.answer_photo(
             photo=product['image_id'],
@@ -5,11 +5,14 @@ from core.logger import bot_1_logger as logger
 from core.bot1 import bot1
 from db.beanie_bot1.models.models import Messages, Users
 import mimetypes
-from datetime import datetime, timezone
+from datetime import datetime
 from utils.database import get_database_bot1
+from utils.ingest_writer import IncomingMessage, ingest_writer
+from utils.user_context import BannedUserMiddleware, UserContext
 
 # Создаем роутер
 user_messages_router = Router()
+user_messages_router.message.middleware(BannedUserMiddleware())
 
 # Исключаем команды
 user_messages_router.message.filter(~F.text.startswith('/'))
@@ -22,15 +25,10 @@ user_messages_router.message.filter(StateFilter(None))
     ContentType.STICKER,
     ContentType.VIDEO_NOTE
 }))
-async def handle_unsupported_content(message: Message):
+async def handle_unsupported_content(message: Message, user_ctx: UserContext):
     """Сообщает пользователю о неподдерживаемых типах контента"""
     user_id = message.from_user.id
-    db = get_database_bot1()
-    users_collection = db.users
-    user = await users_collection.find_one({"id": user_id})
-
-    if user and user.get("banned") == "1":
-        return
+    user = user_ctx.user
 
     # Если пользователь не найден - создаем нового
     if not user:
@@ -41,7 +39,8 @@ async def handle_unsupported_content(message: Message):
             "role": "user",
             "banned": "0"
         }
-        await users_collection.insert_one(new_user)
+        await get_database_bot1().users.insert_one(new_user)
+        user_ctx.user = new_user
     # Пропускаем служебные сообщения
     if not message.from_user:
         return
@@ -69,49 +68,45 @@ async def handle_unsupported_content(message: Message):
     ContentType.PHOTO,
     ContentType.DOCUMENT
 }))
-async def handle_user_message(message: Message):
+async def handle_user_message(message: Message, user_ctx: UserContext):
     """Обрабатывает только текст, фото и документы"""
-    user_id = message.from_user.id
-    db = get_database_bot1()
-    users_collection = db.users
-    user = await users_collection.find_one({"id": user_id})
-
-    if user and user.get("banned") == "1":
-        return
-
-    # Если пользователь не найден - создаем нового
-    if not user:
-        new_user = {
-            "id": user_id,
-            "username": message.from_user.username or "",
-            "full_name": message.from_user.full_name,
-            "role": "user",
-            "banned": "0"
-        }
-        await users_collection.insert_one(new_user)
     # Пропускаем служебные сообщения
     if not message.from_user:
         return
 
+    user_id = message.from_user.id
     username = message.from_user.username
     full_name = get_full_name(message.from_user)
 
-    try:
-        # Получаем следующий ID сообщения
-        next_id = await get_next_message_id()
+    # Нового пользователя создаст upsert в пачке записи, существующего обновляем только при изменениях
+    profile = {"username": username, "full_name": full_name, "role": "user", "banned": "0"}
+    user = user_ctx.user
+    profile_changed = (
+        not user
+        or any(user.get(key) != value for key, value in profile.items())
+        or bool(user.get("unreachable"))
+    )
 
+    try:
         # Определяем тип контента и извлекаем данные
         message_data = await extract_message_data_simple(message)
 
-        # Сохраняем сообщение в MongoDB
-        await save_user_message(
+        # Сохраняем сообщение в MongoDB (пачкой вместе с сообщениями других пользователей)
+        await ingest_writer.write(IncomingMessage(
             user_id=user_id,
             username=username,
             full_name=full_name,
             message_data=message_data,
-            message_id=next_id
-        )
+            profile_changed=profile_changed
+        ))
 
+        # Кэш контекста — в то состояние, которое теперь в базе
+        if user is None:
+            user_ctx.user = {"id": user_id, **profile}
+        elif profile_changed:
+            user.update(profile)
+            user.pop("unreachable", None)
+            user.pop("unreachable_at", None)
 
         # logger.info(f"💾 Сохранено сообщение от {user_id}: {message_data['file_type']}")
 
@@ -249,95 +244,3 @@ def get_full_name(user):
     if user.last_name:
         full_name.append(user.last_name)
     return " ".join(full_name) if full_name else ""
-
-
-async def get_next_message_id() -> int:
-    """Атомарное получение следующего ID через отдельную коллекцию счетчиков"""
-    db = get_database_bot1()
-    counters_collection = db["counters"]
-
-    try:
-        # Атомарно инкрементируем счетчик
-        result = await counters_collection.find_one_and_update(
-            {"_id": "message_id"},
-            {"$inc": {"seq": 1}},
-            upsert=True,
-            return_document=True,
-            projection={"seq": 1}
-        )
-
-        return result["seq"]
-
-    except Exception as e:
-        logger.error(f"❌ Ошибка получения ID через счетчик: {e}")
-        # Fallback: пытаемся найти максимальный ID
-        messages_collection = db["messages"]
-        last_message = await messages_collection.find_one(
-            {},
-            sort=[("id", -1)],
-            projection={"id": 1}
-        )
-        return last_message["id"] + 1 if last_message else 1
-
-async def save_user_message(user_id: int, username: str, full_name: str,
-                            message_data: dict, message_id: int):
-    """Сохраняет сообщение пользователя и обновляет chat_dialogs"""
-
-    db = get_database_bot1()
-    messages_collection = db["messages"]
-    users_collection = db["users"]
-    dialogs_collection = db["chat_dialogs"]
-
-    now = datetime.now(timezone.utc)
-
-    # --- 1. Сохраняем сообщение ---
-    message_doc = {
-        "from_id": user_id,
-        "message_object": message_data["message_object"],
-        "checked": "0",
-        "date": now,
-        "file_id": message_data["file_id"],
-        "file_type": message_data["file_type"],
-        "from_operator": "0",
-        "id": message_id,
-        "file_name": message_data["file_name"],
-        "file_size": message_data["file_size"],
-        "mime_type": message_data["mime_type"]
-    }
-
-    await messages_collection.insert_one(message_doc)
-
-    # --- 2. Обновляем пользователя ---
-    await users_collection.update_one(
-        {"id": user_id},
-        {
-            "$set": {
-                "username": username,
-                "full_name": full_name,
-                "role": "user",
-                "banned": "0"
-            },
-            "$setOnInsert": {"id": user_id}
-        },
-        upsert=True
-    )
-
-    # --- 3. ОБНОВЛЯЕМ CHAT DIALOG  ---
-    await dialogs_collection.update_one(
-        {"user_id": user_id},
-        {
-            "$set": {
-                "username": username or "",
-                "full_name": full_name or "",
-                "last_message_text": message_data["message_object"][:200],
-                "last_message_date": now,
-                "last_message_type": message_data["file_type"],
-                "banned": "0"
-            },
-            "$inc": {
-                "message_count": 1,
-                "unread_count": 1   # новое сообщение от пользователя
-            }
-        },
-        upsert=True
-    )
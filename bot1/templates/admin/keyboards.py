@@ -4,6 +4,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from utils.segments import SEGMENTS
+
 def start_admin_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="Создание рассылки", callback_data="start_mailing")
@@ -12,6 +14,16 @@ def start_admin_kb() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def mailing_segments_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="👥 Все пользователи", callback_data="mailing_segment_all")
+    for segment, title in SEGMENTS.items():
+        builder.button(text=title, callback_data=f"mailing_segment_{segment}")
+    builder.button(text="⬅️ Назад", callback_data="admin_back")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
 def products_management_kb():
     keyboard = InlineKeyboardBuilder()
     keyboard.button(text="➕ Добавить новый товар", callback_data="add_new_product")
@@ -1,6 +1,7 @@
 from aiogram.fsm.state import StatesGroup, State
 
 class AdminMailingState(StatesGroup):
+    waiting_segment_param = State()
     waiting_message_to_mailing = State()
 
 class ProductStates(StatesGroup):
@@ -114,6 +114,10 @@ class MysqlConfig(BaseSettings):
     USER: str
     PASSWORD: str
     DATABASE: str
+    POOL_MIN_SIZE: int = 1
+    POOL_MAX_SIZE: int = 10
+    POOL_RECYCLE: int = 3600  # секунд; переподключение раньше wait_timeout сервера
+    CONNECT_TIMEOUT: int = 5
 
     @property
     def URL(self) -> str:
@@ -135,6 +139,146 @@ class KonsolConfig(BaseSettings):
         extra = 'ignore'
 
 
+class ArchiveConfig(BaseSettings):
+    DIR: Path = Path(__file__).parent / 'data' / 'archive'
+    BATCH_SIZE: int = 500
+    BATCH_PAUSE: float = 0.05
+    RETENTION_DAYS: int = 0  # 0 — архивация старых сообщений выключена
+    RETENTION_INTERVAL: int = 6 * 60 * 60
+
+    class Config:
+        env_prefix = 'ARCHIVE_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class BroadcastConfig(BaseSettings):
+    RATE: float = 25  # сообщений в секунду на бота (лимит Telegram ~30)
+    PER_CHAT_INTERVAL: float = 1.0
+    CONCURRENCY: int = 10
+    BATCH_SIZE: int = 200
+    MAX_ATTEMPTS: int = 5
+    PROGRESS_INTERVAL: float = 5.0
+    REPROBE_DAYS: int = 30  # через сколько дней перепроверять недоступных
+    REPROBE_INTERVAL: int = 24 * 60 * 60
+    SEGMENT_MAX_AGE: int = 10 * 60  # сколько секунд снимок сегмента можно переиспользовать
+    SNAPSHOT_TTL_DAYS: int = 7  # через сколько дней снимки удаляются из базы
+
+    class Config:
+        env_prefix = 'BROADCAST_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class CacheConfig(BaseSettings):
+    USER_TTL: int = 300  # секунд жизни контекста пользователя в кэше бота
+    USER_MAX_SIZE: int = 50_000
+    INVALIDATION_LOG_SIZE: int = 1024 * 1024  # байт, capped-коллекция инвалидаций
+    FSM_TTL: int = 600  # секунд жизни состояния FSM в памяти
+    FSM_MAX_SIZE: int = 50_000
+
+    class Config:
+        env_prefix = 'CACHE_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class CodesConfig(BaseSettings):
+    FILTER_ENABLED: bool = True
+    FALSE_POSITIVE_RATE: float = 0.001
+    REFRESH_INTERVAL: int = 60  # догрузка новых кодов, сек.
+    REBUILD_INTERVAL: int = 6 * 60 * 60  # полная пересборка фильтра, сек.
+    MISS_REFRESH_AFTER: int = 10  # при промахе фильтр старше этого обновляется перед отказом
+    REFRESH_LOOKBACK: int = 1000  # сколько id ниже последнего перечитывать (транзакции коммитятся не по порядку id)
+    BATCH_SIZE: int = 10_000
+    ATTEMPTS: int = 5  # неудачных попыток ввода кода на пользователя
+    ATTEMPTS_WINDOW: int = 10 * 60  # за сколько секунд
+
+    class Config:
+        env_prefix = 'CODES_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class WebhookConfig(BaseSettings):
+    ENABLED: bool = False  # по умолчанию боты работают через long polling
+    BASE_URL: str = ""  # публичный https-адрес, на который Telegram шлёт апдейты
+    SECRET: str = ""  # X-Telegram-Bot-Api-Secret-Token
+    HOST: str = "0.0.0.0"
+    BOT_PORT: int = 8081
+    BOT1_PORT: int = 8082
+    CONCURRENCY: int = 100  # апдейтов в обработке одновременно
+    DEDUP_SIZE: int = 10_000  # сколько последних update_id помнить для отсева повторов
+    MAX_CONNECTIONS: int = 40
+
+    class Config:
+        env_prefix = 'WEBHOOK_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class ShardConfig(BaseSettings):
+    # "" — обычный режим, "ingress" — принимает апдейты и кладёт в очередь, "worker" — обрабатывает
+    ROLE: str = ""
+    WORKER_ID: str = ""  # по умолчанию hostname:pid
+    PARTITIONS: int = 64
+    LEASE_TTL: int = 30  # сек.; воркер без heartbeat дольше этого считается упавшим
+    HEARTBEAT_INTERVAL: int = 5
+    BATCH_SIZE: int = 100
+    POLL_INTERVAL: float = 0.2  # пауза при пустой очереди, сек.
+
+    class Config:
+        env_prefix = 'SHARD_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class SchedulerConfig(BaseSettings):
+    CONCURRENCY: int = 200  # апдейтов в обработке одновременно на бота
+    USER_QUEUE_LIMIT: int = 50  # апдейтов в очереди одного пользователя, лишние отбрасываются
+    ALBUM_DEBOUNCE: float = 0.5  # сколько ждать следующую часть альбома, сек.
+
+    class Config:
+        env_prefix = 'SCHEDULER_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class SubscriptionConfig(BaseSettings):
+    # Сколько доверять записи реестра подписчиков канала, сек.
+    EVENT_TTL: int = 24 * 60 * 60  # получена из апдейта chat_member
+    API_TTL: int = 60 * 60  # получена через get_chat_member
+    NEGATIVE_TTL: int = 60  # «не подписан»: пользователь может подписаться в любой момент
+
+    class Config:
+        env_prefix = 'SUBSCRIPTION_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class IngestConfig(BaseSettings):
+    FLUSH_DELAY: float = 0.005  # сколько копить входящие сообщения бота-1 перед записью, сек.
+    MAX_BATCH: int = 500
+
+    class Config:
+        env_prefix = 'INGEST_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
+class OutboundConfig(BaseSettings):
+    RATE: float = 25  # сообщений в секунду на бота из админки
+    PER_CHAT_INTERVAL: float = 1.0  # минимум между сообщениями в один чат, сек.
+    MAX_ATTEMPTS: int = 3  # попыток отправки при 429 и сетевых ошибках
+    REDELIVERY_INTERVAL: int = 30  # как часто переотправлять недоставленные сообщения, сек.
+    REDELIVERY_MAX_ATTEMPTS: int = 10
+
+    class Config:
+        env_prefix = 'OUTBOUND_'
+        env_file = '.env'
+        extra = 'ignore'
+
+
 class Config:
     mongo = MongoConfig()
     mongo_bot1 = MongoBot1Config()
@@ -143,6 +287,16 @@ class Config:
     proj = ProjConfig()
     mysql = MysqlConfig()
     konsol = KonsolConfig()
+    archive = ArchiveConfig()
+    broadcast = BroadcastConfig()
+    cache = CacheConfig()
+    codes = CodesConfig()
+    webhook = WebhookConfig()
+    shard = ShardConfig()
+    scheduler = SchedulerConfig()
+    subscription = SubscriptionConfig()
+    ingest = IngestConfig()
+    outbound = OutboundConfig()
 
 
 cnf = Config()
@@ -3,11 +3,22 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from config import cnf, BotConfig
+from core.session import session
+from utils.scheduler import UpdateScheduler
+from utils.database import get_database
+from utils.media_registry import MediaRegistry
 
 bot = Bot(
     token=cnf.bot.TOKEN,
+    session=session,
     default=DefaultBotProperties(
         parse_mode=ParseMode.HTML
     )
 )
 bot_config = BotConfig()
+
+# Видео и прочие файлы бота: загружаются в Telegram один раз, дальше по file_id
+media = MediaRegistry(get_database)
+
+# Очередь апдейтов: по порядку для каждого пользователя, общий лимит параллельности
+scheduler = UpdateScheduler("bot")
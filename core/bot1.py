@@ -3,11 +3,22 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from config import cnf, Bot1Config
+from core.session import session
+from utils.scheduler import UpdateScheduler
+from utils.database import get_database_bot1
+from utils.media_registry import MediaRegistry
 
 bot1 = Bot(
     token=cnf.bot1.TOKEN,
+    session=session,
     default=DefaultBotProperties(
         parse_mode=ParseMode.HTML
     )
 )
 bot_config = Bot1Config()
+
+# Файлы, которые операторы отправляют из админки: загружаются в Telegram один раз, дальше по file_id
+media = MediaRegistry(get_database_bot1)
+
+# Очередь апдейтов: по порядку для каждого пользователя, общий лимит параллельности
+scheduler = UpdateScheduler("bot1")
@@ -1,6 +1,19 @@
+from typing import Dict
+
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from config import cnf
 
+# Один клиент (и пул соединений) на адрес: в общем процессе (runner.py)
+# боты, их FSM и админка ходят в Mongo через одни и те же пулы
+_clients: Dict[str, AsyncIOMotorClient] = {}
+
+
+def get_client(url: str) -> AsyncIOMotorClient:
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = AsyncIOMotorClient(url)
+    return client
+
 
-client: AsyncIOMotorClient = AsyncIOMotorClient(cnf.mongo.URL)
\ No newline at end of file
+client: AsyncIOMotorClient = get_client(cnf.mongo.URL)
@@ -0,0 +1,5 @@
+from aiogram.client.session.aiohttp import AiohttpSession
+
+# Общий пул HTTP-соединений к Bot API для обоих ботов: токен входит в URL запроса,
+# поэтому одна сессия обслуживает любое число ботов
+session = AiohttpSession()
@@ -0,0 +1,280 @@
+"""
+Горизонтальное масштабирование бота лотереи.
+
+Процесс с ролью ingress получает апдейты (polling или webhook) и складывает их в update_queue,
+разбивая на партиции по хэшу пользователя. Воркеры делят партиции между собой
+rendezvous-хэшированием по списку живых воркеров и держат их через аренду (lease).
+Партиция обрабатывается строго последовательно одним воркером, поэтому порядок апдейтов
+и блокировки внутри процесса для каждого пользователя остаются корректными.
+Исключение — части одного альбома: они передаются в диспетчер одновременно, чтобы
+MediaGroupMiddleware собрал их в один вызов хендлера, как при polling.
+Упавший воркер перестаёт обновлять heartbeat, и после LEASE_TTL его партиции забирают остальные.
+Забрав партицию, воркер сбрасывает свои кэши (контекст, FSM) её пользователей:
+пока партиция была у другого воркера, данные в базе могли измениться.
+Доставка — не менее одного раза: апдейт удаляется из очереди после обработки.
+"""
+import asyncio
+import contextlib
+import hashlib
+import os
+import signal
+import socket
+import zlib
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject, Update
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from config import cnf
+from core.logger import bot_logger as logger
+from utils.database import get_database
+from utils.media_group import ALBUM_MAX_SIZE
+from utils.user_context import invalidate_where
+
+QUEUE_COLLECTION = "update_queue"
+WORKERS_COLLECTION = "shard_workers"
+PARTITIONS_COLLECTION = "shard_partitions"
+# scope кэшей контекста и FSM бота лотереи (см. utils.user_context)
+CACHE_SCOPE = "bot"
+
+
+def update_user_id(update: Update) -> int:
+    """Пользователь, к которому относится апдейт (для апдейтов без пользователя — чат)"""
+    event = update.event
+    from_user = getattr(event, "from_user", None)
+    if from_user:
+        return from_user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat else 0
+
+
+def media_group_of(document: dict) -> Optional[str]:
+    """media_group_id сообщения из документа очереди (части альбома)"""
+    return (document["update"].get("message") or {}).get("media_group_id")
+
+
+def partition_of(user_id: int) -> int:
+    return zlib.crc32(str(user_id).encode()) % cnf.shard.PARTITIONS
+
+
+def rendezvous_owner(partition: int, workers: List[str]) -> str:
+    """Воркер с наибольшим весом для партиции: при уходе воркера переезжают только его партиции"""
+    def weight(worker_id: str) -> int:
+        digest = hashlib.blake2b(f"{worker_id}:{partition}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    return max(workers, key=weight)
+
+
+class ShardIngressMiddleware(BaseMiddleware):
+    """Вместо обработки кладёт апдейт в очередь его партиции (регистрируется первым на dp.update)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user_id = update_user_id(event)
+        # _id создаётся до первого await: апдейты одного getUpdates получают id в порядке поступления
+        document = {
+            "_id": ObjectId(),
+            "partition": partition_of(user_id),
+            "user_id": user_id,
+            "update": event.model_dump(mode="json", exclude_none=True),
+            "created_at": datetime.now()
+        }
+        await get_database()[QUEUE_COLLECTION].insert_one(document)
+
+
+class ShardWorker:
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.worker_id = cnf.shard.WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
+        # Партиции, на которые у воркера есть аренда, и те, что должны быть его по rendezvous
+        self.owned: Set[int] = set()
+        self.wanted: Set[int] = set()
+        self.stats = {"processed": 0, "failed": 0}
+
+    @property
+    def _db(self):
+        return get_database()
+
+    async def ensure_indexes(self):
+        await self._db[QUEUE_COLLECTION].create_index([("partition", ASCENDING), ("_id", ASCENDING)])
+        await self._db[PARTITIONS_COLLECTION].create_index([("owner", ASCENDING)])
+
+    async def heartbeat(self):
+        now = datetime.now()
+        lease_until = now + timedelta(seconds=cnf.shard.LEASE_TTL)
+        workers = self._db[WORKERS_COLLECTION]
+        partitions = self._db[PARTITIONS_COLLECTION]
+
+        await workers.update_one({"_id": self.worker_id}, {"$set": {"heartbeat_at": now}}, upsert=True)
+        alive_since = now - timedelta(seconds=cnf.shard.LEASE_TTL)
+        live = sorted({
+            worker["_id"] async for worker in workers.find({"heartbeat_at": {"$gte": alive_since}})
+        } | {self.worker_id})
+        self.wanted = {p for p in range(cnf.shard.PARTITIONS) if rendezvous_owner(p, live) == self.worker_id}
+
+        # Продлеваем аренду и проверяем, что её никто не забрал
+        await partitions.update_many(
+            {"owner": self.worker_id},
+            {"$set": {"lease_until": lease_until}}
+        )
+        held = {doc["_id"] async for doc in partitions.find({"owner": self.worker_id}, projection={"_id": 1})}
+        for partition in self.owned - held:
+            logger.warning(f"⚠️ Воркер {self.worker_id} потерял партицию {partition}")
+        self.owned &= held
+
+        # Забираем свободные и просроченные партиции, которые теперь наши
+        acquired = set()
+        for partition in self.wanted - self.owned:
+            try:
+                result = await partitions.update_one(
+                    {"_id": partition, "$or": [{"owner": None}, {"lease_until": {"$lt": now}}]},
+                    {"$set": {"owner": self.worker_id, "lease_until": lease_until}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # Партицию ещё держит другой воркер — освободит после текущей пачки
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                acquired.add(partition)
+
+        if acquired:
+            # Кэш мог остаться с прошлого владения партицией и устареть, а буферизованная
+            # запись FSM из него затёрла бы изменения другого воркера
+            invalidate_where(CACHE_SCOPE, lambda user_id: partition_of(user_id) in acquired)
+            self.owned |= acquired
+
+    async def release(self, partitions: Set[int]):
+        if not partitions:
+            return
+        await self._db[PARTITIONS_COLLECTION].update_many(
+            {"_id": {"$in": list(partitions)}, "owner": self.worker_id},
+            {"$set": {"owner": None, "lease_until": datetime.now()}}
+        )
+        self.owned -= partitions
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self.heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка heartbeat воркера {self.worker_id}: {e}")
+            await asyncio.sleep(cnf.shard.HEARTBEAT_INTERVAL)
+
+    async def _feed(self, document: dict):
+        try:
+            update = Update.model_validate(document["update"], context={"bot": self.bot})
+            await self.dp.feed_update(self.bot, update)
+            self.stats["processed"] += 1
+        except Exception as e:
+            # Апдейт с ошибкой не должен блокировать партицию
+            self.stats["failed"] += 1
+            logger.error(f"❌ Ошибка обработки апдейта из очереди {document['_id']}: {e}", exc_info=True)
+
+    async def _process_album(self, media_group_id: str, documents: List[dict]):
+        """
+        Части альбома — в диспетчер одновременно: по одной первая часть в одиночку отождала бы
+        ALBUM_DEBOUNCE в MediaGroupMiddleware, а остальные ушли бы мимо хендлера альбома.
+        Пока альбом собирается, из очереди подбираются части, которые ingress положил после чтения пачки.
+        """
+        queue = self._db[QUEUE_COLLECTION]
+        partition = documents[0]["partition"]
+        seen = [document["_id"] for document in documents]
+        tasks = [asyncio.create_task(self._feed(document)) for document in documents]
+
+        while len(seen) < ALBUM_MAX_SIZE:
+            pending = [task for task in tasks if not task.done()]
+            if not pending:
+                break
+            await asyncio.wait(pending, timeout=cnf.scheduler.ALBUM_DEBOUNCE / 2)
+            late = await queue.find({
+                "partition": partition,
+                "update.message.media_group_id": media_group_id,
+                "_id": {"$nin": seen}
+            }).sort("_id", ASCENDING).to_list(length=None)
+            for document in late:
+                seen.append(document["_id"])
+                tasks.append(asyncio.create_task(self._feed(document)))
+
+        await asyncio.gather(*tasks)
+        await queue.delete_many({"_id": {"$in": seen}})
+
+    async def _process_partition(self, documents: List[dict]):
+        queue = self._db[QUEUE_COLLECTION]
+        albums: Dict[str, List[dict]] = {}
+        for document in documents:
+            media_group_id = media_group_of(document)
+            if media_group_id:
+                albums.setdefault(media_group_id, []).append(document)
+
+        for document in documents:
+            media_group_id = media_group_of(document)
+            if media_group_id:
+                # Альбом целиком обрабатывается на месте первой части
+                parts = albums.pop(media_group_id, None)
+                if parts:
+                    await self._process_album(media_group_id, parts)
+                continue
+            await self._feed(document)
+            await queue.delete_one({"_id": document["_id"]})
+
+    async def process_batch(self) -> int:
+        active = self.owned & self.wanted
+        if not active:
+            return 0
+
+        documents = await self._db[QUEUE_COLLECTION].find(
+            {"partition": {"$in": list(active)}}
+        ).sort("_id", ASCENDING).limit(cnf.shard.BATCH_SIZE).to_list(length=None)
+
+        # Партиции — параллельно, внутри партиции — по порядку
+        by_partition = groupby(sorted(documents, key=lambda d: (d["partition"], d["_id"])), key=lambda d: d["partition"])
+        await asyncio.gather(*(self._process_partition(list(group)) for _, group in by_partition))
+        return len(documents)
+
+    async def run(self, stop: asyncio.Event):
+        await self.ensure_indexes()
+        await self.heartbeat()
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"🧩 Воркер {self.worker_id} запущен")
+        try:
+            while not stop.is_set():
+                # Отдаём партиции, которые по rendezvous теперь чужие, только между пачками
+                await self.release(self.owned - self.wanted)
+                if not await self.process_batch():
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(stop.wait(), cnf.shard.POLL_INTERVAL)
+        finally:
+            heartbeat_task.cancel()
+            await self.release(set(self.owned))
+            await self._db[WORKERS_COLLECTION].delete_one({"_id": self.worker_id})
+            logger.info(f"🧩 Воркер {self.worker_id} остановлен: {self.stats}")
+
+
+async def run_shard_worker(dp: Dispatcher, bot: Bot):
+    """Точка входа воркера: startup/shutdown диспетчера как при polling, апдейты — из очереди"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    workflow_data.pop("bot", None)
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await ShardWorker(dp, bot).run(stop)
+    finally:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
@@ -0,0 +1,152 @@
+import asyncio
+import hmac
+from collections import OrderedDict
+from typing import Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+
+from config import cnf
+from core.logger import bot_logger as logger
+from utils.scheduler import ON_SCHEDULED
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_path(scope: str) -> str:
+    return f"/webhook/{scope}"
+
+
+def webhook_url(scope: str) -> str:
+    return cnf.webhook.BASE_URL.rstrip("/") + webhook_path(scope)
+
+
+class UpdateDeduplicator:
+    """Последние update_id: Telegram повторяет апдейт, если не дождался ответа"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._seen: OrderedDict[int, None] = OrderedDict()
+
+    def seen(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return False
+
+
+class WebhookHandler:
+    """
+    Принимает апдейты по HTTP и передаёт их в тот же Dispatcher, что и polling.
+    Ответ Telegram отдаётся сразу, обработка идёт в фоне. Слот (CONCURRENCY) занят, пока апдейт
+    не дошёл до UpdateScheduler, — дальше очередь пользователя и общий лимит держит планировщик,
+    и пользователь, засыпающий бота апдейтами, не занимает слоты остальных.
+    Когда все слоты заняты, ответ задерживается — Telegram сам притормаживает отправку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, scope: str):
+        self.dp = dp
+        self.bot = bot
+        self.scope = scope
+        self._dedup = UpdateDeduplicator(cnf.webhook.DEDUP_SIZE)
+        self._semaphore = asyncio.Semaphore(cnf.webhook.CONCURRENCY)
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"received": 0, "duplicates": 0, "failed": 0}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        secret = cnf.webhook.SECRET
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"⚠️ Некорректный апдейт на webhook {self.scope}: {e}")
+            return web.Response(status=400)
+
+        self.stats["received"] += 1
+        if self._dedup.seen(update.update_id):
+            self.stats["duplicates"] += 1
+            return web.json_response({})
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({})
+
+    async def _process(self, update: Update):
+        released = False
+
+        def release_slot():
+            nonlocal released
+            if not released:
+                released = True
+                self._semaphore.release()
+
+        try:
+            result = await self.dp.feed_update(self.bot, update, **{ON_SCHEDULED: release_slot})
+            if isinstance(result, TelegramMethod):
+                await self.dp.silent_call_request(bot=self.bot, result=result)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"❌ Ошибка обработки апдейта {update.update_id} ({self.scope}): {e}", exc_info=True)
+        finally:
+            # Апдейт не дошёл до планировщика (отброшен раньше) или упал до него
+            release_slot()
+
+    async def close(self, app: web.Application = None):
+        """Дожидается апдейтов, которые уже в обработке"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info(f"📥 Webhook {self.scope}: {self.stats}")
+
+
+async def configure_updates(bot: Bot, dp: Dispatcher, scope: str):
+    """Вызывается из startup: в режиме webhook регистрирует адрес, иначе снимает webhook для polling"""
+    if cnf.shard.ROLE == "worker":
+        # Воркеры шардов получают апдейты из очереди, настройки доставки — дело ingress
+        return
+
+    if not cnf.webhook.ENABLED:
+        await bot.delete_webhook()
+        return
+
+    if not cnf.webhook.BASE_URL:
+        # Локальный запуск: апдейты шлёт utils/webhook_emulator.py
+        logger.warning(f"⚠️ WEBHOOK_BASE_URL не задан, webhook {scope} в Telegram не регистрируется")
+        return
+
+    await bot.set_webhook(
+        url=webhook_url(scope),
+        secret_token=cnf.webhook.SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=cnf.webhook.MAX_CONNECTIONS
+    )
+    logger.info(f"🌐 Webhook {scope}: {webhook_url(scope)}")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, scope: str, port: int):
+    """Поднимает aiohttp-сервер для апдейтов; startup/shutdown диспетчера — через жизненный цикл приложения"""
+    handler = WebhookHandler(dp, bot, scope)
+
+    app = web.Application()
+    app.router.add_post(webhook_path(scope), handler.handle)
+    # Сначала дожидаемся обработки, потом закрываем ресурсы в shutdown диспетчера
+    app.on_shutdown.append(handler.close)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, cnf.webhook.HOST, port).start()
+    logger.info(f"🌐 Webhook {scope} слушает {cnf.webhook.HOST}:{port}{webhook_path(scope)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
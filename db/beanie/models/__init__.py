@@ -1,3 +1,3 @@
-from .models import User, AdminMessage, Claim, KonsolPayment, ChatSession, UserMessage, Administrators, ChatMessage, SupportMessage, SupportSession
+from .models import User, AdminMessage, Claim, KonsolPayment, ChatSession, UserMessage, Administrators, ChatMessage, SupportMessage, SupportSession, MediaFile, ChannelMember, SupportSnapshot
 
-document_models = [User, Claim, AdminMessage, KonsolPayment, ChatSession, ChatMessage, UserMessage, Administrators, SupportMessage, SupportSession]
+document_models = [User, Claim, AdminMessage, KonsolPayment, ChatSession, ChatMessage, UserMessage, Administrators, SupportMessage, SupportSession, MediaFile, ChannelMember, SupportSnapshot]
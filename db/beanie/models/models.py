@@ -5,8 +5,9 @@ from datetime import datetime
 from decimal import Decimal
 from beanie import Document, PydanticObjectId
 from typing import get_origin, get_args, Optional
-from pydantic import TypeAdapter, ValidationError, Field, ConfigDict
+from pydantic import TypeAdapter, ValidationError, Field, ConfigDict, model_validator
 from typing import get_type_hints
+from pymongo import IndexModel, ASCENDING
 
 
 # Базовый класс для CRUD-операций
@@ -118,16 +119,23 @@ class AdminMessage(ModelAdmin):
 class User(ModelAdmin):
     tg_id: int
     username: Optional[str] = None
+    username_lower: Optional[str] = None  # username в нижнем регистре — для поиска по префиксу без учёта регистра
     role: str = "user"
     banned: bool = False
     # === Поля для Konsol API ===
     kind: str = "individual"  # всегда "individual"
     created_at: datetime = Field(default_factory=lambda: datetime.now())
 
+    @model_validator(mode="after")
+    def _fill_username_lower(self):
+        self.username_lower = self.username.lower() if self.username else None
+        return self
+
     class Settings:
         name = "users"
         indexes = ["tg_id",
                    "username",
+                   "username_lower",
                    "banned"]
 
 
@@ -146,6 +154,7 @@ class Claim(ModelAdmin):
     phone: Optional[str] = None  # если выбрана СБП
     bank: Optional[str] = None
     card: Optional[str] = None  # если выбрана карта
+    card_last4: Optional[str] = None  # последние 4 цифры карты — для поиска
     bank_member_id: Optional[str] = None  # если выбрана СБП
 
     review_text: str = ""
@@ -164,7 +173,12 @@ class Claim(ModelAdmin):
             "claim_id",
             "user_id",
             "process_status",
-            [("created_at", -1)]
+            [("created_at", -1)],
+            # Единый поиск (api/router/search.py)
+            "code",
+            "phone",
+            "card",
+            "card_last4"
         ]
 
     def update_status(self, claim_status: str, process_status: str):
@@ -234,6 +248,11 @@ class ChatSession(Document):
 
     class Settings:
         name = "chat_sessions"
+        indexes = [
+            # Активная сессия пользователя с последним взаимодействием
+            [("user_id", 1), ("is_active", 1), ("last_interaction", -1)],
+            [("claim_id", 1), ("is_active", 1)]
+        ]
 
 class UserMessage(Document):
     user_id: int
@@ -302,12 +321,16 @@ class SupportSession(Document):
     previous_state: Optional[str] = None
     previous_state_data: Optional[dict] = None
     rollback_count: Optional[int] = None
+    # Снимок FSM на момент обращения (SupportSnapshot)
+    snapshot_id: Optional[PydanticObjectId] = None
 
     class Settings:
         name = "support_sessions"
         indexes = [
             [("user_id", 1), ("resolved", 1)],
-            [("created_at", -1)]
+            [("created_at", -1)],
+            # Дашборд поддержки: вкладка + курсор по created_at
+            [("resolved", 1), ("created_at", -1), ("_id", -1)]
         ]
 
 
@@ -337,3 +360,55 @@ class SupportMessage(Document):
             [("session_id", 1), ("timestamp", 1)],
             [("user_id", 1), ("timestamp", 1)],
         ]
+
+
+class SupportSnapshot(Document):
+    """
+    Состояние FSM пользователя на момент обращения в поддержку (см. utils.support_snapshot).
+    Хранится один раз на одинаковое содержимое; FSM и сессия ссылаются на него по id
+    """
+    user_id: int
+    state: Optional[str] = None
+    data: Dict[str, Any] = Field(default_factory=dict)
+    content_hash: str
+    version: int  # порядковый номер снимка пользователя
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+
+    class Settings:
+        name = "support_snapshots"
+        indexes = [
+            IndexModel([("user_id", ASCENDING), ("content_hash", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING), ("version", -1)]),
+        ]
+
+
+class MediaFile(Document):
+    """Файл, уже загруженный в Telegram этим ботом (см. utils.media_registry)"""
+    sha256: str
+    kind: str  # photo, video, audio, document
+    file_id: str
+    name: Optional[str] = None
+    size: Optional[int] = None
+    uploaded_at: datetime = Field(default_factory=lambda: datetime.now())
+
+    class Settings:
+        name = "media_files"
+        indexes = [
+            IndexModel([("sha256", ASCENDING), ("kind", ASCENDING)], unique=True),
+        ]
+
+
+class ChannelMember(Document):
+    """Подписка пользователя на канал: из апдейтов chat_member или из проверки через Bot API"""
+    channel: str  # как в BOT_CHANNEL_USERNAME, в нижнем регистре
+    user_id: int
+    is_member: bool
+    status: str
+    source: str  # event, api
+    updated_at: datetime = Field(default_factory=lambda: datetime.now())
+
+    class Settings:
+        name = "channel_members"
+        indexes = [
+            IndexModel([("channel", ASCENDING), ("user_id", ASCENDING)], unique=True),
+        ]
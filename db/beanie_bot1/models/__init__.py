@@ -1,4 +1,10 @@
-from .models import Users, Products, Messages
+from .models import (
+    Users, Products, Messages, ChatDeleteJob, Broadcast, BroadcastRecipient,
+    AudienceSnapshot, AudienceSnapshotMember, MediaFile
+)
 
 
-document_models = [Users, Products, Messages]
\ No newline at end of file
+document_models = [
+    Users, Products, Messages, ChatDeleteJob, Broadcast, BroadcastRecipient,
+    AudienceSnapshot, AudienceSnapshotMember, MediaFile
+]
@@ -2,7 +2,7 @@ import secrets
 from typing import List, Dict, Any, Union
 from datetime import datetime
 from decimal import Decimal
-from beanie import Document
+from beanie import Document, PydanticObjectId
 from typing import get_origin, get_args, Optional
 from pydantic import TypeAdapter, ValidationError, Field, ConfigDict
 from typing import get_type_hints
@@ -15,13 +15,24 @@ class Users(Document):
     full_name: Optional[str] = None
     role: str = "user"
     banned: str = "0"
+    # Причина недоступности для рассылок: blocked, deactivated, chat_not_found
+    unreachable: Optional[str] = None
+    unreachable_at: Optional[datetime] = None
+    # Товары, которые пользователь открывал по ссылке /start <id>
+    opened_products: List[int] = []
 
     class Settings:
         name = "users"
         indexes = [
             IndexModel([("id", ASCENDING)], unique=True),
             IndexModel([("username", ASCENDING)]),
-            IndexModel([("banned", ASCENDING)])
+            IndexModel([("banned", ASCENDING)]),
+            # Аудитория рассылки: доступные пользователи по возрастанию id
+            IndexModel([("unreachable", ASCENDING), ("id", ASCENDING)]),
+            # Повторная проверка недоступных
+            IndexModel([("unreachable_at", ASCENDING)], sparse=True),
+            # Сегмент «открывали товар»
+            IndexModel([("opened_products", ASCENDING)], sparse=True)
         ]
 
 class Products(Document):
@@ -63,6 +74,12 @@ class Messages(Document):
             # Для поиска непрочитанных сообщений
             IndexModel([("checked", ASCENDING), ("from_id", ASCENDING)]),
 
+            # Медиа-сообщения, перенесённые в архив (есть только у заглушек архива)
+            IndexModel([("media_ids", ASCENDING)], sparse=True),
+
+            # Сегмент «писали за последние N дней» (покрывающий индекс)
+            IndexModel([("from_operator", ASCENDING), ("date", DESCENDING), ("from_id", ASCENDING)]),
+
             # # Уникальный индекс для id сообщения
             # IndexModel([("id", ASCENDING)], unique=True)
         ]
@@ -93,6 +110,117 @@ class ChatDialog(Document):
         ]
 
 
+class ChatDeleteJob(Document):
+    """Фоновая задача удаления (и архивации) чата"""
+    user_id: int
+    archive: bool = False
+    status: str = "pending"  # pending, running, done, failed
+    deleted_messages: int = 0
+    archive_path: Optional[str] = None
+    restored: bool = False
+    error: Optional[str] = None
+    # Удаляются сообщения с date не позже cutoff (UTC); пришедшие после создания задачи остаются
+    cutoff: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+    finished_at: Optional[datetime] = None
+
+    class Settings:
+        name = "chat_delete_jobs"
+        indexes = [
+            IndexModel([("status", ASCENDING)]),
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        ]
+
+
+class Broadcast(Document):
+    """Рассылка: копия сообщения администратора всем активным пользователям"""
+    admin_chat_id: int
+    source_message_id: int
+    progress_message_id: Optional[int] = None
+    status: str = "pending"  # pending, running, done, failed
+    cursor: int = 0  # последний обработанный users.id
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    unreachable: int = 0  # из failed: заблокировали бота, удалены и т.п.
+    segment: Optional[str] = None  # None — все пользователи
+    snapshot_id: Optional[PydanticObjectId] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+    finished_at: Optional[datetime] = None
+
+    class Settings:
+        name = "broadcasts"
+        indexes = [
+            IndexModel([("status", ASCENDING)]),
+        ]
+
+
+class AudienceSnapshot(Document):
+    """Материализованный сегмент аудитории рассылки"""
+    segment: str  # active, product, unread
+    param: Optional[int] = None  # дни для active, id товара для product
+    status: str = "building"  # building, ready
+    total: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+    expires_at: datetime
+
+    class Settings:
+        name = "audience_snapshots"
+        indexes = [
+            IndexModel([("segment", ASCENDING), ("param", ASCENDING), ("created_at", DESCENDING)]),
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ]
+
+
+class AudienceSnapshotMember(Document):
+    """Пользователь, попавший в снимок сегмента"""
+    snapshot_id: PydanticObjectId
+    user_id: int
+    expires_at: datetime
+
+    class Settings:
+        name = "audience_snapshot_members"
+        indexes = [
+            IndexModel([("snapshot_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ]
+
+
+class BroadcastRecipient(Document):
+    """Результат доставки рассылки одному пользователю"""
+    broadcast_id: PydanticObjectId
+    user_id: int
+    status: str  # sent, failed
+    reason: Optional[str] = None  # blocked, deactivated, chat_not_found, transient
+    error: Optional[str] = None
+    attempts: int = 1
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+
+    class Settings:
+        name = "broadcast_recipients"
+        indexes = [
+            IndexModel([("broadcast_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+            IndexModel([("broadcast_id", ASCENDING), ("status", ASCENDING)]),
+        ]
+
+
+class MediaFile(Document):
+    """Файл, уже загруженный в Telegram ботом-1 (см. utils.media_registry)"""
+    sha256: str
+    kind: str  # photo, video, audio, document
+    file_id: str
+    name: Optional[str] = None
+    size: Optional[int] = None
+    uploaded_at: datetime = Field(default_factory=lambda: datetime.now())
+
+    class Settings:
+        name = "media_files"
+        indexes = [
+            IndexModel([("sha256", ASCENDING), ("kind", ASCENDING)], unique=True),
+        ]
+
+
 class KonsolPayment(Document):
     """Модель для платежей konsol.pro"""
     konsol_id: Optional[str] = None
@@ -1,26 +1,63 @@
-import aiomysql
+import time
+from collections import deque
 from contextlib import asynccontextmanager
+
+import aiomysql
+
 from config import cnf
 
+# Пул соединений создаётся в init_mysql() при старте бота
+_pool = None
 
-@asynccontextmanager
-async def get_connection():
-    conn = await aiomysql.connect(
+# Метрики погашения кодов
+_stats = {
+    "calls": 0,
+    "redeemed": 0,
+    "not_found": 0,
+    "errors": 0,
+}
+_latencies_ms = deque(maxlen=1000)
+
+
+def _connection_kwargs() -> dict:
+    return dict(
         host=cnf.mysql.HOST,
         port=cnf.mysql.PORT,
         user=cnf.mysql.USER,
         password=cnf.mysql.PASSWORD,
         db=cnf.mysql.DATABASE,
         charset='utf8mb4',
-        autocommit=True
+        autocommit=True,
+        connect_timeout=cnf.mysql.CONNECT_TIMEOUT
     )
-    try:
+
+
+@asynccontextmanager
+async def get_connection():
+    # Без пула (скрипты, админка) — одноразовое соединение, как раньше
+    if _pool is None:
+        conn = await aiomysql.connect(**_connection_kwargs())
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    async with _pool.acquire() as conn:
         yield conn
-    finally:
-        conn.close()
 
 
 async def init_mysql():
+    global _pool
+
+    if _pool is None:
+        _pool = await aiomysql.create_pool(
+            minsize=cnf.mysql.POOL_MIN_SIZE,
+            maxsize=cnf.mysql.POOL_MAX_SIZE,
+            pool_recycle=cnf.mysql.POOL_RECYCLE,
+            **_connection_kwargs()
+        )
+
     async with get_connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute("SHOW TABLES LIKE 'oc_qrcode'")
@@ -29,21 +66,103 @@ async def init_mysql():
                 raise Exception("Таблица oc_qrcode не найдена в базе MySQL!")
 
 
+async def close_mysql():
+    global _pool
+
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
 async def get_and_delete_code(code_text: str):
     """
-    Пытается найти код и сразу удалить его (атомарно).
-    Возвращает True, если код существовал и удалён.
+    Гасит код одним DELETE (атомарно).
+    Возвращает True, если код существовал и удалён именно этим вызовом.
     """
+    started = time.perf_counter()
+    _stats["calls"] += 1
+    try:
+        async with get_connection() as conn:
+            async with conn.cursor() as cur:
+                # Из двух одновременных попыток строку удалит только одна
+                await cur.execute("DELETE FROM oc_qrcode WHERE code_text = %s", (code_text,))
+                deleted = cur.rowcount
+    except Exception:
+        _stats["errors"] += 1
+        raise
+    finally:
+        _latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    if deleted:
+        _stats["redeemed"] += 1
+        return True
+
+    _stats["not_found"] += 1
+    return False
+
+
+async def detect_code_id_column():
+    """Автоинкрементный первичный ключ oc_qrcode (для догрузки новых кодов), если он есть"""
     async with get_connection() as conn:
         async with conn.cursor() as cur:
-            # Сначала проверяем наличие
-            await cur.execute("SELECT code_text FROM oc_qrcode WHERE code_text = %s", (code_text,))
-            exists = await cur.fetchone()
+            await cur.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'oc_qrcode' "
+                "AND COLUMN_KEY = 'PRI' AND EXTRA LIKE %s",
+                ("%auto_increment%",)
+            )
+            row = await cur.fetchone()
+            return row[0] if row else None
 
-            if not exists:
-                return False
 
-            # Удаляем код
-            await cur.execute("DELETE FROM oc_qrcode WHERE code_text = %s", (code_text,))
+async def fetch_codes(id_column: str = None, after_id: int = 0, batch_size: int = 10000):
+    """
+    Все коды из oc_qrcode пачками: [(id, code_text), ...].
+    С id_column читаются только строки с id > after_id; без него id в пачке — None.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor(aiomysql.SSCursor) as cur:
+            if id_column:
+                await cur.execute(
+                    f"SELECT `{id_column}`, code_text FROM oc_qrcode WHERE `{id_column}` > %s ORDER BY `{id_column}`",
+                    (after_id,)
+                )
+            else:
+                await cur.execute("SELECT NULL, code_text FROM oc_qrcode")
+
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def mysql_stats() -> dict:
+    """Состояние пула и задержки погашения кодов (последние 1000 вызовов)"""
+    latencies = sorted(_latencies_ms)
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+    pool = None
+    if _pool is not None:
+        pool = {
+            "size": _pool.size,
+            "free": _pool.freesize,
+            "min": _pool.minsize,
+            "max": _pool.maxsize,
+        }
 
-            return True
+    return {
+        **_stats,
+        "pool": pool,
+        "latency_ms": {
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1], 1) if latencies else 0.0,
+        },
+    }
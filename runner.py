@@ -0,0 +1,102 @@
+"""
+Оба бота и админка в одном процессе на одном event loop (uvloop, если установлен).
+Клиенты Mongo и пул HTTP-соединений к Bot API общие, хендлеры и FSM у каждого бота свои.
+
+    python -u runner.py
+"""
+import asyncio
+import contextlib
+import importlib.util
+import signal
+
+import uvicorn
+
+from config import cnf
+from core.logger import bot_logger as logger
+from core.session import session
+from core.webhook import run_webhook
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+API_HOST = "0.0.0.0"
+API_PORT = 8000
+
+
+def load_entrypoint(name: str, path: str):
+    """bot.py и bot1.py перекрыты одноимёнными пакетами bot/ и bot1/, поэтому грузим их по пути"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class AdminServer(uvicorn.Server):
+    """uvicorn без собственных обработчиков сигналов — остановкой управляет раннер"""
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+
+async def main() -> None:
+    bot_app = load_entrypoint("bot_app", "bot.py")
+    bot1_app = load_entrypoint("bot1_app", "bot1.py")
+    from web_admin import app
+    app.state.shared_bot_session = True
+
+    bots = [
+        (bot_app.dp, bot_app.bot, "bot", cnf.webhook.BOT_PORT),
+        (bot1_app.dp, bot1_app.bot1, "bot1", cnf.webhook.BOT1_PORT),
+    ]
+    server = AdminServer(uvicorn.Config(app, host=API_HOST, port=API_PORT))
+
+    tasks = {"api": asyncio.create_task(server.serve(), name="api")}
+    for dp, bot, scope, port in bots:
+        if cnf.webhook.ENABLED:
+            service = run_webhook(dp, bot, scope, port)
+        else:
+            # Сессия общая — закрываем её один раз, когда остановятся все
+            service = dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+        tasks[scope] = asyncio.create_task(service, name=scope)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    stop_waiter = asyncio.create_task(stop.wait())
+    done, _ = await asyncio.wait([*tasks.values(), stop_waiter], return_when=asyncio.FIRST_COMPLETED)
+    for task in done - {stop_waiter}:
+        # Один сервис упал — останавливаем остальные, чтобы контейнер перезапустился целиком
+        logger.error(f"❌ Сервис {task.get_name()} завершился: {task.exception() if not task.cancelled() else 'отменён'}")
+    stop_waiter.cancel()
+
+    logger.info("🛑 Остановка сервисов...")
+    server.should_exit = True
+    for dp, _, scope, _ in bots:
+        if cnf.webhook.ENABLED:
+            # run_webhook останавливается отменой: shutdown диспетчера идёт из cleanup приложения
+            tasks[scope].cancel()
+        else:
+            with contextlib.suppress(RuntimeError):
+                await dp.stop_polling()
+
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for name, result in zip(tasks, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Ошибка при остановке {name}: {result}")
+
+    await session.close()
+    logger.info("=== Runner stopped ===")
+
+
+if __name__ == "__main__":
+    run = uvloop.run if uvloop else asyncio.run
+    try:
+        run(main())
+    except KeyboardInterrupt:
+        logger.info('Exit')
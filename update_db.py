@@ -1,10 +1,13 @@
 import asyncio
+from utils.chat_archive import NOT_ARCHIVE_STUB
 from utils.database import init_database_bot1
 
 
 async def update_db():
     db = await init_database_bot1()
     pipeline = [
+        # Заглушки архива — не сообщения, в summary диалога их не считаем
+        {"$match": NOT_ARCHIVE_STUB},
         {"$sort": {"date": 1}},
         {"$group": {
             "_id": "$from_id",
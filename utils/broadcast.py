@@ -0,0 +1,348 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import Message
+from pymongo.errors import DuplicateKeyError
+
+from config import cnf
+from core.logger import bot_1_logger as logger
+from db.beanie_bot1.models import Broadcast, BroadcastRecipient
+from utils.database import get_database_bot1
+from utils.rate_limit import KeyedRateLimiter, TokenBucket
+from utils.segments import extend_snapshot, get_snapshot, reachable_filter, segment_title
+
+# Общие для всех рассылок лимиты Telegram
+_global_bucket = TokenBucket(cnf.broadcast.RATE)
+_chat_limiter = KeyedRateLimiter(cnf.broadcast.PER_CHAT_INTERVAL)
+
+# Ссылки на запущенные рассылки, чтобы их не собрал GC
+_running = set()
+
+# Как часто рассылка продлевает TTL своего снимка аудитории, сек.
+SNAPSHOT_EXTEND_INTERVAL = 3600
+
+# Причины, по которым пользователю бессмысленно слать следующие рассылки
+UNREACHABLE_REASONS = ("blocked", "deactivated", "chat_not_found")
+
+
+def audience_query(cursor: int = 0) -> dict:
+    """Получатели рассылки: незаблокированные и доступные пользователи после cursor"""
+    return {**reachable_filter(), "id": {"$gt": cursor}}
+
+
+def classify_error(error: TelegramAPIError) -> str:
+    """Причина ошибки доставки: blocked, deactivated, chat_not_found или transient"""
+    text = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "deactivated" in text:
+            return "deactivated"
+        return "blocked"
+    if isinstance(error, TelegramBadRequest) and "chat not found" in text:
+        return "chat_not_found"
+    return "transient"
+
+
+async def mark_unreachable(user_id: int, reason: str):
+    await get_database_bot1()["users"].update_one(
+        {"id": user_id},
+        {"$set": {"unreachable": reason, "unreachable_at": datetime.now()}}
+    )
+
+
+async def clear_unreachable(user_id: int):
+    """Пользователь снова доступен (например, написал боту после разблокировки)"""
+    await get_database_bot1()["users"].update_one(
+        {"id": user_id, "unreachable": {"$ne": None}},
+        {"$unset": {"unreachable": "", "unreachable_at": ""}}
+    )
+
+
+async def start_broadcast(bot: Bot, msg: Message, segment: Optional[str] = None,
+                          param: Optional[int] = None) -> Optional[Broadcast]:
+    """
+    Создаёт рассылку сообщения msg и запускает её в фоне.
+    segment — ключ из utils.segments.SEGMENTS, None — все пользователи.
+    """
+    snapshot_id = None
+    if segment:
+        snapshot = await get_snapshot(segment, param)
+        snapshot_id, total = snapshot.id, snapshot.total
+    else:
+        users_collection = get_database_bot1()["users"]
+        total = await users_collection.count_documents(audience_query())
+    if not total:
+        return None
+
+    progress_msg = await msg.answer(
+        f"📤 Начинаю рассылку ({segment_title(segment, param)})... 0/{total}"
+    )
+
+    job = Broadcast(
+        admin_chat_id=msg.chat.id,
+        source_message_id=msg.message_id,
+        progress_message_id=progress_msg.message_id,
+        total=total,
+        segment=segment_title(segment, param) if segment else None,
+        snapshot_id=snapshot_id
+    )
+    await job.insert()
+
+    _spawn(bot, job)
+    return job
+
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """Продолжает рассылки, прерванные перезапуском бота"""
+    jobs = await Broadcast.find(
+        {"status": {"$in": ["pending", "running"]}}
+    ).to_list()
+
+    for job in jobs:
+        _spawn(bot, job)
+
+    if jobs:
+        logger.info(f"🔄 Возобновлено рассылок: {len(jobs)}")
+    return len(jobs)
+
+
+def _spawn(bot: Bot, job: Broadcast):
+    task = asyncio.create_task(_run_broadcast(bot, job))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+
+
+async def _next_batch(job: Broadcast) -> List[int]:
+    db = get_database_bot1()
+    if job.snapshot_id:
+        # Сегментная рассылка читает готовый список из снимка
+        members = await db["audience_snapshot_members"].find(
+            {"snapshot_id": job.snapshot_id, "user_id": {"$gt": job.cursor}},
+            projection={"user_id": 1, "_id": 0}
+        ).sort("user_id", 1).limit(cnf.broadcast.BATCH_SIZE).to_list(length=None)
+        return [member["user_id"] for member in members]
+
+    users = await db["users"].find(
+        audience_query(job.cursor),
+        projection={"id": 1, "_id": 0}
+    ).sort("id", 1).limit(cnf.broadcast.BATCH_SIZE).to_list(length=None)
+    return [user["id"] for user in users]
+
+
+async def _send_one(bot: Bot, job: Broadcast, user_id: int) -> Tuple[str, Optional[str], Optional[str], int]:
+    """Отправляет копию сообщения одному пользователю с учётом лимитов и повторов"""
+    error = None
+    for attempt in range(1, cnf.broadcast.MAX_ATTEMPTS + 1):
+        await _chat_limiter.wait(user_id)
+        await _global_bucket.acquire()
+        try:
+            await bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=job.admin_chat_id,
+                message_id=job.source_message_id
+            )
+            return "sent", None, None, attempt
+
+        except TelegramRetryAfter as e:
+            # 429 — тормозим все рассылки этого бота, а не только текущую отправку
+            logger.warning(f"⏳ Flood control, пауза {e.retry_after} сек.")
+            _global_bucket.pause(e.retry_after)
+            error = str(e)
+
+        except (TelegramNetworkError, TelegramServerError) as e:
+            error = str(e)
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+        except TelegramAPIError as e:
+            return "failed", classify_error(e), str(e), attempt
+
+    return "failed", "transient", error, cnf.broadcast.MAX_ATTEMPTS
+
+
+async def _deliver(bot: Bot, job: Broadcast, user_id: int, semaphore: asyncio.Semaphore) -> Tuple[str, Optional[str]]:
+    async with semaphore:
+        status, reason, error, attempts = await _send_one(bot, job, user_id)
+
+    try:
+        await BroadcastRecipient(
+            broadcast_id=job.id,
+            user_id=user_id,
+            status=status,
+            reason=reason,
+            error=error,
+            attempts=attempts
+        ).insert()
+    except DuplicateKeyError:
+        pass
+
+    if reason in UNREACHABLE_REASONS:
+        await mark_unreachable(user_id, reason)
+    elif error:
+        logger.error(f"Ошибка при отправке пользователю {user_id}: {error}")
+    return status, reason
+
+
+async def _update_progress(bot: Bot, job: Broadcast, text: str):
+    if not job.progress_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job.admin_chat_id,
+            message_id=job.progress_message_id,
+            text=text,
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning(f"Не удалось обновить прогресс рассылки {job.id}: {e}")
+    except TelegramAPIError as e:
+        logger.warning(f"Не удалось обновить прогресс рассылки {job.id}: {e}")
+
+
+async def _run_broadcast(bot: Bot, job: Broadcast):
+    semaphore = asyncio.Semaphore(cnf.broadcast.CONCURRENCY)
+
+    try:
+        # После рестарта счётчики берём из записей о доставке
+        sent = await BroadcastRecipient.find({"broadcast_id": job.id, "status": "sent"}).count()
+        failed = await BroadcastRecipient.find({"broadcast_id": job.id, "status": "failed"}).count()
+        unreachable = await BroadcastRecipient.find(
+            {"broadcast_id": job.id, "reason": {"$in": list(UNREACHABLE_REASONS)}}
+        ).count()
+        await job.set({
+            Broadcast.status: "running",
+            Broadcast.sent: sent,
+            Broadcast.failed: failed,
+            Broadcast.unreachable: unreachable
+        })
+
+        # Снимок не должен истечь по TTL посреди долгой или возобновлённой рассылки
+        last_extend = time.monotonic()
+        if job.snapshot_id and not await extend_snapshot(job.snapshot_id):
+            logger.warning(f"⚠️ Снимок аудитории рассылки {job.id} уже удалён по TTL")
+
+        last_progress = 0.0
+        while True:
+            if job.snapshot_id and time.monotonic() - last_extend >= SNAPSHOT_EXTEND_INTERVAL:
+                last_extend = time.monotonic()
+                await extend_snapshot(job.snapshot_id)
+
+            user_ids = await _next_batch(job)
+            if not user_ids:
+                break
+
+            # Пропускаем тех, кому уже отправили до перезапуска
+            done = await BroadcastRecipient.find(
+                {"broadcast_id": job.id, "user_id": {"$in": user_ids}}
+            ).to_list()
+            done_ids = {recipient.user_id for recipient in done}
+
+            results = await asyncio.gather(*[
+                _deliver(bot, job, user_id, semaphore)
+                for user_id in user_ids
+                if user_id not in done_ids
+            ])
+
+            statuses = [status for status, _ in results]
+            await job.set({
+                Broadcast.cursor: user_ids[-1],
+                Broadcast.sent: job.sent + statuses.count("sent"),
+                Broadcast.failed: job.failed + statuses.count("failed"),
+                Broadcast.unreachable: job.unreachable + sum(
+                    1 for _, reason in results if reason in UNREACHABLE_REASONS
+                )
+            })
+
+            if time.monotonic() - last_progress >= cnf.broadcast.PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await _update_progress(
+                    bot, job,
+                    f"📤 Рассылка... {job.sent + job.failed}/{job.total}\n"
+                    f"✅ {job.sent} ❌ {job.failed}"
+                )
+
+        await job.set({Broadcast.status: "done", Broadcast.finished_at: datetime.now()})
+        if job.snapshot_id:
+            # TTL снимка отсчитывается от завершения рассылки
+            await extend_snapshot(job.snapshot_id)
+
+        processed = job.sent + job.failed
+        result_text = (
+            f"✅ <b>Рассылка завершена!</b>\n\n"
+            f"📊 <b>Статистика:</b>\n"
+            f"• Аудитория: {job.segment or 'все пользователи'}\n"
+            f"• Всего пользователей: {processed}\n"
+            f"• Успешно отправлено: {job.sent}\n"
+            f"• Не удалось отправить: {job.failed}\n"
+            f"• Из них недоступны (исключены из рассылок): {job.unreachable}\n"
+            f"• Процент успеха: {(job.sent / processed * 100) if processed else 0:.1f}%"
+        )
+        await _update_progress(bot, job, result_text)
+        logger.info(f"📨 Рассылка {job.id} завершена: {job.sent} отправлено, {job.failed} ошибок")
+
+    except Exception as e:
+        logger.error(f"❌ Рассылка {job.id} прервана: {e}", exc_info=True)
+        await job.set({
+            Broadcast.status: "failed",
+            Broadcast.error: str(e)[:500],
+            Broadcast.finished_at: datetime.now()
+        })
+        await _update_progress(bot, job, "❌ Ошибка при рассылке, подробности в логах")
+
+
+async def reprobe_unreachable(bot: Bot) -> int:
+    """
+    Перепроверяет пользователей, помеченных недоступными больше REPROBE_DAYS дней назад.
+    Проверка — send_chat_action: это самый дешёвый запрос, на который Telegram отвечает
+    так же, как на отправку (заблокирован / удалён), но без сообщения в чате.
+    Разблокировавший бота пользователь на несколько секунд увидит «печатает…».
+    Возвращает число пользователей, снова ставших доступными.
+    """
+    users_collection = get_database_bot1()["users"]
+    since = datetime.now() - timedelta(days=cnf.broadcast.REPROBE_DAYS)
+    cursor = users_collection.find(
+        {"unreachable_at": {"$lt": since}},
+        projection={"id": 1, "_id": 0}
+    ).batch_size(cnf.broadcast.BATCH_SIZE)
+
+    restored = 0
+    async for user in cursor:
+        user_id = user["id"]
+        await _chat_limiter.wait(user_id)
+        await _global_bucket.acquire()
+        try:
+            await bot.send_chat_action(chat_id=user_id, action="typing")
+            await clear_unreachable(user_id)
+            restored += 1
+        except TelegramRetryAfter as e:
+            _global_bucket.pause(e.retry_after)
+        except TelegramAPIError as e:
+            reason = classify_error(e)
+            if reason in UNREACHABLE_REASONS:
+                await mark_unreachable(user_id, reason)
+
+    if restored:
+        logger.info(f"🔁 Снова доступны для рассылок: {restored} пользователей")
+    return restored
+
+
+async def run_reprobe_loop(bot: Bot):
+    """Периодическая перепроверка недоступных пользователей"""
+    while True:
+        try:
+            await reprobe_unreachable(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка перепроверки недоступных пользователей: {e}", exc_info=True)
+        await asyncio.sleep(cnf.broadcast.REPROBE_INTERVAL)
@@ -0,0 +1,447 @@
+import asyncio
+import gzip
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from config import cnf
+from core.logger import api_logger as logger
+from db.beanie_bot1.models import ChatDeleteJob
+from utils.database import get_database_bot1
+
+# Ссылки на запущенные задачи, чтобы их не собрал GC
+_running_jobs = set()
+
+# file_type заглушки, которая остаётся в messages вместо перенесённых в архив сообщений
+ARCHIVE_STUB_TYPE = "archive"
+# Условие для остальных читателей messages (диалоги, сегменты, статистика): заглушки — не сообщения
+NOT_ARCHIVE_STUB = {"file_type": {"$ne": ARCHIVE_STUB_TYPE}}
+
+# Порядок истории, согласованный с history_sort_key: при равной date решает _id
+HISTORY_SORT = [("date", -1), ("_id", -1)]
+
+# Для чтения архива в админке: naive UTC, как отдаёт motor
+_READ_OPTIONS = json_util.JSONOptions(tz_aware=False, json_mode=json_util.JSONMode.RELAXED)
+
+
+def _write_lines(path: Path, docs: List[dict]):
+    """Дописывает документы в сжатый JSONL-файл (каждый вызов — отдельный gzip member)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS))
+            f.write("\n")
+
+
+def _iter_chunks(path: Path, size: int):
+    """Читает сжатый JSONL-файл порциями по size документов"""
+    chunk = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(json_util.loads(line))
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+@lru_cache(maxsize=64)
+def _load_bundle(path: str, mtime: float) -> List[dict]:
+    """Читает месячный архив пользователя (mtime — часть ключа кэша)"""
+    seen = set()
+    docs = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            doc = json_util.loads(line, json_options=_READ_OPTIONS)
+            # После прерванного прогона порция могла записаться дважды
+            if doc["_id"] in seen:
+                continue
+            seen.add(doc["_id"])
+            docs.append(doc)
+    return docs
+
+
+def _remove_bundles(paths: List[str]):
+    for path in paths:
+        Path(path).unlink(missing_ok=True)
+    _load_bundle.cache_clear()
+
+
+async def load_bundle(path: str) -> List[dict]:
+    bundle = Path(path)
+    if not bundle.exists():
+        logger.warning(f"⚠️ Архив не найден: {path}")
+        return []
+    return await asyncio.to_thread(_load_bundle, str(bundle), bundle.stat().st_mtime)
+
+
+def bundle_path(user_id: int, month: str) -> Path:
+    return Path(cnf.archive.DIR) / "bundles" / str(user_id) / f"{month}.jsonl.gz"
+
+
+async def archive_old_messages(older_than_days: Optional[int] = None) -> int:
+    """
+    Переносит прочитанные сообщения старше older_than_days дней в сжатые
+    помесячные архивы пользователей. В messages остаётся одна заглушка
+    на пользователя и месяц со ссылкой на файл архива.
+    """
+    days = older_than_days or cnf.archive.RETENTION_DAYS
+    if days <= 0:
+        return 0
+
+    messages_collection = get_database_bot1()["messages"]
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    base_query = {
+        "date": {"$lt": cutoff},
+        "checked": "1",
+        **NOT_ARCHIVE_STUB
+    }
+
+    groups = await messages_collection.aggregate([
+        {"$match": base_query},
+        {"$group": {
+            "_id": {
+                "user_id": "$from_id",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}}
+            }
+        }}
+    ], allowDiskUse=True).to_list(None)
+
+    # Чаты, которые сейчас удаляются, не трогаем: новая заглушка могла бы пережить удаление
+    deleting = set(await ChatDeleteJob.get_motor_collection().distinct(
+        "user_id", {"status": {"$in": ["pending", "running"]}}
+    ))
+
+    archived = 0
+    for group in groups:
+        user_id = group["_id"]["user_id"]
+        if user_id in deleting:
+            continue
+        month = group["_id"]["month"]
+        month_start = datetime.strptime(month, "%Y-%m")
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        path = bundle_path(user_id, month)
+
+        query = {
+            **base_query,
+            "from_id": user_id,
+            "date": {"$gte": month_start, "$lt": min(next_month, cutoff.replace(tzinfo=None))}
+        }
+
+        while True:
+            batch = await messages_collection.find(query)\
+                .sort("_id", 1)\
+                .limit(cnf.archive.BATCH_SIZE)\
+                .to_list(length=None)
+            if not batch:
+                break
+
+            await asyncio.to_thread(_write_lines, path, batch)
+
+            # Сначала заглушка, потом удаление: при сбое сообщения не пропадут из истории
+            await messages_collection.update_one(
+                {"from_id": user_id, "file_type": ARCHIVE_STUB_TYPE, "archive_month": month},
+                {
+                    "$set": {
+                        "archive_path": str(path),
+                        "message_object": "",
+                        "checked": "1",
+                        "from_operator": "0",
+                        "file_id": ""
+                    },
+                    "$setOnInsert": {"id": 0},
+                    "$inc": {"archived_count": len(batch)},
+                    "$min": {"date_from": batch[0]["date"]},
+                    "$max": {"date": max(doc["date"] for doc in batch)},
+                    "$addToSet": {"media_ids": {"$each": [doc["_id"] for doc in batch if doc.get("file_id")]}}
+                },
+                upsert=True
+            )
+
+            result = await messages_collection.delete_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}}
+            )
+            archived += result.deleted_count
+            await asyncio.sleep(cnf.archive.BATCH_PAUSE)
+
+    if archived:
+        logger.info(f"📦 Перенесено в архив {archived} сообщений (старше {days} дн.)")
+    return archived
+
+
+async def run_retention_loop():
+    """Периодически переносит старые сообщения в архив"""
+    while True:
+        try:
+            await archive_old_messages()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка архивации старых сообщений: {e}", exc_info=True)
+        await asyncio.sleep(cnf.archive.RETENTION_INTERVAL)
+
+
+def _older_query(before: datetime, before_id: Optional[ObjectId]) -> List[dict]:
+    """Условия «старше курсора»: по date, при равной date — по _id"""
+    if before_id is None:
+        return [{"date": {"$lt": before}}]
+    return [{"date": {"$lt": before}}, {"date": before, "_id": {"$lt": before_id}}]
+
+
+def _is_older(doc: dict, before: Optional[datetime], before_id: Optional[ObjectId]) -> bool:
+    if before is None:
+        return True
+    if before_id is None:
+        return doc["date"] < before
+    return (doc["date"], doc["_id"]) < (before, before_id)
+
+
+def history_sort_key(doc: dict):
+    """Единый порядок истории для горячих и поднятых из архива сообщений: (date, _id)"""
+    return doc["date"], doc["_id"]
+
+
+def _cursor_query(before: Optional[datetime], before_id: Optional[ObjectId]) -> dict:
+    if before is None:
+        return {}
+    return {"$or": _older_query(before, before_id)}
+
+
+async def load_history(messages_collection, user_id: int, limit: int,
+                       before: Optional[datetime] = None,
+                       before_id: Optional[ObjectId] = None) -> List[dict]:
+    """
+    Страница истории старше курсора (before, before_id), не больше limit сообщений, новые сначала.
+    Горячие сообщения (в т.ч. непрочитанные, которые не архивируются) и заглушки архива
+    выбираются отдельными запросами: заглушка не занимает место горячего сообщения в limit,
+    и архивные сообщения не могут обогнать горячие, оставшиеся за пределами выборки.
+    """
+    hot = await messages_collection.find(
+        {"from_id": user_id, **NOT_ARCHIVE_STUB, **_cursor_query(before, before_id)}
+    ).sort(HISTORY_SORT).limit(limit).to_list(length=None)
+
+    stub_query = {"from_id": user_id, "file_type": ARCHIVE_STUB_TYPE}
+    if before is not None:
+        stub_query["date_from"] = {"$lte": before}
+    if hot and len(hot) >= limit:
+        # Архивы, целиком старше последнего горячего сообщения, на эту страницу не попадут
+        stub_query["date"] = {"$gte": hot[-1]["date"]}
+
+    result = list(hot)
+    async for stub in messages_collection.find(stub_query).sort(HISTORY_SORT):
+        if len(result) >= limit:
+            result.sort(key=history_sort_key, reverse=True)
+            # Заглушки идут по убыванию самой новой даты архива — дальше только более старые
+            if stub["date"] < result[limit - 1]["date"]:
+                break
+        for doc in await load_bundle(stub["archive_path"]):
+            if _is_older(doc, before, before_id):
+                result.append(doc)
+
+    result.sort(key=history_sort_key, reverse=True)
+    return result[:limit]
+
+
+async def find_message(message_id: str) -> Optional[dict]:
+    """Ищет сообщение по _id в messages, а если его там нет — в архиве"""
+    messages_collection = get_database_bot1()["messages"]
+    oid = ObjectId(message_id)
+
+    message = await messages_collection.find_one({"_id": oid})
+    if message:
+        return message
+
+    stub = await messages_collection.find_one(
+        {"media_ids": oid},
+        projection={"archive_path": 1}
+    )
+    if not stub:
+        return None
+
+    for doc in await load_bundle(stub["archive_path"]):
+        if doc["_id"] == oid:
+            return doc
+    return None
+
+
+async def rebuild_dialog(user_id: int):
+    """Пересчитывает summary диалога в chat_dialogs по сообщениям пользователя"""
+    db = get_database_bot1()
+    pipeline = [
+        {"$match": {"from_id": user_id, **NOT_ARCHIVE_STUB}},
+        {"$sort": {"date": 1}},
+        {"$group": {
+            "_id": "$from_id",
+            "last_message_date": {"$last": "$date"},
+            "last_message_text": {"$last": "$message_object"},
+            "last_message_type": {"$last": "$file_type"},
+            "message_count": {"$sum": 1},
+            "unread_count": {
+                "$sum": {
+                    "$cond": [
+                        {"$and": [
+                            {"$eq": ["$checked", "0"]},
+                            {"$eq": ["$from_operator", "0"]}
+                        ]},
+                        1,
+                        0
+                    ]
+                }
+            }
+        }}
+    ]
+    data = await db.messages.aggregate(pipeline).to_list(None)
+    if not data:
+        return
+
+    d = data[0]
+    user = await db.users.find_one({"id": user_id}) or {}
+    await db.chat_dialogs.update_one(
+        {"user_id": user_id},
+        {
+            "$set": {
+                "username": user.get("username", ""),
+                "full_name": user.get("full_name", ""),
+                "banned": user.get("banned", "0"),
+                "last_message_text": (d.get("last_message_text") or "")[:200],
+                "last_message_date": d["last_message_date"],
+                "last_message_type": d.get("last_message_type", "text"),
+                "message_count": d["message_count"],
+                "unread_count": d["unread_count"]
+            }
+        },
+        upsert=True
+    )
+
+
+async def start_chat_delete_job(user_id: int, archive: bool = False) -> ChatDeleteJob:
+    """
+    Создаёт задачу удаления чата и запускает её в фоне.
+    Summary диалога удаляется сразу, сообщения — порциями в фоне.
+    """
+    job = ChatDeleteJob(user_id=user_id, archive=archive, cutoff=datetime.now(timezone.utc))
+    if archive:
+        job.archive_path = str(
+            Path(cnf.archive.DIR) / "deleted" / f"{user_id}_{job.created_at:%Y%m%d%H%M%S}.jsonl.gz"
+        )
+    await job.insert()
+
+    await get_database_bot1()["chat_dialogs"].delete_one({"user_id": user_id})
+
+    _spawn(job)
+    return job
+
+
+def _spawn(job: ChatDeleteJob):
+    task = asyncio.create_task(_run_delete_job(job))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+
+
+async def _run_delete_job(job: ChatDeleteJob):
+    db = get_database_bot1()
+    messages_collection = db["messages"]
+    archive_path = Path(job.archive_path) if job.archive_path else None
+
+    # Удаляем только сообщения, пришедшие до создания задачи.
+    # Сравнение по date, а не по _id: ObjectId с точностью до секунды и создаются разными процессами.
+    # У задач, созданных до появления cutoff, берём время из их _id
+    cutoff = job.cutoff or job.id.generation_time
+    query = {"from_id": job.user_id, "date": {"$lte": cutoff}}
+    projection = None if archive_path else {"_id": 1, "file_type": 1, "archive_path": 1}
+
+    try:
+        await job.set({ChatDeleteJob.status: "running"})
+
+        while True:
+            batch = await messages_collection.find(query, projection)\
+                .sort("_id", 1)\
+                .limit(cnf.archive.BATCH_SIZE)\
+                .to_list(length=None)
+            if not batch:
+                break
+
+            # Помесячные архивы удаляются вместе с чатом: иначе новая заглушка
+            # того же месяца дописалась бы в старый файл и вернула удалённые сообщения
+            bundles = [doc["archive_path"] for doc in batch if doc.get("file_type") == ARCHIVE_STUB_TYPE]
+
+            if archive_path:
+                docs = [doc for doc in batch if doc.get("file_type") != ARCHIVE_STUB_TYPE]
+                for bundle in bundles:
+                    docs.extend(await load_bundle(bundle))
+                await asyncio.to_thread(_write_lines, archive_path, docs)
+
+            result = await messages_collection.delete_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}}
+            )
+            await job.inc({ChatDeleteJob.deleted_messages: result.deleted_count})
+
+            if bundles:
+                await asyncio.to_thread(_remove_bundles, bundles)
+
+            # Отдаём event loop и растягиваем нагрузку на индексы
+            await asyncio.sleep(cnf.archive.BATCH_PAUSE)
+
+        await job.set({
+            ChatDeleteJob.status: "done",
+            ChatDeleteJob.finished_at: datetime.now()
+        })
+        logger.info(f"🗑 Чат {job.user_id} удалён: {job.deleted_messages} сообщений (задача {job.id})")
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка задачи удаления чата {job.id}: {e}", exc_info=True)
+        await job.set({
+            ChatDeleteJob.status: "failed",
+            ChatDeleteJob.error: str(e)[:500],
+            ChatDeleteJob.finished_at: datetime.now()
+        })
+
+
+async def resume_chat_delete_jobs() -> int:
+    """Перезапускает задачи, прерванные остановкой приложения"""
+    jobs = await ChatDeleteJob.find(
+        {"status": {"$in": ["pending", "running"]}}
+    ).to_list()
+
+    for job in jobs:
+        _spawn(job)
+
+    if jobs:
+        logger.info(f"🔄 Возобновлено задач удаления чатов: {len(jobs)}")
+    return len(jobs)
+
+
+async def restore_chat(job: ChatDeleteJob) -> int:
+    """Восстанавливает переписку из архива задачи удаления. Возвращает число вставленных сообщений"""
+    if not job.archive_path or not Path(job.archive_path).exists():
+        raise FileNotFoundError("Архив для этой задачи не найден")
+
+    messages_collection = get_database_bot1()["messages"]
+    chunks = _iter_chunks(Path(job.archive_path), cnf.archive.BATCH_SIZE)
+    inserted = 0
+
+    while True:
+        chunk: Optional[List[dict]] = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+        try:
+            result = await messages_collection.insert_many(chunk, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Дубликаты _id (повторная порция после рестарта или повторное восстановление)
+            inserted += e.details.get("nInserted", 0)
+
+    await rebuild_dialog(job.user_id)
+    await job.set({ChatDeleteJob.restored: True})
+
+    logger.info(f"♻️ Чат {job.user_id} восстановлен из архива: {inserted} сообщений")
+    return inserted
@@ -1,18 +1,69 @@
+from datetime import datetime, timedelta
+
 from aiogram import Bot
-from aiogram.types import ChatMember
+from aiogram.types import ChatMember, ChatMemberUpdated
+
+from config import cnf
+from db.beanie.models import ChannelMember
+
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+
+def _is_member(member: ChatMember) -> bool:
+    # restricted — участник с ограничениями, подписан, если is_member
+    return member.status in MEMBER_STATUSES or bool(getattr(member, "is_member", False))
+
+
+async def save_member(channel: str, user_id: int, member: ChatMember, source: str):
+    """Записывает подписку в реестр channel_members"""
+    await ChannelMember.get_motor_collection().update_one(
+        {"channel": channel.lower(), "user_id": user_id},
+        {"$set": {
+            "is_member": _is_member(member),
+            "status": member.status,
+            "source": source,
+            "updated_at": datetime.now()
+        }},
+        upsert=True
+    )
 
 
-async def check_user_subscription(bot: Bot, user_id: int, channel_username: str) -> bool:
+async def on_chat_member(event: ChatMemberUpdated, channel_username: str):
+    """Апдейт chat_member канала: вступление, выход, бан — сразу в реестр"""
+    await save_member(channel_username, event.new_chat_member.user.id, event.new_chat_member, "event")
+
+
+def _is_fresh(record: ChannelMember) -> bool:
+    if not record.is_member:
+        ttl = cnf.subscription.NEGATIVE_TTL
+    elif record.source == "event":
+        ttl = cnf.subscription.EVENT_TTL
+    else:
+        ttl = cnf.subscription.API_TTL
+    return record.updated_at > datetime.now() - timedelta(seconds=ttl)
+
+
+async def check_user_subscription(bot: Bot, user_id: int, channel_username: str, recheck: bool = False) -> bool:
     """
     Проверяет, подписан ли пользователь на канал.
+    Сначала смотрит реестр channel_members (его ведут апдейты chat_member),
+    в Bot API идёт только для неизвестных пользователей и устаревших записей.
 
     :param bot: экземпляр бота
     :param user_id: ID пользователя
     :param channel_username: имя канала (например, "@pure_health")
+    :param recheck: не доверять записи «не подписан» (пользователь нажал «Проверить подписку»)
     :return: True если подписан, иначе False
     """
+    record = await ChannelMember.find_one({"channel": channel_username.lower(), "user_id": user_id})
+    if record and _is_fresh(record) and (record.is_member or not recheck):
+        return record.is_member
+
     try:
         member: ChatMember = await bot.get_chat_member(chat_id=channel_username, user_id=user_id)
-        return member.status in ("member", "administrator", "creator")
     except Exception:
-        return False
\ No newline at end of file
+        # API недоступен — лучше устаревшая запись, чем отказ
+        return bool(record and record.is_member)
+
+    await save_member(channel_username, user_id, member, "api")
+    return _is_member(member)
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import math
+import time
+from typing import Optional
+
+from config import cnf
+from core.logger import bot_logger as logger
+from db.mysql.crud import detect_code_id_column, fetch_codes
+
+
+def normalize_code(code: str) -> str:
+    # MySQL сравнивает code_text без учёта регистра и хвостовых пробелов —
+    # фильтр должен быть не строже, иначе появятся ложные отказы
+    return code.rstrip().casefold()
+
+
+class BloomFilter:
+    """Фильтр Блума: «точно нет» или «возможно есть» с долей ложных срабатываний error_rate"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1000)
+        self.size = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class CodeFilter:
+    """
+    Фильтр по oc_qrcode.code_text: отсекает заведомо несуществующие коды без запроса в MySQL.
+    Строится при старте, новые коды догружаются по автоинкрементному ключу (если он есть),
+    раз в REBUILD_INTERVAL фильтр пересобирается целиком (погашенные коды из него уходят).
+    Фильтр может ошибаться только в сторону «возможно есть»: без автоинкрементного ключа
+    промах не считается отказом, потому что новые коды видны лишь после пересборки.
+    """
+
+    def __init__(self):
+        self._bloom: Optional[BloomFilter] = None
+        self._id_column: Optional[str] = None
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._lock = asyncio.Lock()
+        self.rejected = 0  # попыток, отсечённых без запроса в MySQL
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    @property
+    def id_column(self) -> Optional[str]:
+        """Автоинкрементный ключ oc_qrcode, по которому догружаются новые коды (None — его нет)"""
+        return self._id_column
+
+    async def rebuild(self):
+        """Полная пересборка; новый фильтр подменяет старый только когда готов"""
+        started = time.monotonic()
+        id_column = await detect_code_id_column()
+
+        codes, last_id = [], 0
+        async for rows in fetch_codes(id_column, 0, cnf.codes.BATCH_SIZE):
+            for row_id, code_text in rows:
+                codes.append(normalize_code(code_text))
+                last_id = row_id if row_id is not None else last_id
+
+        # Запас на рост, чтобы догрузки не портили точность до следующей пересборки
+        bloom = BloomFilter(int(len(codes) * 1.5), cnf.codes.FALSE_POSITIVE_RATE)
+        for code in codes:
+            bloom.add(code)
+
+        async with self._lock:
+            self._bloom, self._id_column, self._last_id = bloom, id_column, last_id
+            self._refreshed_at = time.monotonic()
+        logger.info(
+            f"🧮 Фильтр кодов собран: {len(codes)} кодов, {len(bloom.bits) // 1024} КБ, "
+            f"{time.monotonic() - started:.1f} сек."
+        )
+
+    async def refresh(self, max_age: float = 0):
+        """Догружает коды, добавленные после последнего обновления (если оно старше max_age)"""
+        async with self._lock:
+            # Одновременные промахи ждут одну догрузку, а не запускают каждый свою
+            if not self._id_column or time.monotonic() - self._refreshed_at <= max_age:
+                return
+
+            # Перечитываем окно ниже _last_id: строка с меньшим id могла закоммититься позже
+            after_id = max(0, self._last_id - cnf.codes.REFRESH_LOOKBACK)
+            added = 0
+            async for rows in fetch_codes(self._id_column, after_id, cnf.codes.BATCH_SIZE):
+                for row_id, code_text in rows:
+                    code = normalize_code(code_text)
+                    if code not in self._bloom:
+                        self._bloom.add(code)
+                        added += 1
+                    self._last_id = max(self._last_id, row_id)
+            self._refreshed_at = time.monotonic()
+            if added:
+                logger.info(f"🧮 В фильтр кодов добавлено: {added}")
+
+    async def may_exist(self, code: str) -> bool:
+        """False — кода точно нет в oc_qrcode. Если фильтр не готов, всегда True"""
+        if not self.ready:
+            return True
+
+        code = normalize_code(code)
+        if code in self._bloom:
+            return True
+
+        # Без автоинкрементного ключа код мог появиться после пересборки — решает MySQL
+        if not self._id_column:
+            return True
+
+        # Код мог появиться после последнего обновления — перед отказом догружаем новые
+        try:
+            await self.refresh(max_age=cnf.codes.MISS_REFRESH_AFTER)
+        except Exception as e:
+            logger.error(f"❌ Не удалось обновить фильтр кодов: {e}")
+            return True
+        if code in self._bloom:
+            return True
+
+        self.rejected += 1
+        return False
+
+
+code_filter = CodeFilter()
+
+
+async def run_code_filter_loop():
+    """Сборка фильтра при старте, дальше догрузка и периодическая пересборка"""
+    rebuilt_at = 0.0
+    while True:
+        try:
+            # Без автоинкрементного ключа новые коды видны только после пересборки
+            full = not code_filter.id_column or time.monotonic() - rebuilt_at > cnf.codes.REBUILD_INTERVAL
+            if not code_filter.ready or full:
+                await code_filter.rebuild()
+                rebuilt_at = time.monotonic()
+            else:
+                await code_filter.refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления фильтра кодов: {e}", exc_info=True)
+        await asyncio.sleep(cnf.codes.REFRESH_INTERVAL)
@@ -1,8 +1,8 @@
 import asyncio
 
-from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie, Document
 from config import cnf
+from core.mongo import get_client
 from db.beanie.models import Administrators
 from db.beanie.models import document_models
 from db.beanie_bot1.models import document_models as bot1_models
@@ -46,7 +46,7 @@ async def init_database():
     if _is_initialized_main:
         return _client_main[cnf.mongo.NAME]
 
-    _client_main = AsyncIOMotorClient(cnf.mongo.URL)
+    _client_main = get_client(cnf.mongo.URL)
     database = _client_main[cnf.mongo.NAME]
 
     await init_beanie(
@@ -67,7 +67,7 @@ async def init_database_bot1():
     if _is_initialized_bot1:
         return _client_bot1[cnf.mongo_bot1.NAME]
 
-    _client_bot1 = AsyncIOMotorClient(cnf.mongo_bot1.URL)
+    _client_bot1 = get_client(cnf.mongo_bot1.URL)
     database = _client_bot1[cnf.mongo_bot1.NAME]
 
 
@@ -80,9 +80,10 @@ async def init_database_bot1():
     print("✅ База данных Бот-1 инициализирована")
 
     from db.beanie_bot1.models import Users, Products, Messages
+    from utils.chat_archive import NOT_ARCHIVE_STUB
     users_count = await Users.count()
     products_count = await Products.count()
-    messages_count = await Messages.count()
+    messages_count = await Messages.find(NOT_ARCHIVE_STUB).count()
 
     print(f"📊 Загружено из Бот-1: {users_count} пользователей, {products_count} товаров, {messages_count} сообщений")
 
@@ -0,0 +1,146 @@
+import copy
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.mongo import MongoStorage
+from aiogram.types import TelegramObject
+
+from config import cnf
+from core.logger import bot_logger as logger
+from utils.user_context import on_invalidate
+
+
+class _WriteBuffer:
+    """Ключи FSM, изменённые за время обработки одного апдейта"""
+
+    def __init__(self):
+        self.dirty: Set[str] = set()
+        self.flushed = False
+
+
+_write_buffer: ContextVar[Optional[_WriteBuffer]] = ContextVar("fsm_write_buffer", default=None)
+
+
+class CachedMongoStorage(MongoStorage):
+    """
+    MongoStorage с кэшем в памяти процесса (L1).
+    Чтения обслуживаются из памяти, все изменения за один апдейт сливаются в один
+    replace_one в конце обработки (см. FSMWriteBufferMiddleware).
+    Вне апдейта запись идёт сразу.
+    Прямые правки коллекции (админка) сбрасывают L1 через publish_invalidation(scope, user_id).
+    """
+
+    def __init__(self, *args, scope: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scope = scope
+        # document_id -> (момент устаревания, user_id, {"state": ..., "data": ...})
+        self._records: Dict[str, Tuple[float, int, Dict[str, Any]]] = {}
+        on_invalidate(scope, self.invalidate_where)
+
+    def invalidate_where(self, matches: Callable[[int], bool]):
+        # Инвалидации редки, поэтому достаточно полного прохода
+        for document_id in [d for d, (_, uid, _) in self._records.items() if matches(uid)]:
+            del self._records[document_id]
+
+    def _remember(self, key: StorageKey, document_id: str, record: Dict[str, Any]):
+        now = time.monotonic()
+        if document_id not in self._records and len(self._records) >= cnf.cache.FSM_MAX_SIZE:
+            for stale_id in [d for d, (expires, _, _) in self._records.items() if expires <= now]:
+                del self._records[stale_id]
+            while len(self._records) >= cnf.cache.FSM_MAX_SIZE:
+                del self._records[next(iter(self._records))]
+
+        self._records[document_id] = (now + cnf.cache.FSM_TTL, key.user_id, record)
+
+    async def _record(self, key: StorageKey) -> Tuple[str, Dict[str, Any]]:
+        document_id = self._key_builder.build(key)
+        cached = self._records.get(document_id)
+        if cached and cached[0] > time.monotonic():
+            return document_id, cached[2]
+
+        document = await self._collection.find_one({"_id": document_id}) or {}
+        record = {"state": document.get("state"), "data": document.get("data") or {}}
+        self._remember(key, document_id, record)
+        return document_id, record
+
+    async def _write(self, key: StorageKey, document_id: str, record: Dict[str, Any]):
+        self._remember(key, document_id, record)
+
+        buffer = _write_buffer.get()
+        if buffer is not None and not buffer.flushed:
+            buffer.dirty.add(document_id)
+            return
+        await self._persist(document_id)
+
+    async def _persist(self, document_id: str):
+        cached = self._records.get(document_id)
+        if not cached:
+            return
+        record = cached[2]
+
+        document = {}
+        if record["state"] is not None:
+            document["state"] = record["state"]
+        if record["data"]:
+            document["data"] = record["data"]
+
+        if document:
+            await self._collection.replace_one({"_id": document_id}, document, upsert=True)
+        else:
+            await self._collection.delete_one({"_id": document_id})
+
+    async def flush(self, buffer: _WriteBuffer):
+        buffer.flushed = True
+        for document_id in buffer.dirty:
+            try:
+                await self._persist(document_id)
+            except Exception as e:
+                # Не держим в памяти то, чего нет в базе
+                self._records.pop(document_id, None)
+                logger.error(f"❌ Не удалось сохранить FSM {document_id}: {e}")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        document_id, record = await self._record(key)
+        await self._write(key, document_id, {**record, "state": self.resolve_state(state)})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, record = await self._record(key)
+        return record["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        document_id, record = await self._record(key)
+        await self._write(key, document_id, {**record, "data": copy.deepcopy(data)})
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, record = await self._record(key)
+        return copy.deepcopy(record["data"])
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        document_id, record = await self._record(key)
+        new_data = {**record["data"], **copy.deepcopy(data)}
+        await self._write(key, document_id, {**record, "data": new_data})
+        return copy.deepcopy(new_data)
+
+
+class FSMWriteBufferMiddleware(BaseMiddleware):
+    """Копит изменения FSM за апдейт и сохраняет их одной записью на ключ"""
+
+    def __init__(self, storage: CachedMongoStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        buffer = _WriteBuffer()
+        token = _write_buffer.set(buffer)
+        try:
+            return await handler(event, data)
+        finally:
+            _write_buffer.reset(token)
+            await self.storage.flush(buffer)
@@ -0,0 +1,182 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from config import cnf
+from core.logger import bot_1_logger as logger
+from utils.database import get_database_bot1
+
+
+async def reserve_message_ids(count: int) -> List[int]:
+    """id для count сообщений в messages: один $inc счётчика, общего для бота и админки"""
+    counter = await get_database_bot1()["counters"].find_one_and_update(
+        {"_id": "message_id"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        projection={"seq": 1}
+    )
+    return list(range(counter["seq"] - count + 1, counter["seq"] + 1))
+
+
+@dataclass
+class IncomingMessage:
+    """Сообщение пользователя бота-1 для записи в messages / users / chat_dialogs"""
+    user_id: int
+    username: Optional[str]
+    full_name: str
+    message_data: dict
+    # False — профиль в users не изменился, обновлять пользователя не нужно
+    profile_changed: bool = True
+    date: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class IngestWriter:
+    """
+    Копит входящие сообщения всех пользователей несколько миллисекунд (FLUSH_DELAY)
+    и записывает их пачкой: один $inc счётчика на всю пачку, insert_many в messages
+    и по одному bulk_write в users и chat_dialogs.
+    Хендлер ждёт future своей записи, поэтому сообщение считается принятым только после записи в базу.
+    """
+
+    def __init__(self):
+        self._pending: List[Tuple[IncomingMessage, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks = set()
+        # Пачки пишутся по одной: иначе последнее сообщение диалога могла бы перезаписать более старая пачка
+        self._lock = asyncio.Lock()
+        self.batches = 0
+        self.written = 0
+
+    async def write(self, item: IncomingMessage) -> int:
+        """Ставит сообщение в пачку и ждёт записи; возвращает id сообщения"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= cnf.ingest.MAX_BATCH:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(cnf.ingest.FLUSH_DELAY, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._flush(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch: List[Tuple[IncomingMessage, asyncio.Future]]):
+        async with self._lock:
+            try:
+                message_ids = await self._write_batch([item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи пачки сообщений ({len(batch)}): {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.batches += 1
+            self.written += len(batch)
+            for (_, future), message_id in zip(batch, message_ids):
+                if not future.done():
+                    future.set_result(message_id)
+
+    async def _write_batch(self, items: List[IncomingMessage]) -> List[int]:
+        db = get_database_bot1()
+
+        # --- 1. id сообщений: один $inc на всю пачку ---
+        message_ids = await reserve_message_ids(len(items))
+
+        # --- 2. Сообщения ---
+        await db["messages"].insert_many([
+            {
+                "from_id": item.user_id,
+                "message_object": item.message_data["message_object"],
+                "checked": "0",
+                "date": item.date,
+                "file_id": item.message_data["file_id"],
+                "file_type": item.message_data["file_type"],
+                "from_operator": "0",
+                "id": message_id,
+                "file_name": item.message_data["file_name"],
+                "file_size": item.message_data["file_size"],
+                "mime_type": item.message_data["mime_type"]
+            }
+            for item, message_id in zip(items, message_ids)
+        ], ordered=True)
+
+        # По одной операции на пользователя: побеждает последнее сообщение пачки
+        last_by_user: Dict[int, IncomingMessage] = {}
+        counts: Dict[int, int] = {}
+        profile_changed = set()
+        for item in items:
+            last_by_user[item.user_id] = item
+            counts[item.user_id] = counts.get(item.user_id, 0) + 1
+            if item.profile_changed:
+                profile_changed.add(item.user_id)
+
+        # --- 3. Пользователи (только если профиль изменился) ---
+        user_ops = [
+            UpdateOne(
+                {"id": user_id},
+                {
+                    "$set": {
+                        "username": item.username,
+                        "full_name": item.full_name,
+                        "role": "user",
+                        "banned": "0"
+                    },
+                    # Написал сам — значит, снова доступен для рассылок
+                    "$unset": {"unreachable": "", "unreachable_at": ""},
+                    "$setOnInsert": {"id": user_id}
+                },
+                upsert=True
+            )
+            for user_id, item in last_by_user.items()
+            if user_id in profile_changed
+        ]
+        if user_ops:
+            await db["users"].bulk_write(user_ops, ordered=True)
+
+        # --- 4. Диалоги ---
+        await db["chat_dialogs"].bulk_write([
+            UpdateOne(
+                {"user_id": user_id},
+                {
+                    "$set": {
+                        "username": item.username or "",
+                        "full_name": item.full_name or "",
+                        "last_message_text": item.message_data["message_object"][:200],
+                        "last_message_date": item.date,
+                        "last_message_type": item.message_data["file_type"],
+                        "banned": "0"
+                    },
+                    "$inc": {
+                        "message_count": counts[user_id],
+                        "unread_count": counts[user_id]  # новые сообщения от пользователя
+                    }
+                },
+                upsert=True
+            )
+            for user_id, item in last_by_user.items()
+        ], ordered=True)
+
+        return message_ids
+
+    async def close(self):
+        """Дописывает накопленное (при выключении бота)"""
+        self._start_flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+
+ingest_writer = IngestWriter()
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.types import Message, TelegramObject, Update
+
+from config import cnf
+
+# Больше частей в альбоме Telegram не бывает — дальше ждать незачем
+ALBUM_MAX_SIZE = 10
+
+
+class MediaGroupMiddleware(BaseMiddleware):
+    """
+    Собирает альбом (апдейты с одним media_group_id) в один вызов хендлера.
+    Первая часть ждёт, пока новые части перестанут приходить (ALBUM_DEBOUNCE), и уходит
+    в обработку с data["album"] — списком сообщений по порядку; остальные части не обрабатываются.
+    Работает только в перечисленных состояниях FSM — их хендлеры должны понимать album.
+    Регистрируется на dp.update перед UpdateScheduler: части альбома не должны ждать друг друга в очереди.
+    """
+
+    def __init__(self, states: Iterable[State]):
+        self.states = {state.state for state in states}
+        # (chat_id, media_group_id) -> собранные части
+        self._albums: Dict[tuple, List[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        message = event.message
+        if not message or not message.media_group_id:
+            return await handler(event, data)
+
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(message)
+            return
+
+        state = data.get("state")
+        if not state or await state.get_state() not in self.states:
+            return await handler(event, data)
+
+        # Пока читали состояние, альбом могла начать другая часть
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(message)
+            return
+
+        album = self._albums[key] = [message]
+        try:
+            while len(album) < ALBUM_MAX_SIZE:
+                size = len(album)
+                await asyncio.sleep(cnf.scheduler.ALBUM_DEBOUNCE)
+                if len(album) == size:
+                    break
+        finally:
+            del self._albums[key]
+
+        data["album"] = sorted(album, key=lambda part: part.message_id)
+        return await handler(event, data)
@@ -0,0 +1,208 @@
+import asyncio
+import glob
+import hashlib
+import os
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputFile, InputMediaDocument, InputMediaPhoto, Message
+
+from core.logger import bot_logger as logger
+
+if TYPE_CHECKING:
+    from utils.uploads import SpooledUpload
+
+MEDIA_COLLECTION = "media_files"
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sent_file_id(sent: Message, kind: str) -> Optional[str]:
+    """
+    file_id отправленного файла, если Telegram вернул его тем же видом, что и kind.
+    Беззвучное mp4 может прийти как animation, видео — как document: такой file_id
+    не подходит для send_video/send_audio, поэтому не кэшируется
+    """
+    if kind == "photo":
+        return sent.photo[-1].file_id if sent.photo else None
+    media = getattr(sent, kind, None)
+    if media:
+        return media.file_id
+    returned = next(
+        (name for name in ("animation", "document", "video", "audio", "voice") if getattr(sent, name, None)),
+        None
+    )
+    logger.info(f"ℹ️ Telegram вернул {returned} вместо {kind}, file_id не кэшируется")
+    return None
+
+
+class MediaRegistry:
+    """
+    Реестр загруженных в Telegram файлов: sha256 файла -> file_id.
+    Файл загружается один раз, дальше отправляется по file_id.
+    Если файл на диске изменился, меняется хэш и файл загружается заново.
+    file_id привязан к боту, поэтому у каждого бота свой реестр в своей базе.
+    """
+
+    def __init__(self, get_db: Callable[[], Any]):
+        self._get_db = get_db
+        # (sha256, kind) -> file_id
+        self._file_ids: Dict[Tuple[str, str], str] = {}
+        # path -> (mtime_ns, size, sha256)
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+
+    @property
+    def _collection(self):
+        return self._get_db()[MEDIA_COLLECTION]
+
+    async def file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        sha256 = await asyncio.to_thread(sha256_file, path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+        return sha256
+
+    async def get_file_id(self, sha256: str, kind: str) -> Optional[str]:
+        file_id = self._file_ids.get((sha256, kind))
+        if file_id:
+            return file_id
+
+        document = await self._collection.find_one({"sha256": sha256, "kind": kind})
+        if document:
+            self._file_ids[(sha256, kind)] = document["file_id"]
+            return document["file_id"]
+        return None
+
+    async def remember(self, sha256: str, kind: str, file_id: str, name: str = None, size: int = None):
+        self._file_ids[(sha256, kind)] = file_id
+        await self._collection.update_one(
+            {"sha256": sha256, "kind": kind},
+            {"$set": {
+                "file_id": file_id,
+                "name": name,
+                "size": size,
+                "uploaded_at": datetime.now()
+            }},
+            upsert=True
+        )
+
+    async def forget(self, sha256: str, kind: str):
+        self._file_ids.pop((sha256, kind), None)
+        await self._collection.delete_one({"sha256": sha256, "kind": kind})
+
+    async def warm_up(self, pattern: str, kind: str = "video") -> int:
+        """Считает хэши файлов и подтягивает известные file_id в память (без загрузки в Telegram)"""
+        known = 0
+        for path in sorted(glob.glob(pattern)):
+            if await self.get_file_id(await self.file_hash(path), kind):
+                known += 1
+        return known
+
+    async def _send_cached(
+        self,
+        send: Callable[[Union[str, InputFile]], Awaitable[Message]],
+        sha256: str,
+        kind: str,
+        make_input: Callable[[], InputFile],
+        name: str,
+        size: int
+    ) -> Message:
+        file_id = await self.get_file_id(sha256, kind)
+        if file_id:
+            try:
+                return await send(file_id)
+            except TelegramBadRequest as e:
+                logger.warning(f"⚠️ file_id для {name} больше не действителен, загружаем заново: {e}")
+                await self.forget(sha256, kind)
+
+        sent = await send(make_input())
+        new_file_id = _sent_file_id(sent, kind)
+        if new_file_id:
+            await self.remember(sha256, kind, new_file_id, name, size)
+        return sent
+
+    async def send(
+        self,
+        send: Callable[[Union[str, InputFile]], Awaitable[Message]],
+        path: str,
+        kind: str = "video"
+    ) -> Message:
+        """
+        Отправляет файл через send(media): по file_id, если файл уже загружался,
+        иначе загружает с диска и запоминает полученный file_id.
+        """
+        sha256 = await self.file_hash(path)
+        return await self._send_cached(
+            send, sha256, kind, lambda: FSInputFile(path), os.path.basename(path), os.path.getsize(path)
+        )
+
+    async def send_upload(
+        self,
+        send: Callable[[Union[str, InputFile]], Awaitable[Message]],
+        upload: "SpooledUpload",
+        kind: str
+    ) -> Message:
+        """
+        То же для файла, загруженного в админку: одинаковый файл (по sha256 содержимого)
+        уходит в Telegram один раз, повторные отправки — по file_id.
+        """
+        return await self._send_cached(send, upload.sha256, kind, upload.input_file, upload.filename, upload.size)
+
+    async def send_upload_group(
+        self,
+        send: Callable[[list], Awaitable[List[Message]]],
+        uploads: List["SpooledUpload"],
+        kind: str,
+        caption: Optional[str] = None
+    ) -> List[Message]:
+        """
+        Отправляет загруженные в админку файлы одним альбомом через send(media) (send_media_group).
+        kind — photo или document: Telegram не смешивает их в одном альбоме.
+        Уже загружавшиеся файлы идут по file_id, новые file_id запоминаются.
+        Альбом — от 2 файлов: на один файл Telegram ответит ошибкой, и кэш альбома сбросится зря.
+        """
+        if len(uploads) < 2:
+            raise ValueError("send_media_group принимает от 2 файлов — один файл отправляйте через send_upload")
+        media_type = InputMediaPhoto if kind == "photo" else InputMediaDocument
+        hashes = [upload.sha256 for upload in uploads]
+        file_ids = [await self.get_file_id(sha256, kind) for sha256 in hashes]
+
+        def build(use_cache: bool) -> list:
+            return [
+                media_type(
+                    media=(file_id if use_cache and file_id else upload.input_file()),
+                    caption=caption if index == 0 else None
+                )
+                for index, (upload, file_id) in enumerate(zip(uploads, file_ids))
+            ]
+
+        try:
+            sent = await send(build(use_cache=True))
+        except TelegramBadRequest as e:
+            if not any(file_ids):
+                raise
+            logger.warning(f"⚠️ file_id в альбоме больше не действителен, загружаем заново: {e}")
+            for sha256, file_id in zip(hashes, file_ids):
+                if file_id:
+                    await self.forget(sha256, kind)
+            file_ids = [None] * len(uploads)
+            sent = await send(build(use_cache=False))
+
+        for upload, file_id, message in zip(uploads, file_ids, sent):
+            new_file_id = _sent_file_id(message, kind)
+            if new_file_id and new_file_id != file_id:
+                await self.remember(upload.sha256, kind, new_file_id, upload.filename, upload.size)
+        return sent
+
+    async def answer_video(self, message: Message, path: str, **kwargs) -> Message:
+        return await self.send(lambda video: message.answer_video(video=video, **kwargs), path, "video")
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from pydantic import BaseModel
+from pymongo import ASCENDING, ReturnDocument
+
+from config import cnf
+from core.bot import bot
+from core.bot1 import bot1
+from core.logger import api_logger as logger
+from utils.database import get_database, get_database_bot1
+from utils.rate_limit import KeyedRateLimiter, TokenBucket
+
+OUTBOUND_COLLECTION = "outbound_queue"
+
+# scope -> функция получения базы, где лежит запись об отправленном сообщении
+_DATABASES = {
+    "bot": get_database,
+    "bot1": get_database_bot1,
+}
+
+# Ошибки, после которых отправку имеет смысл повторить
+TRANSIENT_ERRORS = (TelegramRetryAfter, TelegramNetworkError, TelegramServerError)
+
+
+def _storable(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметры для очереди: объекты aiogram (клавиатуры) — как dict, бот провалидирует их при отправке"""
+    return {
+        key: value.model_dump(mode="json", exclude_none=True) if isinstance(value, BaseModel) else value
+        for key, value in params.items()
+    }
+
+
+class OutboundDispatcher:
+    """
+    Исходящие сообщения админки в Telegram.
+    Лимит на чат и общий лимит на бота, повторы с паузой при 429 и сетевых ошибках.
+    Сообщения, которые не удалось доставить из-за временных ошибок, попадают в outbound_queue
+    и переотправляются в фоне; после доставки к записи в базе применяется on_delivered.
+    Сессии ботов живут всё время работы админки и закрываются в lifespan.
+    """
+
+    def __init__(self, bots: Dict[str, Bot]):
+        self.bots = bots
+        self._buckets = {scope: TokenBucket(cnf.outbound.RATE) for scope in bots}
+        self._chat_limiter = KeyedRateLimiter(cnf.outbound.PER_CHAT_INTERVAL)
+        self._redelivery_task: Optional[asyncio.Task] = None
+
+    @property
+    def _queue(self):
+        return get_database()[OUTBOUND_COLLECTION]
+
+    async def send(self, scope: str, method: str, chat_id: int, **params) -> Any:
+        """Вызывает метод бота (send_message, send_photo, ...) с лимитами и повторами"""
+        bot_instance = self.bots[scope]
+        bucket = self._buckets[scope]
+        for attempt in range(1, cnf.outbound.MAX_ATTEMPTS + 1):
+            await self._chat_limiter.wait((scope, chat_id))
+            await bucket.acquire()
+            try:
+                return await getattr(bot_instance, method)(chat_id=chat_id, **params)
+
+            except TelegramRetryAfter as e:
+                # 429 — притормаживаем все отправки этого бота
+                logger.warning(f"⏳ Flood control ({scope}), пауза {e.retry_after} сек.")
+                bucket.pause(e.retry_after)
+                if attempt == cnf.outbound.MAX_ATTEMPTS:
+                    raise
+
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == cnf.outbound.MAX_ATTEMPTS:
+                    raise
+                logger.warning(f"⚠️ Ошибка отправки ({scope}, {chat_id}), попытка {attempt}: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def send_or_queue(
+        self,
+        scope: str,
+        method: str,
+        chat_id: int,
+        on_delivered: Optional[Dict[str, Any]] = None,
+        **params
+    ) -> Any:
+        """
+        Как send, но при временной ошибке ставит сообщение в очередь переотправки и возвращает None.
+        Постоянные ошибки (бот заблокирован, неверный запрос) пробрасываются.
+        params должны быть простыми значениями (текст, file_id) или объектами aiogram вроде reply_markup —
+        они сохраняются через model_dump. Загружаемые файлы (InputFile) в очередь не попадут.
+
+        :param on_delivered: {"collection": ..., "filter": ..., "update": ...} — обновление записи
+            о сообщении в базе scope после отложенной доставки
+        """
+        try:
+            return await self.send(scope, method, chat_id, **params)
+        except TRANSIENT_ERRORS as e:
+            await self._queue.insert_one({
+                "scope": scope,
+                "method": method,
+                "chat_id": chat_id,
+                "params": _storable(params),
+                "on_delivered": on_delivered,
+                "status": "pending",
+                "attempts": 0,
+                "last_error": str(e),
+                "next_attempt_at": datetime.now() + timedelta(seconds=cnf.outbound.REDELIVERY_INTERVAL),
+                "created_at": datetime.now()
+            })
+            logger.warning(f"📮 Сообщение для {chat_id} ({scope}) поставлено в очередь переотправки: {e}")
+            return None
+
+    async def _redeliver_one(self, job: dict):
+        try:
+            await self.send(job["scope"], job["method"], job["chat_id"], **job["params"])
+        except TRANSIENT_ERRORS as e:
+            attempts = job["attempts"] + 1
+            failed = attempts >= cnf.outbound.REDELIVERY_MAX_ATTEMPTS
+            delay = cnf.outbound.REDELIVERY_INTERVAL * min(2 ** attempts, 64)
+            await self._queue.update_one({"_id": job["_id"]}, {"$set": {
+                "status": "failed" if failed else "pending",
+                "attempts": attempts,
+                "last_error": str(e),
+                "next_attempt_at": datetime.now() + timedelta(seconds=delay)
+            }})
+            return
+        except TelegramAPIError as e:
+            await self._queue.update_one({"_id": job["_id"]}, {"$set": {"status": "failed", "last_error": str(e)}})
+            logger.error(f"❌ Отложенное сообщение для {job['chat_id']} не доставлено: {e}")
+            return
+
+        on_delivered = job.get("on_delivered")
+        if on_delivered:
+            database = _DATABASES[job["scope"]]()
+            await database[on_delivered["collection"]].update_one(on_delivered["filter"], on_delivered["update"])
+        await self._queue.delete_one({"_id": job["_id"]})
+        logger.info(f"📬 Отложенное сообщение доставлено пользователю {job['chat_id']} ({job['scope']})")
+
+    async def redeliver_due(self) -> int:
+        """Переотправляет сообщения, у которых подошло время; запись берётся с арендой, чтобы не задвоить"""
+        delivered = 0
+        while True:
+            now = datetime.now()
+            job = await self._queue.find_one_and_update(
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"$set": {"next_attempt_at": now + timedelta(seconds=cnf.outbound.REDELIVERY_INTERVAL)}},
+                sort=[("next_attempt_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not job:
+                return delivered
+            await self._redeliver_one(job)
+            delivered += 1
+
+    async def _redelivery_loop(self):
+        await self._queue.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+        while True:
+            try:
+                await self.redeliver_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка очереди переотправки: {e}", exc_info=True)
+            await asyncio.sleep(cnf.outbound.REDELIVERY_INTERVAL)
+
+    def start(self):
+        self._redelivery_task = asyncio.create_task(self._redelivery_loop())
+
+    async def close(self):
+        """Останавливает переотправку. HTTP-сессию ботов закрывает её владелец (web_admin или runner.py)"""
+        if self._redelivery_task:
+            self._redelivery_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._redelivery_task
+            self._redelivery_task = None
+
+
+outbound = OutboundDispatcher({"bot": bot, "bot1": bot1})
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket: не больше rate операций в секунду со всплесками до capacity.
+    pause() блокирует весь бакет (например, после 429 от Telegram).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def pause(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        # Лок даёт FIFO-очередь ожидающих
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class KeyedRateLimiter:
+    """Минимальный интервал между операциями с одним ключом (например, chat_id)"""
+
+    def __init__(self, interval: float, max_keys: int = 100_000):
+        self.interval = interval
+        self.max_keys = max_keys
+        self._next_at: Dict[Hashable, float] = {}
+
+    def _cleanup(self, now: float):
+        self._next_at = {key: at for key, at in self._next_at.items() if at > now}
+
+    async def wait(self, key: Hashable):
+        now = time.monotonic()
+        if len(self._next_at) >= self.max_keys:
+            self._cleanup(now)
+
+        at = max(now, self._next_at.get(key, 0.0))
+        self._next_at[key] = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class SlidingWindowLimiter:
+    """Не больше limit событий с одним ключом за последние window секунд"""
+
+    def __init__(self, limit: int, window: float, max_keys: int = 100_000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events: Dict[Hashable, Deque[float]] = {}
+
+    def _cleanup(self, now: float):
+        self._events = {
+            key: events for key, events in self._events.items()
+            if events and events[-1] > now - self.window
+        }
+
+    def _window(self, key: Hashable, now: float) -> Deque[float]:
+        if len(self._events) >= self.max_keys:
+            self._cleanup(now)
+
+        events = self._events.setdefault(key, deque())
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return events
+
+    def allowed(self, key: Hashable) -> bool:
+        """Есть ли место в окне — без регистрации события"""
+        return len(self._window(key, time.monotonic())) < self.limit
+
+    def hit(self, key: Hashable) -> bool:
+        """Регистрирует событие; False — лимит исчерпан (событие не засчитывается)"""
+        now = time.monotonic()
+        events = self._window(key, now)
+        if len(events) >= self.limit:
+            return False
+        events.append(now)
+        return True
+
+    def retry_after(self, key: Hashable) -> float:
+        """Через сколько секунд освободится место в окне"""
+        events = self._events.get(key)
+        if not events or len(events) < self.limit:
+            return 0.0
+        return max(0.0, events[0] + self.window - time.monotonic())
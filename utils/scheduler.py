@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import cnf
+from core.logger import bot_logger as logger
+from core.sharding import update_user_id
+
+# Ключ в data (kwargs feed_update): вызывается, как только апдейт дошёл до планировщика.
+# Webhook по нему освобождает свой слот — дальше очередь и общий лимит держит планировщик
+ON_SCHEDULED = "on_scheduled"
+
+
+class _UserQueue:
+    """Очередь апдейтов одного пользователя: один выполняется, остальные ждут по порядку"""
+    __slots__ = ("waiters",)
+
+    def __init__(self):
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Планировщик апдейтов (outer middleware на dp.update).
+    Апдейты одного пользователя выполняются строго по очереди (FIFO), разные пользователи —
+    параллельно, но не больше CONCURRENCY одновременно. У пользователя в работе не больше
+    одного апдейта, поэтому активный пользователь не вытесняет остальных.
+    Очередь пользователя создаётся при первом апдейте и удаляется, как только опустеет.
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._queues: Dict[int, _UserQueue] = {}
+        self._semaphore = asyncio.Semaphore(cnf.scheduler.CONCURRENCY)
+        self.waiting = 0
+        self.running = 0
+        self.processed = 0
+        self.dropped = 0
+        self._wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._queues),
+            "waiting": self.waiting,
+            "running": self.running,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "wait_avg_ms": round(self._wait_total / self.processed * 1000, 1) if self.processed else 0,
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+        }
+
+    def _pass_turn(self, user_id: int, queue: _UserQueue):
+        while queue.waiters:
+            waiter = queue.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        del self._queues[user_id]
+
+    async def _wait_turn(self, user_id: int) -> bool:
+        """Ждёт очереди пользователя; False — очередь переполнена и апдейт отброшен"""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            self._queues[user_id] = _UserQueue()
+            return True
+
+        if len(queue.waiters) >= cnf.scheduler.USER_QUEUE_LIMIT:
+            self.dropped += 1
+            logger.warning(f"⚠️ Очередь пользователя {user_id} ({self.scope}) переполнена, апдейт отброшен")
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        self.waiting += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Ход уже передан нам — отдаём его следующему
+                self._pass_turn(user_id, queue)
+            raise
+        finally:
+            self.waiting -= 1
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        on_scheduled = data.pop(ON_SCHEDULED, None)
+        if on_scheduled:
+            on_scheduled()
+
+        user_id = update_user_id(event)
+        enqueued = time.monotonic()
+
+        if not user_id:
+            async with self._semaphore:
+                return await handler(event, data)
+
+        if not await self._wait_turn(user_id):
+            return
+        try:
+            async with self._semaphore:
+                wait = time.monotonic() - enqueued
+                self._wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                self.processed += 1
+                self.running += 1
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.running -= 1
+        finally:
+            self._pass_turn(user_id, self._queues[user_id])
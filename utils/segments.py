@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional
+
+from config import cnf
+from core.logger import bot_1_logger as logger
+from db.beanie_bot1.models import AudienceSnapshot
+from utils.chat_archive import NOT_ARCHIVE_STUB
+from utils.database import get_database_bot1
+
+# Сегменты аудитории рассылки: ключ -> подпись для администратора
+SEGMENTS = {
+    "active": "Писали за последние N дней",
+    "product": "Открывали товар",
+    "unread": "С непрочитанными диалогами",
+}
+
+
+def reachable_filter() -> dict:
+    """Пользователи, которым вообще можно отправлять рассылки"""
+    return {"unreachable": None, "banned": {"$ne": "1"}}
+
+
+def segment_title(segment: Optional[str], param: Optional[int] = None) -> str:
+    if not segment:
+        return "Все пользователи"
+    if segment == "active":
+        return f"Писали за последние {param} дн."
+    if segment == "product":
+        return f"Открывали товар #{param}"
+    return SEGMENTS.get(segment, segment)
+
+
+async def _batched(cursor, field: str) -> AsyncIterator[List[int]]:
+    batch = []
+    async for doc in cursor:
+        batch.append(doc[field])
+        if len(batch) >= cnf.broadcast.BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _candidates(segment: str, param: Optional[int]):
+    """
+    Курсор по кандидатам сегмента и имя поля с id пользователя.
+    Каждый вариант опирается на свой индекс.
+    """
+    db = get_database_bot1()
+
+    if segment == "active":
+        since = datetime.now(timezone.utc) - timedelta(days=param)
+        return db["messages"].aggregate([
+            {"$match": {"from_operator": "0", "date": {"$gte": since}, **NOT_ARCHIVE_STUB}},
+            {"$group": {"_id": "$from_id"}}
+        ], allowDiskUse=True), "_id"
+
+    if segment == "product":
+        return db["users"].find(
+            {"opened_products": param, **reachable_filter()},
+            projection={"id": 1, "_id": 0}
+        ), "id"
+
+    if segment == "unread":
+        return db["chat_dialogs"].find(
+            {"unread_count": {"$gt": 0}},
+            projection={"user_id": 1, "_id": 0}
+        ), "user_id"
+
+    raise ValueError(f"Неизвестный сегмент: {segment}")
+
+
+async def build_snapshot(segment: str, param: Optional[int] = None) -> AudienceSnapshot:
+    """Материализует сегмент в audience_snapshot_members"""
+    db = get_database_bot1()
+    users_collection = db["users"]
+    members_collection = db["audience_snapshot_members"]
+
+    expires_at = datetime.now() + timedelta(days=cnf.broadcast.SNAPSHOT_TTL_DAYS)
+    snapshot = AudienceSnapshot(segment=segment, param=param, expires_at=expires_at)
+    await snapshot.insert()
+
+    cursor, field = _candidates(segment, param)
+    total = 0
+    async for user_ids in _batched(cursor, field):
+        if segment != "product":
+            # Кандидаты из messages/chat_dialogs: отсекаем забаненных и недоступных
+            users = await users_collection.find(
+                {"id": {"$in": user_ids}, **reachable_filter()},
+                projection={"id": 1, "_id": 0}
+            ).to_list(length=None)
+            user_ids = [user["id"] for user in users]
+
+        if not user_ids:
+            continue
+
+        await members_collection.insert_many([
+            {"snapshot_id": snapshot.id, "user_id": user_id, "expires_at": expires_at}
+            for user_id in user_ids
+        ], ordered=False)
+        total += len(user_ids)
+
+    await snapshot.set({AudienceSnapshot.status: "ready", AudienceSnapshot.total: total})
+    logger.info(f"🎯 Снимок сегмента «{segment_title(segment, param)}»: {total} пользователей")
+    return snapshot
+
+
+async def extend_snapshot(snapshot_id) -> bool:
+    """
+    Продлевает TTL снимка и его участников на SNAPSHOT_TTL_DAYS от текущего момента.
+    Вызывается, пока снимок читает рассылка, и при её завершении.
+    False — снимок уже удалён по TTL.
+    """
+    db = get_database_bot1()
+    expires_at = datetime.now() + timedelta(days=cnf.broadcast.SNAPSHOT_TTL_DAYS)
+    result = await db["audience_snapshots"].update_one(
+        {"_id": snapshot_id}, {"$set": {"expires_at": expires_at}}
+    )
+    await db["audience_snapshot_members"].update_many(
+        {"snapshot_id": snapshot_id}, {"$set": {"expires_at": expires_at}}
+    )
+    return bool(result.matched_count)
+
+
+async def get_snapshot(segment: str, param: Optional[int] = None) -> AudienceSnapshot:
+    """Свежий снимок сегмента: переиспользует готовый не старше SEGMENT_MAX_AGE"""
+    fresh_since = datetime.now() - timedelta(seconds=cnf.broadcast.SEGMENT_MAX_AGE)
+    snapshot = await AudienceSnapshot.find(
+        {"segment": segment, "param": param, "status": "ready", "created_at": {"$gte": fresh_since}}
+    ).sort("-created_at").first_or_none()
+    if snapshot:
+        return snapshot
+    return await build_snapshot(segment, param)
+
+
+async def record_product_open(user_id: int, product_id: int):
+    """Запоминает, что пользователь открывал товар (для сегмента product)"""
+    await get_database_bot1()["users"].update_one(
+        {"id": user_id},
+        {"$addToSet": {"opened_products": product_id}}
+    )
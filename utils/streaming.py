@@ -0,0 +1,93 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Iterable, List, Optional
+
+from bson import Decimal128, ObjectId
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# Документов, которые читаются из курсора и отдаются клиенту за раз
+STREAM_BATCH_SIZE = 500
+
+# format=json — как раньше (один массив в памяти), ndjson и array — потоково
+FORMAT_PATTERN = "^(json|ndjson|array)$"
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> dict:
+    """
+    Проекция из параметра fields=a,b,c (не задан — все разрешённые поля).
+    Неизвестное поле — 400, а не молча пустые документы.
+    """
+    allowed = list(allowed)
+    requested = [field.strip() for field in (fields or "").split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    return {field: 1 for field in (requested or allowed)}
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+def dumps(document: dict) -> str:
+    if "_id" in document:
+        document["id"] = str(document.pop("_id"))
+    return json.dumps(document, ensure_ascii=False, default=_default)
+
+
+async def iter_batches(cursor, batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Читает курсор Motor пачками по batch_size: в памяти не больше одной пачки"""
+    batch = []
+    async for document in cursor.batch_size(batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _encode(batches: AsyncIterator[List[dict]], fmt: str) -> AsyncIterator[str]:
+    if fmt == "array":
+        yield "["
+    first = True
+    async for batch in batches:
+        if not batch:
+            continue
+        if fmt == "ndjson":
+            yield "".join(dumps(document) + "\n" for document in batch)
+        else:
+            chunk = ",".join(dumps(document) for document in batch)
+            yield chunk if first else "," + chunk
+        first = False
+    if fmt == "array":
+        yield "]"
+
+
+def stream_documents(
+    cursor,
+    fmt: str,
+    enrich: Optional[Callable[[List[dict]], Any]] = None
+) -> StreamingResponse:
+    """
+    Потоковый ответ из курсора: NDJSON (по документу на строку) или JSON-массив, собираемый на ходу.
+    enrich(batch) — async-функция, дополняющая пачку (например, username из users) перед отдачей.
+    """
+    async def batches():
+        async for batch in iter_batches(cursor):
+            if enrich:
+                await enrich(batch)
+            yield batch
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return StreamingResponse(_encode(batches(), fmt), media_type=media_type)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.context import FSMContext
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from db.beanie.models import SupportSnapshot
+
+# Служебные ключи поддержки в данных FSM — в снимок не попадают, иначе снимки вкладываются друг в друга.
+# original_data — копия всех данных из старых версий бота, встречается в ещё не обновлённых FSM
+SNAPSHOT_KEYS = ("original_state", "original_data", "support_snapshot_id")
+
+
+def compact_data(data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Данные FSM без служебных ключей поддержки"""
+    return {key: value for key, value in (data or {}).items() if key not in SNAPSHOT_KEYS}
+
+
+def content_hash(state: Optional[str], data: Dict[str, Any]) -> str:
+    payload = json.dumps({"state": state, "data": data}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def save_snapshot(user_id: int, state: Optional[str], data: Dict[str, Any]) -> SupportSnapshot:
+    """Сохраняет снимок; если такой уже есть у пользователя (тот же хэш), возвращает существующий"""
+    data = compact_data(data)
+    digest = content_hash(state, data)
+
+    existing = await SupportSnapshot.find_one({"user_id": user_id, "content_hash": digest})
+    if existing:
+        return existing
+
+    last = await SupportSnapshot.find({"user_id": user_id}).sort([("version", DESCENDING)]).limit(1).to_list()
+    snapshot = SupportSnapshot(
+        user_id=user_id,
+        state=state,
+        data=data,
+        content_hash=digest,
+        version=last[0].version + 1 if last else 1
+    )
+    try:
+        await snapshot.insert()
+    except DuplicateKeyError:
+        # Тот же снимок только что сохранил параллельный апдейт
+        return await SupportSnapshot.find_one({"user_id": user_id, "content_hash": digest})
+    return snapshot
+
+
+async def snapshot_fsm(user_id: int, state: FSMContext) -> SupportSnapshot:
+    """
+    Снимок текущего состояния пользователя при обращении в поддержку.
+    В FSM остаются только данные без вложенных копий и ссылка на снимок — размер не растёт от обращения к обращению
+    """
+    current_state = await state.get_state()
+    current_data = compact_data(await state.get_data())
+    snapshot = await save_snapshot(user_id, current_state, current_data if current_state else {})
+
+    await state.set_data({
+        **current_data,
+        "original_state": current_state,
+        "support_snapshot_id": str(snapshot.id)
+    })
+    return snapshot
+
+
+async def load_snapshot(snapshot_id) -> Optional[SupportSnapshot]:
+    if not snapshot_id:
+        return None
+    return await SupportSnapshot.get(snapshot_id)
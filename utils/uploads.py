@@ -0,0 +1,217 @@
+import hashlib
+import mimetypes
+import re
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from aiogram.types import InputFile, Message
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from core.logger import api_logger as logger
+
+if TYPE_CHECKING:
+    from utils.media_registry import MediaRegistry
+
+# Лимит Bot API на отправку файла
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+# Альбом (send_media_group) Telegram принимает только из 2–10 файлов
+MIN_GROUP_SIZE = 2
+MAX_GROUP_SIZE = 10
+CHUNK_SIZE = 256 * 1024
+# Запас на поля формы и заголовки частей multipart
+MULTIPART_OVERHEAD = 1024 * 1024
+# Пометка в истории админки для файла, который не ушёл в Telegram
+UNDELIVERED_MARK = " (не доставлено)"
+
+# Эндпоинты альбомов: до MAX_GROUP_SIZE файлов в запросе, остальные multipart-запросы — один файл
+GROUP_UPLOAD_PATHS = re.compile(r"^/(chats/send/files/|claims/chat/send-files|support/session/[^/]+/send_files)$")
+
+
+def body_limit(path: str) -> int:
+    """Максимальный размер тела multipart-запроса для пути"""
+    files = MAX_GROUP_SIZE if GROUP_UPLOAD_PATHS.match(path) else 1
+    return files * MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+
+
+def _too_large(limit: int) -> str:
+    return f"Запрос слишком большой (макс. {limit // (1024 * 1024)} МБ)"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Ограничивает тело multipart-запросов до разбора формы. Starlette складывает всё тело
+    во временные файлы ещё до вызова хендлера, поэтому проверка размера в хендлере опаздывает.
+    Content-Length больше лимита — сразу 413, тело не читается; без Content-Length
+    тело считается по мере чтения и обрывается с 413, как только перейдёт лимит.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        limit = body_limit(scope["path"])
+        declared = headers.get(b"content-length")
+        if declared and declared.isdigit() and int(declared) > limit:
+            response = JSONResponse({"detail": _too_large(limit)}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI пробрасывает HTTPException из разбора формы как есть
+                    raise HTTPException(status_code=413, detail=_too_large(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class UploadInputFile(InputFile):
+    """Файл из формы админки для Bot API: aiogram читает его кусками прямо из UploadFile, без копий"""
+
+    def __init__(self, file: UploadFile, filename: Optional[str] = None):
+        super().__init__(filename=filename, chunk_size=CHUNK_SIZE)
+        self.file = file
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        # Файл может читаться повторно: при повторе отправки и после неудачи с file_id
+        await self.file.seek(0)
+        while chunk := await self.file.read(self.chunk_size):
+            yield chunk
+
+
+@dataclass
+class SpooledUpload:
+    """Файл из формы админки: Starlette уже держит его в SpooledTemporaryFile, здесь — размер и sha256"""
+    file: UploadFile
+    filename: str
+    size: int
+    sha256: str
+
+    def input_file(self) -> UploadInputFile:
+        return UploadInputFile(self.file, filename=self.filename)
+
+
+@asynccontextmanager
+async def spool_upload(file: UploadFile, filename: str, max_size: int = MAX_UPLOAD_SIZE) -> AsyncIterator[SpooledUpload]:
+    """
+    Считает размер и sha256 загруженного файла, читая его кусками по CHUNK_SIZE.
+    Тело запроса уже ограничено UploadSizeLimitMiddleware, здесь — лимит Bot API на один файл.
+    В Telegram файл потом уходит кусками прямо из загрузки Starlette (upload.input_file()),
+    без копий в памяти и на диске.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while chunk := await file.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Файл слишком большой (макс. {max_size // (1024 * 1024)} МБ)"
+            )
+        digest.update(chunk)
+
+    yield SpooledUpload(file=file, filename=filename, size=size, sha256=digest.hexdigest())
+
+
+@asynccontextmanager
+async def spool_uploads(files: List[UploadFile], max_size: int = MAX_UPLOAD_SIZE) -> AsyncIterator[List[SpooledUpload]]:
+    """
+    spool_upload для нескольких файлов альбома: от MIN_GROUP_SIZE до MAX_GROUP_SIZE, лимит размера — на каждый файл.
+    Один файл — на эндпоинт отправки файла: альбом из одного файла Telegram отклоняет
+    """
+    if len(files) < MIN_GROUP_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"В альбоме должно быть не меньше {MIN_GROUP_SIZE} файлов, один файл отправляйте отдельно"
+        )
+    if len(files) > MAX_GROUP_SIZE:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_GROUP_SIZE} файлов за раз")
+
+    uploads = []
+    for index, file in enumerate(files):
+        async with spool_upload(file, file.filename or f"file_{index + 1}", max_size) as upload:
+            uploads.append(upload)
+    yield uploads
+
+
+def upload_mime_type(file: UploadFile) -> str:
+    return file.content_type or mimetypes.guess_type(file.filename or "")[0] or "application/octet-stream"
+
+
+def album_kind(mime_types: List[str]) -> str:
+    """
+    photo, если все файлы — картинки (кроме svg, которую Telegram как фото не принимает), иначе document:
+    Telegram не смешивает фото и документы в одном альбоме
+    """
+    if all(mime.startswith("image/") and not mime.endswith("svg+xml") for mime in mime_types):
+        return "photo"
+    return "document"
+
+
+@dataclass
+class AlbumItem:
+    """Файл отправленного альбома — для записи в историю чата"""
+    upload: SpooledUpload
+    mime_type: str
+    file_id: str  # пустой, если файл не доставлен
+    caption: str  # подпись альбома — только у первого файла
+
+    @property
+    def delivered(self) -> bool:
+        return bool(self.file_id)
+
+    def text(self, fallback: str = "") -> str:
+        """Текст для истории: подпись или fallback, у недоставленного файла — с UNDELIVERED_MARK"""
+        text = self.caption or fallback
+        return text if self.delivered else text + UNDELIVERED_MARK
+
+
+async def send_upload_album(
+    registry: "MediaRegistry",
+    send: Callable[[list], Awaitable[List[Message]]],
+    files: List[UploadFile],
+    caption: str = ""
+) -> Tuple[str, List[AlbumItem]]:
+    """
+    Отправляет файлы из формы админки одним альбомом через send(media) (send_media_group).
+    Ошибка Telegram не прерывает запрос: файлы возвращаются недоставленными, чтобы их можно было
+    сохранить в истории с пометкой. Возвращает вид альбома (photo / document) и файлы по порядку.
+    """
+    mime_types = [upload_mime_type(file) for file in files]
+    kind = album_kind(mime_types)
+
+    sent: List[Message] = []
+    async with spool_uploads(files) as uploads:
+        if any(upload.size == 0 for upload in uploads):
+            raise HTTPException(status_code=400, detail="Файл пустой")
+        try:
+            sent = await registry.send_upload_group(send, uploads, kind, caption[:1024] or None)
+        except Exception as e:
+            logger.error(f"❌ Telegram отправка альбома не удалась: {e}")
+
+    items = []
+    for index, (upload, mime_type) in enumerate(zip(uploads, mime_types)):
+        msg = sent[index] if index < len(sent) else None
+        if kind == "photo":
+            file_id = msg.photo[-1].file_id if msg and msg.photo else ""
+        else:
+            file_id = msg.document.file_id if msg and msg.document else ""
+        items.append(AlbumItem(
+            upload=upload, mime_type=mime_type, file_id=file_id, caption=caption if index == 0 else ""
+        ))
+    return kind, items
@@ -0,0 +1,228 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from config import cnf
+from core.logger import bot_logger as logger
+from db.beanie.models import ChatSession, SupportSession, User
+from utils.database import get_database, get_database_bot1
+
+INVALIDATION_COLLECTION = "cache_invalidations"
+
+# scope -> функция получения базы, где живут данные пользователя
+_SCOPES = {
+    "bot": get_database,
+    "bot1": get_database_bot1,
+}
+
+
+@dataclass
+class UserContext:
+    """
+    Контекст пользователя на время обработки апдейта.
+    Для бота лотереи user — документ User, для бота-1 — dict из users.
+    Хендлеры могут обновлять поля после своих изменений, чтобы кэш оставался актуальным.
+    """
+    user_id: int
+    user: Any = None
+    banned: bool = False
+    chat_session: Optional[ChatSession] = None
+    support_session: Optional[SupportSession] = None
+
+
+# (scope, user_id) -> (момент устаревания, контекст)
+_cache: Dict[Tuple[str, int], Tuple[float, UserContext]] = {}
+
+# scope, для которых capped-коллекция инвалидаций уже проверена
+_log_ready = set()
+
+# Другие кэши процесса, которые сбрасываются вместе с контекстом (например, FSM)
+_invalidation_callbacks: Dict[str, List[Callable[[int], None]]] = {}
+
+
+async def _load_bot(user_id: int) -> UserContext:
+    user, chat_session, support_session = await asyncio.gather(
+        User.get(tg_id=user_id),
+        ChatSession.find(
+            {"user_id": user_id, "is_active": True}
+        ).sort("-last_interaction").first_or_none(),
+        SupportSession.find(
+            {"user_id": user_id, "resolved": False}
+        ).sort("-created_at").first_or_none(),
+    )
+    return UserContext(
+        user_id=user_id,
+        user=user,
+        banned=bool(user and user.banned),
+        chat_session=chat_session,
+        support_session=support_session
+    )
+
+
+async def _load_bot1(user_id: int) -> UserContext:
+    user = await get_database_bot1()["users"].find_one({"id": user_id})
+    return UserContext(
+        user_id=user_id,
+        user=user,
+        banned=bool(user and user.get("banned") == "1")
+    )
+
+
+_LOADERS = {
+    "bot": _load_bot,
+    "bot1": _load_bot1,
+}
+
+
+async def get_user_context(scope: str, user_id: int) -> UserContext:
+    """Контекст из кэша, при промахе или устаревании — из базы"""
+    key = (scope, user_id)
+    now = time.monotonic()
+    cached = _cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    ctx = await _LOADERS[scope](user_id)
+
+    if len(_cache) >= cnf.cache.USER_MAX_SIZE:
+        # Сначала выбрасываем устаревшие, если не помогло — самые старые записи
+        for stale_key in [k for k, (expires, _) in _cache.items() if expires <= now]:
+            del _cache[stale_key]
+        while len(_cache) >= cnf.cache.USER_MAX_SIZE:
+            del _cache[next(iter(_cache))]
+
+    _cache[key] = (now + cnf.cache.USER_TTL, ctx)
+    return ctx
+
+
+def on_invalidate(scope: str, callback: Callable[[Callable[[int], bool]], None]):
+    """
+    Регистрирует сброс стороннего кэша по событию инвалидации.
+    callback получает условие на user_id и сбрасывает все подходящие записи
+    """
+    _invalidation_callbacks.setdefault(scope, []).append(callback)
+
+
+def invalidate_where(scope: str, matches: Callable[[int], bool]):
+    """Сбрасывает контекст и сторонние кэши всех пользователей scope, для которых matches(user_id)"""
+    for key in [k for k in _cache if k[0] == scope and matches(k[1])]:
+        del _cache[key]
+    for callback in _invalidation_callbacks.get(scope, []):
+        callback(matches)
+
+
+def invalidate(scope: str, user_id: int):
+    _cache.pop((scope, user_id), None)
+    for callback in _invalidation_callbacks.get(scope, []):
+        callback(lambda uid: uid == user_id)
+
+
+async def _invalidation_log(scope: str):
+    """Capped-коллекция с событиями инвалидации; создаётся при первом обращении"""
+    database = _SCOPES[scope]()
+    if scope not in _log_ready:
+        if INVALIDATION_COLLECTION not in await database.list_collection_names():
+            try:
+                await database.create_collection(
+                    INVALIDATION_COLLECTION,
+                    capped=True,
+                    size=cnf.cache.INVALIDATION_LOG_SIZE
+                )
+            except CollectionInvalid:
+                pass
+        _log_ready.add(scope)
+    return database[INVALIDATION_COLLECTION]
+
+
+async def publish_invalidation(scope: str, user_id: int):
+    """
+    Сбрасывает кэш контекста пользователя во всех процессах ботов.
+    Вызывается админкой после бана/разбана, открытия/закрытия сессий
+    и прямых правок aiogram_fsm_states.
+    """
+    invalidate(scope, user_id)
+    try:
+        collection = await _invalidation_log(scope)
+        await collection.insert_one({"user_id": user_id, "created_at": datetime.now()})
+    except Exception as e:
+        # Кэш всё равно устареет через USER_TTL
+        logger.error(f"❌ Не удалось опубликовать инвалидацию {scope}:{user_id}: {e}")
+
+
+async def run_invalidation_listener(scope: str):
+    """Слушает capped-коллекцию инвалидаций (tailable cursor) и чистит локальный кэш"""
+    last_id = None
+    while True:
+        try:
+            collection = await _invalidation_log(scope)
+            if last_id is None:
+                # Старые события не интересны: кэш процесса пока пуст
+                last = await collection.find_one(sort=[("$natural", -1)])
+                last_id = last["_id"] if last else 0
+
+            cursor = collection.find(
+                {"_id": {"$gt": last_id}} if last_id else {},
+                cursor_type=CursorType.TAILABLE_AWAIT
+            )
+            while cursor.alive:
+                async for event in cursor:
+                    last_id = event["_id"]
+                    invalidate(scope, event["user_id"])
+                await asyncio.sleep(0.1)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка слушателя инвалидаций кэша ({scope}): {e}")
+        # Курсор закрывается, пока коллекция пуста, — переоткрываем
+        await asyncio.sleep(1)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает контекст пользователя один раз на апдейт (через кэш)
+    и кладёт его в data["user_ctx"]. Баны здесь не проверяются — см. BannedUserMiddleware.
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = getattr(event, "from_user", None)
+        if not from_user:
+            return await handler(event, data)
+
+        data["user_ctx"] = await get_user_context(self.scope, from_user.id)
+        return await handler(event, data)
+
+
+class BannedUserMiddleware(BaseMiddleware):
+    """
+    Не пускает забаненных пользователей в хендлеры роутера.
+    Вешается только на пользовательские роутеры: админские команды (/reg, /db_stats) работают как раньше
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        ctx: Optional[UserContext] = data.get("user_ctx")
+        if ctx and ctx.banned:
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return
+        return await handler(event, data)
@@ -0,0 +1,81 @@
+"""
+Локальная замена Telegram для режима webhook: шлёт синтетические апдейты на webhook бота.
+
+    python -m utils.webhook_emulator --scope bot --count 1000 --users 50 --text /start
+
+Часть апдейтов отправляется повторно (--duplicates), чтобы проверить отсев по update_id.
+Ответы бота на синтетические чаты Telegram отклонит — это ожидаемо, проверяется приём и обработка.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+import aiohttp
+
+from config import cnf
+from core.webhook import SECRET_HEADER, webhook_path
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        }
+    }
+
+
+async def emulate(url: str, count: int, users: int, text: str, duplicates: float, concurrency: int) -> Counter:
+    first_user = 10 ** 9
+    updates = [
+        make_message_update(update_id, first_user + random.randrange(users), text)
+        for update_id in range(1, count + 1)
+    ]
+    updates += random.sample(updates, int(count * duplicates))
+
+    headers = {SECRET_HEADER: cnf.webhook.SECRET} if cnf.webhook.SECRET else {}
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update: dict):
+            async with semaphore:
+                try:
+                    async with session.post(url, json=update) as response:
+                        statuses[response.status] += 1
+                except aiohttp.ClientError:
+                    statuses["error"] += 1
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Эмулятор Telegram для webhook ботов")
+    parser.add_argument("--scope", choices=["bot", "bot1"], default="bot")
+    parser.add_argument("--url", help="адрес webhook (по умолчанию локальный порт бота)")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--text", default="/start")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="доля повторно отправляемых апдейтов")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    port = cnf.webhook.BOT_PORT if args.scope == "bot" else cnf.webhook.BOT1_PORT
+    url = args.url or f"http://127.0.0.1:{port}{webhook_path(args.scope)}"
+
+    started = time.monotonic()
+    statuses = asyncio.run(emulate(url, args.count, args.users, args.text, args.duplicates, args.concurrency))
+    elapsed = time.monotonic() - started
+    total = sum(statuses.values())
+    print(f"{url}: {total} запросов за {elapsed:.2f} сек. ({total / elapsed:.0f}/сек.), ответы: {dict(statuses)}")
+
+
+if __name__ == "__main__":
+    main()
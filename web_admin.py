@@ -1,12 +1,19 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from api.router.claims import router as claims_router
 from api.router.chats import router as chats_router
 from api.router.payments import router as payments_router
+from api.router.search import router as search_router, backfill_card_last4, backfill_username_lower
 from api.router import auth, main, supports_router
 from db.beanie.models import Administrators
 from utils.database import init_database, check_connection, init_database_bot1, check_connection_bot1
+from config import cnf
+from utils.chat_archive import resume_chat_delete_jobs, run_retention_loop
+from utils.outbound import outbound
+from utils.uploads import UploadSizeLimitMiddleware
+from core.session import session
 
 
 @asynccontextmanager
@@ -25,13 +32,27 @@ async def lifespan(app: FastAPI):
     print(message_main)
     print(message_bot1)
 
+    retention_task = None
     if not success_main or not success_bot1:
         print("❌ Критическая ошибка: не удалось подключиться к базам данных")
+    else:
+        await resume_chat_delete_jobs()
+        await backfill_card_last4()
+        await backfill_username_lower()
+        outbound.start()
+        if cnf.archive.RETENTION_DAYS > 0:
+            retention_task = asyncio.create_task(run_retention_loop())
 
     yield
 
     # Shutdown
     print("🛑 Остановка FastAPI...")
+    if retention_task:
+        retention_task.cancel()
+    await outbound.close()
+    # В runner.py сессия Bot API общая с ботами — её закрывает раннер, когда остановятся все
+    if not getattr(app.state, "shared_bot_session", False):
+        await session.close()
 
 
 app = FastAPI(
@@ -39,12 +60,16 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Лимит тела загрузок файлов — до того, как Starlette запишет его во временные файлы
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.include_router(auth.router)
 app.include_router(main.router)
 app.include_router(claims_router)
 app.include_router(chats_router)
 app.include_router(payments_router)
 app.include_router(supports_router)
+app.include_router(search_router)
 
 # Эндпоинты для проверки
 @app.get("/health")